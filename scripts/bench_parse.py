@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Offline Parse Benchmark
+
+Replays recorded store responses from fixtures/ through each scraper's
+extraction logic with no network access, and reports products/sec, ms per
+page and peak memory per source and HTML parser backend. Each recorded page
+is stored with the products extracted from it when it was recorded, and
+every backend must still extract exactly those products.
+
+Record a corpus (needs network access; DKOldies needs Playwright):
+    python bench_parse.py record --query zelda --query mario --sources all
+
+Run the benchmark and compare against a saved baseline:
+    python bench_parse.py run --baseline fixtures/bench_baseline.json --max_regression 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import tracemalloc
+from contextlib import redirect_stderr
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote_plus
+
+import http_client
+import html_parser
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+MANIFEST_FILE = FIXTURES_DIR / 'manifest.json'
+
+SOURCE_NAMES = ['vgny', 'jjgames', 'lukie-games', 'dkoldies']
+
+def load_manifest():
+    """Load the corpus manifest (a list of recorded pages)."""
+    if not MANIFEST_FILE.exists():
+        return []
+    return json.loads(MANIFEST_FILE.read_text())
+
+def save_manifest(entries):
+    """Write the corpus manifest, sorted for stable diffs."""
+    FIXTURES_DIR.mkdir(parents=True, exist_ok=True)
+    entries = sorted(entries, key=lambda e: (e['source'], e['query']))
+    MANIFEST_FILE.write_text(json.dumps(entries, indent=2) + "\n")
+
+def _slug(query):
+    return ''.join(c if c.isalnum() else '-' for c in query.lower()).strip('-') or 'query'
+
+def _record_page(source, query):
+    """Fetch one search page for a source and return (bytes, extension, url)."""
+    if source == 'vgny':
+        from scrape_vgny import HEADERS
+        url = f"https://videogamesnewyork.com/search.php?search_query={quote_plus(query)}&section=product"
+        response = http_client.get(url, headers=HEADERS, timeout=15)
+        response.raise_for_status()
+        return response.content, 'html', url
+
+    if source == 'lukie-games':
+        from scrape_lukie_games import HEADERS
+        url = f"https://www.lukiegames.com/search.asp?q={quote_plus(query)}"
+        response = http_client.get(url, headers=HEADERS, timeout=10)
+        response.raise_for_status()
+        return response.content, 'html', url
+
+    if source == 'jjgames':
+        from scrape_jjgames import JJGAMES_STORE_ID
+        url = f"https://app.ecwid.com/api/v3/{JJGAMES_STORE_ID}/search?keyword={quote_plus(query)}&limit=100"
+        response = http_client.get(url, headers={'Accept': 'application/json'}, timeout=30)
+        response.raise_for_status()
+        return response.content, 'json', url
+
+    if source == 'dkoldies':
+        # DKOldies renders its grid with JavaScript, so record the rendered DOM
+        from scrape_dkoldies import DKOldiesBrowserPool, _load_search_page
+        url = f"https://www.dkoldies.com/searchresults.html?search_query={quote_plus(query)}"
+
+        async def render():
+            pool = DKOldiesBrowserPool(pool_size=1)
+            try:
+                async with pool.page() as page:
+                    return await _load_search_page(page, url)
+            finally:
+                await pool.close()
+
+        return asyncio.run(render()).encode('utf-8'), 'html', url
+
+    raise ValueError(f"Unknown source: {source}")
+
+def record(queries, sources):
+    """Record search responses for every (source, query) into the corpus."""
+    entries = {(e['source'], e['query']): e for e in load_manifest()}
+
+    for source in sources:
+        for query in queries:
+            try:
+                content, extension, url = _record_page(source, query)
+            except Exception as e:
+                print(f"Could not record {source} '{query}': {str(e)}", file=sys.stderr)
+                continue
+
+            # A bot challenge or a layout the scraper no longer reads would
+            # give the benchmark nothing to measure
+            products = _extract_products(source, content)
+            if not products:
+                print(f"Not recording {source} '{query}': the page has no products", file=sys.stderr)
+                continue
+
+            relative = Path(source) / f"{_slug(query)}.{extension}"
+            expected = Path(source) / f"{_slug(query)}.expected.json"
+            path = FIXTURES_DIR / relative
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+            (FIXTURES_DIR / expected).write_text(json.dumps(products, indent=1, ensure_ascii=False) + "\n")
+
+            entries[(source, query)] = {
+                'source': source,
+                'query': query,
+                'file': str(relative),
+                'expected': str(expected),
+                'url': url,
+                'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            }
+            print(f"Recorded {source} '{query}' ({len(content)} bytes)", file=sys.stderr)
+
+    save_manifest(list(entries.values()))
+
+def _extract_products(source, content):
+    """Extract a page's products with the source's first available backend."""
+    extract, backends = get_extractor(source)
+    with open(os.devnull, 'w') as devnull, redirect_stderr(devnull):
+        return extract(content, backends[0])
+
+def get_extractor(source):
+    """
+    Return (extract, backends) for a source.
+
+    extract(content, backend) runs the scraper's extraction logic on a
+    recorded page. JJGames is JSON, so it only has a single "json" backend.
+    """
+    if source == 'vgny':
+        from scrape_vgny import parse_vgny_products
+        return (lambda content, backend: parse_vgny_products(content, max_results=1000, backend=backend),
+                html_parser.available_backends())
+
+    if source == 'lukie-games':
+        from scrape_lukie_games import parse_lukie_games_products
+        return (lambda content, backend: parse_lukie_games_products(content, max_results=1000, backend=backend),
+                html_parser.available_backends())
+
+    if source == 'dkoldies':
+        from scrape_dkoldies import parse_dkoldies_products
+        return (lambda content, backend: parse_dkoldies_products(content, max_results=1000, backend=backend),
+                html_parser.available_backends())
+
+    if source == 'jjgames':
+        from scrape_jjgames import parse_jjgames_products
+        return (lambda content, backend: parse_jjgames_products(json.loads(content)), ['json'])
+
+    raise ValueError(f"Unknown source: {source}")
+
+def benchmark_source(source, pages, backend, extract, repeat):
+    """Time extraction of every recorded page for one source and backend."""
+    page_times = []
+    product_count = 0
+
+    with open(os.devnull, 'w') as devnull, redirect_stderr(devnull):
+        # Peak memory from a single untimed pass so tracing doesn't skew timings
+        tracemalloc.start()
+        outputs = [extract(content, backend) for content in pages]
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        for content, products in zip(pages, outputs):
+            product_count += len(products)
+            runs = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                extract(content, backend)
+                runs.append(time.perf_counter() - start)
+            page_times.append(statistics.median(runs))
+
+    total_time = sum(page_times)
+    return {
+        'pages': len(pages),
+        'products': product_count,
+        'ms_per_page': round(total_time / len(pages) * 1000, 3),
+        'products_per_sec': round(product_count / total_time, 1) if total_time else 0.0,
+        'peak_memory_kb': round(peak / 1024, 1),
+    }, outputs
+
+def run(sources, backends=None, repeat=10):
+    """
+    Benchmark every source and backend over the recorded corpus.
+
+    Returns:
+        tuple: (results, problems) where results maps "source/backend" to
+        metrics and problems describes every source whose backends
+        disagreed or changed what they extract from a page, that has no
+        recorded pages, or whose pages parse to no products
+    """
+    manifest = load_manifest()
+    results = {}
+    problems = []
+
+    for source in sources:
+        entries = [e for e in manifest if e['source'] == source]
+        pages = [(FIXTURES_DIR / e['file']).read_bytes() for e in entries]
+        if not pages:
+            print(f"No recorded pages for {source}; run 'bench_parse.py record' first", file=sys.stderr)
+            problems.append(f"{source}: no recorded pages")
+            continue
+
+        try:
+            extract, source_backends = get_extractor(source)
+        except ImportError as e:
+            print(f"Skipping {source}: {str(e)}", file=sys.stderr)
+            continue
+
+        if backends and source_backends != ['json']:
+            source_backends = [b for b in source_backends if b in backends]
+
+        reference = None
+        for backend in source_backends:
+            metrics, outputs = benchmark_source(source, pages, backend, extract, repeat)
+            results[f"{source}/{backend}"] = metrics
+
+            # A page that parses to nothing would time an empty loop
+            for entry, products in zip(entries, outputs):
+                if not products:
+                    problems.append(f"{source}/{backend}: {entry['file']} parsed to 0 products")
+                elif entry.get('expected') and (
+                    json.loads(json.dumps(products)) != json.loads((FIXTURES_DIR / entry['expected']).read_text())
+                ):
+                    problems.append(f"{source}/{backend}: {entry['file']} products differ from {entry['expected']}")
+
+            # Every backend must extract exactly the same products
+            serialized = json.dumps(outputs, sort_keys=True)
+            if reference is None:
+                reference = serialized
+            elif serialized != reference:
+                problems.append(f"{source}/{backend}: products differ from {source_backends[0]}")
+
+    return results, problems
+
+def check_regressions(results, baseline, max_regression):
+    """Return descriptions of every result slower than baseline allows."""
+    regressions = []
+    for key, metrics in results.items():
+        if key not in baseline:
+            continue
+        allowed = baseline[key]['ms_per_page'] * (1 + max_regression)
+        if metrics['ms_per_page'] > allowed:
+            regressions.append(
+                f"{key}: {metrics['ms_per_page']} ms/page vs baseline {baseline[key]['ms_per_page']} ms/page"
+            )
+    return regressions
+
+def parse_sources(value):
+    """Parse the --sources argument into a list of source names."""
+    if value == 'all':
+        return list(SOURCE_NAMES)
+    sources = [s.strip() for s in value.split(',') if s.strip()]
+    unknown = [s for s in sources if s not in SOURCE_NAMES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown source(s): {', '.join(unknown)}")
+    return sources
+
+def main():
+    """Main function to handle command line arguments and run the benchmark."""
+    parser = argparse.ArgumentParser(description='Benchmark scraper extraction on recorded store responses.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='Record live search responses into fixtures/')
+    record_parser.add_argument('--query', type=str, action='append', required=True, help='Search term (repeatable)')
+    record_parser.add_argument('--sources', type=parse_sources, default='all', help='Comma-separated sources, or "all"')
+
+    run_parser = subparsers.add_parser('run', help='Benchmark extraction on the recorded corpus')
+    run_parser.add_argument('--sources', type=parse_sources, default='all', help='Comma-separated sources, or "all"')
+    run_parser.add_argument('--backends', type=str, help='Comma-separated HTML parser backends (default: all available)')
+    run_parser.add_argument('--repeat', type=int, default=10, help='Timed runs per page')
+    run_parser.add_argument('--baseline', type=str, help='Baseline JSON file to compare against')
+    run_parser.add_argument('--max_regression', type=float, default=0.2,
+                            help='Allowed slowdown vs baseline as a fraction (default: 0.2)')
+    run_parser.add_argument('--save_baseline', action='store_true', help='Write these results to --baseline')
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.query, args.sources)
+        return
+
+    backends = args.backends.split(',') if args.backends else None
+    results, problems = run(args.sources, backends, args.repeat)
+
+    for key, metrics in results.items():
+        print(f"{key:28} {metrics['ms_per_page']:>9.3f} ms/page {metrics['products_per_sec']:>10.1f} products/s "
+              f"{metrics['peak_memory_kb']:>9.1f} KB peak", file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+    failed = False
+    for problem in problems:
+        print(f"Corpus problem: {problem}", file=sys.stderr)
+        failed = True
+
+    if args.baseline:
+        baseline_path = Path(args.baseline)
+        if args.save_baseline:
+            baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+            print(f"Saved baseline to {baseline_path}", file=sys.stderr)
+        elif baseline_path.exists():
+            regressions = check_regressions(results, json.loads(baseline_path.read_text()), args.max_regression)
+            for regression in regressions:
+                print(f"Regression: {regression}", file=sys.stderr)
+            failed = failed or bool(regressions)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
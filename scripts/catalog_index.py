@@ -0,0 +1,677 @@
+#!/usr/bin/env python3
+"""
+Catalog Index
+
+A local copy of every store's inventory in SQLite, searchable with FTS5 in a
+few milliseconds instead of a live scrape of four sites.
+
+The crawler walks each store with the scrapers' own parsers: the HTML stores
+are searched once per platform (see CRAWL_SEEDS) and paged through to the
+end, and JJGames is read through the Ecwid search API 100 items at a time.
+Each page is written in its own transaction together with a checkpoint, so
+an interrupted crawl resumes from the next page and memory stays bounded by
+one page no matter how large the catalog is. Requests go through
+http_client, so the crawl respects the per-host rate limits and circuit
+breakers. Each page waits for a "crawl" slot from scheduler.py, so the
+crawl gives way to interactive searches between pages. Once a source's
+crawl completes, listings it didn't see again are dropped. A page with no
+product cards and no pagination (a bot challenge or error page) stops the
+crawl at that page instead of ending the seed, so it can't cause listings
+on the pages after it to be dropped. Likewise, when a seed has more pages
+than CRAWL_MAX_PAGES the crawl is marked truncated and drops nothing.
+
+Settings:
+    LOOTSCOUT_CATALOG_DB           Database path (default: ~/.cache/lootscout/catalog.db)
+    LOOTSCOUT_CRAWL_MAX_PAGES      Most pages crawled per seed (default: 200)
+
+Run with --crawl to crawl, --query to search the index, or with no
+arguments to print per-source counts and crawl progress.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+from urllib.parse import quote_plus
+
+import requests
+
+import http_client
+import price_history
+import scheduler
+from html_parser import response_charset
+from pagination import page_count
+from platforms import PLATFORM_KEYWORDS
+from product_ids import fingerprint
+
+CATALOG_DB = Path(os.path.expanduser(os.environ.get('LOOTSCOUT_CATALOG_DB', '~/.cache/lootscout/catalog.db')))
+CRAWL_MAX_PAGES = int(os.environ.get('LOOTSCOUT_CRAWL_MAX_PAGES', '200'))
+
+# Searches that together cover a store's inventory. The HTML stores have no
+# "list everything" page, so they are walked one platform at a time; Ecwid
+# returns the whole catalog for an empty keyword.
+PLATFORM_SEEDS = [keywords[0] for keywords in PLATFORM_KEYWORDS.values()]
+CRAWL_SEEDS = {
+    'vgny': PLATFORM_SEEDS,
+    'jjgames': [''],
+    'lukie-games': PLATFORM_SEEDS,
+    'dkoldies': PLATFORM_SEEDS,
+}
+
+VGNY_SEARCH_URL = "https://videogamesnewyork.com/search.php"
+LUKIE_SEARCH_URL = "https://www.lukiegames.com/search.asp"
+DKOLDIES_SEARCH_URL = "https://www.dkoldies.com/searchresults.html"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    pk INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    source TEXT NOT NULL,
+    title TEXT NOT NULL,
+    platform TEXT,
+    condition TEXT,
+    price_cents INTEGER,
+    currency TEXT,
+    payload TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    last_checked REAL,
+    misses INTEGER NOT NULL DEFAULT 0,
+    quantity INTEGER,
+    price_changes INTEGER NOT NULL DEFAULT 0,
+    price_changed_at REAL,
+    views INTEGER NOT NULL DEFAULT 0,
+    changed_at REAL,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS products_source_seen ON products (source, last_seen);
+CREATE INDEX IF NOT EXISTS products_platform ON products (platform);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    title, content='products', content_rowid='pk', tokenize='unicode61 remove_diacritics 2'
+);
+
+-- Keep the full-text index in step with the products table. Re-crawling an
+-- unchanged listing doesn't touch the index.
+CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts (rowid, title) VALUES (new.pk, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, title) VALUES ('delete', old.pk, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF title ON products
+WHEN old.title IS NOT new.title BEGIN
+    INSERT INTO products_fts (products_fts, rowid, title) VALUES ('delete', old.pk, old.title);
+    INSERT INTO products_fts (rowid, title) VALUES (new.pk, new.title);
+END;
+
+CREATE TABLE IF NOT EXISTS crawl_state (
+    source TEXT PRIMARY KEY,
+    seed_index INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    products_seen INTEGER NOT NULL DEFAULT 0,
+    finished_at REAL,
+    truncated INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Columns used by refresh_scheduler.py: when a listing was last looked for,
+# how often it went missing, stock, repricing, views and sitemap changes;
+# and the content fingerprint that lets unchanged listings skip a rewrite
+_REFRESH_COLUMNS = [
+    ('last_checked', 'REAL'),
+    ('misses', 'INTEGER NOT NULL DEFAULT 0'),
+    ('quantity', 'INTEGER'),
+    ('price_changes', 'INTEGER NOT NULL DEFAULT 0'),
+    ('price_changed_at', 'REAL'),
+    ('views', 'INTEGER NOT NULL DEFAULT 0'),
+    ('changed_at', 'REAL'),
+    ('fingerprint', 'TEXT'),
+]
+
+# Whether a seed of the current crawl had more pages than CRAWL_MAX_PAGES
+_CRAWL_STATE_COLUMNS = [
+    ('truncated', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+_local = threading.local()
+
+def _connect():
+    """Return this thread's connection, creating the database on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and getattr(_local, 'path', None) == CATALOG_DB:
+        return conn
+
+    CATALOG_DB.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(CATALOG_DB), timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    # Keep SQLite's page cache small; the crawl writes far more than it reads
+    conn.execute('PRAGMA cache_size=-8000')
+    conn.executescript(_SCHEMA)
+
+    # Indexes built before refresh scheduling lack its columns, and crawl
+    # state written before truncated seeds were tracked lacks that flag
+    for table, table_columns in (('products', _REFRESH_COLUMNS), ('crawl_state', _CRAWL_STATE_COLUMNS)):
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column, definition in table_columns:
+            if column not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                except sqlite3.OperationalError:
+                    pass  # Another process added it first
+
+    _local.conn = conn
+    _local.path = CATALOG_DB
+    return conn
+
+def _rows(source, products, now):
+    """Turn products into products-table rows, one at a time."""
+    for product in products:
+        if not product.get('url'):
+            continue
+        yield (
+            product['url'], source, product['title'], product.get('platform'), product.get('condition'),
+            product.get('price_cents'), product.get('currency'), json.dumps(product), now, now, now,
+            product.get('quantity'), fingerprint(product),
+        )
+
+# Seeing a listing again resets its misses and change flag, and counts a repricing
+_UPSERT = (
+    "INSERT INTO products (url, source, title, platform, condition, price_cents, currency, payload, "
+    "first_seen, last_seen, last_checked, quantity, fingerprint) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (url) DO UPDATE SET source = excluded.source, title = excluded.title, "
+    "platform = excluded.platform, condition = excluded.condition, "
+    "price_changes = price_changes + (price_cents IS NOT excluded.price_cents), "
+    "price_changed_at = CASE WHEN price_cents IS NOT excluded.price_cents "
+    "THEN excluded.last_seen ELSE price_changed_at END, "
+    "price_cents = excluded.price_cents, currency = excluded.currency, payload = excluded.payload, "
+    "last_seen = excluded.last_seen, last_checked = excluded.last_checked, misses = 0, changed_at = NULL, "
+    "quantity = COALESCE(excluded.quantity, quantity), fingerprint = excluded.fingerprint"
+)
+
+# A listing whose fingerprint hasn't changed only has its bookkeeping updated
+_TOUCH = (
+    "UPDATE products SET last_seen = ?, last_checked = ?, misses = 0, changed_at = NULL "
+    "WHERE url = ?"
+)
+
+# Bound on SQL variables per fingerprint lookup
+_LOOKUP_BATCH = 500
+
+def _write(conn, source, products, now):
+    """
+    Write products inside the caller's transaction. Listings already stored
+    with the same fingerprint are only touched: their payload isn't
+    serialized or rewritten.
+
+    Returns:
+        tuple: (products written, products whose content changed)
+    """
+    products = [product for product in products if product.get('url')]
+    stored = {}
+    for start in range(0, len(products), _LOOKUP_BATCH):
+        urls = [product['url'] for product in products[start:start + _LOOKUP_BATCH]]
+        stored.update(conn.execute(
+            f"SELECT url, fingerprint FROM products WHERE url IN ({','.join('?' * len(urls))})", urls
+        ))
+
+    changed = [product for product in products if stored.get(product['url']) != fingerprint(product)]
+    if len(changed) < len(products):
+        changed_urls = {product['url'] for product in changed}
+        conn.executemany(_TOUCH, [
+            (now, now, product['url']) for product in products if product['url'] not in changed_urls
+        ])
+    conn.executemany(_UPSERT, _rows(source, changed, now))
+    return len(products), len(changed)
+
+def upsert(source, products):
+    """
+    Add or refresh products in the index (e.g. from a live search).
+
+    Args:
+        source (str): Source name
+        products (iterable): Product dictionaries
+
+    Returns:
+        int: Number of products written
+    """
+    conn = _connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        written, _ = _write(conn, source, products, time.time())
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return written
+
+def record_views(urls):
+    """
+    Count index search hits, so often-viewed listings are refreshed sooner.
+
+    Args:
+        urls (iterable): URLs of the products returned to a user
+    """
+    rows = [(url,) for url in urls]
+    if not rows:
+        return
+    try:
+        conn = _connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany("UPDATE products SET views = views + 1 WHERE url = ?", rows)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    except sqlite3.Error as e:
+        # A busy index shouldn't fail the search that viewed it
+        print(f"Could not record catalog views: {str(e)}", file=sys.stderr)
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+def match_expression(query):
+    """
+    Build an FTS5 query matching every word of a search as a prefix.
+
+    Words are quoted, so FTS5 operators typed into a search box are treated
+    as plain text.
+    """
+    return ' '.join(f'"{token}"*' for token in _TOKEN.findall(query.lower()))
+
+def search(query, platform=None, sources=None, max_results=16, min_cents=None, max_cents=None):
+    """
+    Search the index.
+
+    Args:
+        query (str): Search term
+        platform (str, optional): Game platform (e.g., 'ps1', 'snes'); matches
+            the detected platform or, like the scrapers, the title
+        sources (list, optional): Source names to include (defaults to all)
+        max_results (int, optional): Maximum number of results to return
+        min_cents (int, optional): Lowest price to include, in cents
+        max_cents (int, optional): Only include prices below this, in cents
+
+    Returns:
+        list: Product dictionaries, best match first, each with its
+        "source_key" (source name) and an "indexed_at" timestamp of when it
+        was last seen in the store
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+
+    sql = ("SELECT p.payload, p.source, p.last_seen FROM products_fts JOIN products p ON p.pk = products_fts.rowid "
+           "WHERE products_fts MATCH ?")
+    params = [expression]
+    if platform:
+        sql += " AND (p.platform = ? OR instr(lower(p.title), ?) > 0)"
+        params += [platform.lower(), platform.lower()]
+    if sources:
+        sql += f" AND p.source IN ({','.join('?' * len(sources))})"
+        params += list(sources)
+    if min_cents is not None:
+        sql += " AND p.price_cents >= ?"
+        params.append(min_cents)
+    if max_cents is not None:
+        sql += " AND p.price_cents < ?"
+        params.append(max_cents)
+    sql += " ORDER BY bm25(products_fts) LIMIT ?"
+    params.append(max_results)
+
+    try:
+        rows = _connect().execute(sql, params).fetchall()
+    except sqlite3.Error as e:
+        print(f"Catalog search failed: {str(e)}", file=sys.stderr)
+        return []
+    return [
+        {**json.loads(payload), 'source_key': source, 'indexed_at': last_seen}
+        for payload, source, last_seen in rows
+    ]
+
+def listings(sources=None):
+    """
+    Return every indexed listing's searchable fields.
+
+    Args:
+        sources (list, optional): Source names to include (defaults to all)
+
+    Returns:
+        list: (url, source, title, platform, condition, price_cents) tuples
+    """
+    sql = "SELECT url, source, title, platform, condition, price_cents FROM products"
+    params = []
+    if sources:
+        sql += f" WHERE source IN ({','.join('?' * len(sources))})"
+        params = list(sources)
+    return _connect().execute(sql, params).fetchall()
+
+def _fetch_vgny(seed, page):
+    """Fetch one VGNY crawl page, returning (products, page count, card stats)."""
+    from scrape_vgny import HEADERS, iter_vgny_products
+    response = http_client.get(VGNY_SEARCH_URL, params={'search_query': seed, 'section': 'product', 'page': page},
+                               headers=HEADERS, timeout=15)
+    response.raise_for_status()
+    encoding = response_charset(response)
+    stats = {}
+    return (iter_vgny_products(response.content, None, None, encoding=encoding, stats=stats),
+            page_count(response.content, encoding=encoding), stats)
+
+def _fetch_jjgames(seed, page):
+    """Fetch one page of the Ecwid catalog, returning (products, page count, card stats)."""
+    from scrape_jjgames import API_HEADERS, ECWID_PAGE_LIMIT, JJGAMES_STORE_ID, iter_jjgames_products
+    offset = (page - 1) * ECWID_PAGE_LIMIT
+    url = (f"https://app.ecwid.com/api/v3/{JJGAMES_STORE_ID}/search?keyword={quote_plus(seed)}"
+           f"&limit={ECWID_PAGE_LIMIT}&offset={offset}")
+    response = http_client.get(url, headers=API_HEADERS, timeout=30)
+    response.raise_for_status()
+    data = response.json()
+    # A total of 0 gives 0 pages: Ecwid itself says the seed has no matches
+    pages = (int(data.get('total', 0)) + ECWID_PAGE_LIMIT - 1) // ECWID_PAGE_LIMIT
+    return with_ecwid_quantities(data, iter_jjgames_products(data)), pages, {'cards': len(data.get('items', []))}
+
+def with_ecwid_quantities(data, products):
+    """
+    Add Ecwid's stock counts to JJGames products for the index.
+
+    Ecwid reports a quantity for every item that isn't unlimited; the refresh
+    scheduler uses it to re-check nearly sold-out listings sooner.
+
+    Args:
+        data (dict): Decoded Ecwid search response
+        products (iterable): Products built from that response
+
+    Yields:
+        dict: Products, with "quantity" set when Ecwid tracks stock
+    """
+    quantities = {
+        f"https://www.jjgames.com/#!/~/product/{item.get('id')}": item.get('quantity')
+        for item in data.get('items', [])
+        if not item.get('unlimited', True) and item.get('quantity') is not None
+    }
+    for product in products:
+        if product['url'] in quantities:
+            product = {**product, 'quantity': quantities[product['url']]}
+        yield product
+
+def _fetch_lukie_games(seed, page):
+    """Fetch a LukieGames search; every match is on the one page."""
+    from scrape_lukie_games import HEADERS, iter_lukie_games_products
+    response = http_client.get(f"{LUKIE_SEARCH_URL}?q={quote_plus(seed)}", headers=HEADERS, timeout=10)
+    response.raise_for_status()
+    stats = {}
+    return (iter_lukie_games_products(response.content, None, None, encoding=response_charset(response), stats=stats),
+            1, stats)
+
+async def _fetch_dkoldies(seed, page):
+    """Render one DKOldies crawl page on the browser pool."""
+    from circuit_breaker import CircuitOpenError, get_breaker
+    from rate_limiter import acquire_async
+    from scrape_dkoldies import DKOLDIES_HOST, MAX_RATE_LIMIT_WAIT, _load_pooled_page, iter_dkoldies_products
+
+    await acquire_async(DKOLDIES_HOST, max_wait=MAX_RATE_LIMIT_WAIT)
+    breaker = get_breaker(DKOLDIES_HOST)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {DKOLDIES_HOST}; skipping request")
+    try:
+        content = await _load_pooled_page(f"{DKOLDIES_SEARCH_URL}?search_query={quote_plus(seed)}&page={page}")
+    except Exception as e:
+        breaker.record_failure()
+        raise requests.ConnectionError(str(e)) from e
+    except BaseException:
+        breaker.release_trial()
+        raise
+    breaker.record_success()
+    stats = {}
+    return iter_dkoldies_products(content, None, None, stats=stats), page_count(content), stats
+
+class EmptyPageError(Exception):
+    """Raised for a crawl page with no product cards and no pagination."""
+
+CRAWL_FETCHERS = {
+    'vgny': _fetch_vgny,
+    'jjgames': _fetch_jjgames,
+    'lukie-games': _fetch_lukie_games,
+    'dkoldies': _fetch_dkoldies,
+}
+
+def _load_checkpoint(source, restart=False):
+    """Return (seed_index, page, started_at) to crawl from, starting over if needed."""
+    conn = _connect()
+    row = conn.execute(
+        "SELECT seed_index, page, started_at, finished_at FROM crawl_state WHERE source = ?", (source,)
+    ).fetchone()
+    if row is not None and row[3] is None and not restart:
+        return row[0], row[1], row[2]
+
+    now = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO crawl_state (source, seed_index, page, started_at, updated_at) "
+        "VALUES (?, 0, 1, ?, ?)",
+        (source, now, now),
+    )
+    return 0, 1, now
+
+def _ingest_page(source, products, stats, seed_index, page, pages):
+    """
+    Write one crawled page and the checkpoint after it in one transaction.
+
+    Args:
+        source (str): Source name
+        products (iterable): The page's products, parsed as they are read
+        stats (dict): Filled with the page's product card count ("cards")
+            as the products are parsed
+        seed_index (int): Seed the page belongs to
+        page (int): Page number within the seed
+        pages (int): Page count reported by the store
+
+    Returns:
+        tuple: (products written, products whose content changed, next
+        seed_index, next page)
+
+    Raises:
+        EmptyPageError: If the page has no product cards and no pagination
+    """
+    # Only this page is ever held in memory
+    now = time.time()
+    products = [product for product in products if product.get('url')]
+
+    # A results page with no cards at all and no pagination is a bot
+    # challenge or an error page, not the end of the seed. Moving past it
+    # would let _finish_crawl drop every listing on the pages skipped.
+    if not stats.get('cards') and pages == 1:
+        raise EmptyPageError(f"page {page} has no product cards")
+    price_history.record(products, now)
+
+    # Move on to the next seed after the last page the store reports. Pages
+    # whose cards were all filtered out (e.g. sold out) don't end the seed.
+    # A seed cut off at CRAWL_MAX_PAGES leaves listings unseen, so the crawl
+    # is marked truncated and _finish_crawl won't drop anything.
+    truncated = page >= CRAWL_MAX_PAGES and pages > CRAWL_MAX_PAGES
+    if page >= min(pages, CRAWL_MAX_PAGES):
+        seed_index, page = seed_index + 1, 1
+    else:
+        page += 1
+
+    conn = _connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        written, changed = _write(conn, source, products, now)
+        conn.execute(
+            "UPDATE crawl_state SET seed_index = ?, page = ?, updated_at = ?, pages_done = pages_done + 1, "
+            "products_seen = products_seen + ?, truncated = MAX(truncated, ?) WHERE source = ?",
+            (seed_index, page, now, written, int(truncated), source),
+        )
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return written, changed, seed_index, page
+
+def _finish_crawl(source, started_at):
+    """
+    Mark a crawl finished and drop listings it didn't see.
+
+    A truncated crawl didn't read every page, so it drops nothing.
+
+    Returns:
+        tuple: (listings removed, whether the crawl read every page)
+    """
+    conn = _connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        truncated = conn.execute("SELECT truncated FROM crawl_state WHERE source = ?", (source,)).fetchone()[0]
+        removed = 0
+        if not truncated:
+            removed = conn.execute(
+                "DELETE FROM products WHERE source = ? AND last_seen < ?", (source, started_at)
+            ).rowcount
+        conn.execute("UPDATE crawl_state SET finished_at = ? WHERE source = ?", (time.time(), source))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return removed, not truncated
+
+async def crawl_source(source, restart=False, max_pages=None):
+    """
+    Crawl one store into the index, resuming from its last checkpoint.
+
+    Args:
+        source (str): Source name (a key of CRAWL_FETCHERS)
+        restart (bool, optional): Ignore an unfinished crawl and start over
+        max_pages (int, optional): Stop after this many pages; the next
+            crawl picks up where this one stopped
+
+    Returns:
+        dict: {"pages", "products", "changed", "removed", "finished",
+        "complete"}; "complete" is False when a seed had more pages than
+        CRAWL_MAX_PAGES, in which case nothing was removed
+    """
+    fetch = CRAWL_FETCHERS[source]
+    seeds = CRAWL_SEEDS[source]
+    seed_index, page, started_at = await asyncio.to_thread(_load_checkpoint, source, restart)
+    report = {'pages': 0, 'products': 0, 'changed': 0, 'removed': 0, 'finished': False, 'complete': False}
+
+    while seed_index < len(seeds):
+        if max_pages is not None and report['pages'] >= max_pages:
+            return report
+
+        try:
+            # One crawl slot per page, so interactive searches get in between pages
+            async with scheduler.slot(source, 'crawl', 'crawl'):
+                if asyncio.iscoroutinefunction(fetch):
+                    products, pages, stats = await fetch(seeds[seed_index], page)
+                else:
+                    products, pages, stats = await asyncio.to_thread(fetch, seeds[seed_index], page)
+
+            # Parsing happens here, off the event loop, as the rows are written
+            written, changed, next_seed, next_page = await asyncio.to_thread(
+                _ingest_page, source, products, stats, seed_index, page, pages
+            )
+        except (requests.RequestException, EmptyPageError) as e:
+            # The store is down, blocking or rate limiting us; the checkpoint
+            # still points at this page, so the next crawl retries it
+            print(f"Crawl of {source} stopped at '{seeds[seed_index]}' page {page}: {str(e)}", file=sys.stderr)
+            return report
+
+        report['pages'] += 1
+        report['products'] += written
+        report['changed'] += changed
+        print(f"Crawled {source} '{seeds[seed_index]}' page {page}/{pages}: {written} products, "
+              f"{changed} changed", file=sys.stderr)
+        seed_index, page = next_seed, next_page
+
+    report['removed'], report['complete'] = await asyncio.to_thread(_finish_crawl, source, started_at)
+    report['finished'] = True
+    if not report['complete']:
+        print(f"Crawl of {source} hit LOOTSCOUT_CRAWL_MAX_PAGES ({CRAWL_MAX_PAGES}) on a seed; "
+              f"no listings were dropped", file=sys.stderr)
+    return report
+
+async def crawl(sources=None, restart=False, max_pages=None):
+    """
+    Crawl several stores at once, each at its own host's rate limit.
+
+    Returns:
+        dict: source -> crawl_source report
+    """
+    sources = list(sources or CRAWL_FETCHERS.keys())
+    try:
+        reports = await asyncio.gather(*[crawl_source(source, restart, max_pages) for source in sources],
+                                       return_exceptions=True)
+    finally:
+        if 'dkoldies' in sources:
+            from scrape_dkoldies import close_browser_pool
+            await close_browser_pool()
+    return {
+        source: report if not isinstance(report, BaseException) else {'error': str(report)}
+        for source, report in zip(sources, reports)
+    }
+
+def catalog_stats():
+    """
+    Report per-source product counts and crawl progress.
+
+    Returns:
+        dict: source -> {"products", "crawl": {...} or None}
+    """
+    conn = _connect()
+    report = {source: {'products': 0, 'crawl': None} for source in CRAWL_FETCHERS}
+    for source, count in conn.execute("SELECT source, COUNT(*) FROM products GROUP BY source"):
+        report.setdefault(source, {'products': 0, 'crawl': None})['products'] = count
+    for (source, seed_index, page, started_at, updated_at, pages_done, products_seen, finished_at,
+         truncated) in conn.execute(
+        "SELECT source, seed_index, page, started_at, updated_at, pages_done, products_seen, finished_at, "
+        "truncated FROM crawl_state"
+    ):
+        report.setdefault(source, {'products': 0, 'crawl': None})['crawl'] = {
+            'seed': seed_index,
+            'seeds': len(CRAWL_SEEDS.get(source, [])),
+            'page': page,
+            'pages_done': pages_done,
+            'products_seen': products_seen,
+            'started_at': started_at,
+            'updated_at': updated_at,
+            'finished_at': finished_at,
+            'truncated': bool(truncated),
+        }
+    return report
+
+def main():
+    """Crawl, search or report on the catalog index."""
+    parser = argparse.ArgumentParser(description='Crawl and search the local catalog index.')
+    parser.add_argument('--crawl', action='store_true', help='Crawl stores into the index')
+    parser.add_argument('--sources', type=str, default='all',
+                        help='Comma-separated sources to crawl or search, or "all"')
+    parser.add_argument('--restart', action='store_true', help='Start the crawl over instead of resuming')
+    parser.add_argument('--max_pages', type=int, help='Stop each source after this many pages')
+    parser.add_argument('--query', type=str, help='Search the index')
+    parser.add_argument('--platform', type=str, help='Game platform (e.g., ps1, snes)')
+    parser.add_argument('--max_results', type=int, default=16, help='Maximum number of results')
+
+    args = parser.parse_args()
+    sources = None if args.sources == 'all' else [s.strip() for s in args.sources.split(',') if s.strip()]
+
+    if args.crawl:
+        print(json.dumps(asyncio.run(crawl(sources, args.restart, args.max_pages)), indent=2))
+    elif args.query:
+        start = time.perf_counter()
+        products = search(args.query, args.platform, sources, args.max_results)
+        print(f"{len(products)} results in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+        print(json.dumps(products))
+    else:
+        print(json.dumps(catalog_stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
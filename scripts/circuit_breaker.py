@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Circuit Breakers
+
+One breaker per store host, shared by everything in the process. After
+`failure_threshold` consecutive failures (connection errors, timeouts, 5xx)
+the breaker opens and requests to that host fail immediately instead of
+waiting out timeouts and retries. After `reset_timeout` seconds it lets a
+single trial request through (half-open): success closes it again, failure
+re-opens it for another `reset_timeout`.
+
+Settings:
+    LOOTSCOUT_BREAKER_FAILURES  Consecutive failures before opening (default: 5)
+    LOOTSCOUT_BREAKER_RESET     Seconds to stay open before a trial (default: 30)
+
+Per-host overrides live in BREAKER_SETTINGS.
+"""
+
+import os
+import sys
+import time
+import json
+import threading
+
+import requests
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+DEFAULT_FAILURE_THRESHOLD = int(os.environ.get('LOOTSCOUT_BREAKER_FAILURES', '5'))
+DEFAULT_RESET_TIMEOUT = float(os.environ.get('LOOTSCOUT_BREAKER_RESET', '30'))
+
+# Host -> breaker settings. A DKOldies failure costs a browser page and a
+# 10s+ wait, so it trips sooner and stays open longer.
+BREAKER_SETTINGS = {
+    'www.dkoldies.com': {'failure_threshold': 3, 'reset_timeout': 60},
+}
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of making a request to a host whose breaker is open."""
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker for one host."""
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout=DEFAULT_RESET_TIMEOUT, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._trial_started_at = 0.0
+        self._counters = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def _update_state(self):
+        """Move an open breaker to half-open once its reset timeout passes."""
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._trial_calls = 0
+
+    @property
+    def state(self):
+        """Current state, without using up a half-open trial call."""
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def is_open(self):
+        """Return True if requests would be rejected right now."""
+        with self._lock:
+            self._update_state()
+            if self._state == HALF_OPEN:
+                return (self._trial_calls >= self.half_open_max_calls
+                        and time.monotonic() - self._trial_started_at < self.reset_timeout)
+            return self._state == OPEN
+
+    def allow(self):
+        """
+        Ask to make a request.
+
+        Returns:
+            bool: True if the request may go ahead; it must then be followed
+            by record_success(), record_failure() or release_trial()
+        """
+        with self._lock:
+            self._update_state()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN:
+                # A trial that never reported back (e.g. it was cancelled)
+                # frees its slot after another reset_timeout
+                now = time.monotonic()
+                if self._trial_calls >= self.half_open_max_calls and now - self._trial_started_at >= self.reset_timeout:
+                    self._trial_calls = 0
+                if self._trial_calls < self.half_open_max_calls:
+                    self._trial_calls += 1
+                    self._trial_started_at = now
+                    return True
+            self._counters['rejected'] += 1
+            return False
+
+    def record_success(self):
+        """Record a successful request, closing a half-open breaker."""
+        with self._lock:
+            self._counters['successes'] += 1
+            self._failures = 0
+            self._state = CLOSED
+
+    def release_trial(self):
+        """
+        Give back a half-open trial slot for a request that ended without
+        hearing from the host (e.g. it was cancelled), leaving the state as is.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and self._trial_calls > 0:
+                self._trial_calls -= 1
+
+    def record_failure(self):
+        """Record a failed request, opening the breaker past the threshold."""
+        with self._lock:
+            self._counters['failures'] += 1
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._counters['opened'] += 1
+                    print(f"Circuit for {self.name} opened after {self._failures} failure(s)", file=sys.stderr)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        """Return the breaker's state and counters."""
+        with self._lock:
+            self._update_state()
+            return {'state': self._state, 'consecutive_failures': self._failures, **self._counters}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name):
+    """Return the breaker for a host, creating it on first use."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, **BREAKER_SETTINGS.get(name, {}))
+                _breakers[name] = breaker
+    return breaker
+
+def is_open(name):
+    """Return True if the named breaker exists and is open."""
+    breaker = _breakers.get(name)
+    return breaker is not None and breaker.is_open()
+
+def breaker_stats():
+    """Return state and counters for every breaker, keyed by host."""
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
+
+if __name__ == "__main__":
+    print(json.dumps({
+        'failure_threshold': DEFAULT_FAILURE_THRESHOLD,
+        'reset_timeout': DEFAULT_RESET_TIMEOUT,
+        'overrides': BREAKER_SETTINGS,
+    }, indent=2))
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Deal Scoring
+
+Ranks listings by how good a deal they are against what the same game
+usually sells for.
+
+Listings are grouped into games with entity_resolution, so "Zelda OOT
+N64" and "Legend of Zelda Ocarina of Time - Nintendo 64" share a baseline;
+products outside the catalog are placed in a group with
+entity_resolution.match_group. Each group's baseline is the median and median
+absolute deviation (MAD) of the prices observed over the last
+BASELINE_DAYS. The observations come from the price history
+(price_history.py) plus the catalog index's current prices, with at most
+one observation per listing per day, so a listing searched a hundred times
+counts no more than one that was crawled once. A listing's deal_score is
+its robust z-score against its group:
+
+    deal_score = (median - price) / max(1.4826 * MAD, 5% of median, $1)
+
+0 is a typical price, 1 is one standard deviation cheaper than usual, and
+negative scores are above the usual price. Groups with fewer than
+MIN_OBSERVATIONS prices get no score (None).
+
+Medians and MADs for every group are computed at once: observations are
+sorted by (group, price) and each group's middle element is picked by
+index arithmetic, so building a baseline and scoring listings are a few
+array operations regardless of how many groups there are; grouping the
+catalog's titles is most of a baseline's cost. Baselines are rebuilt at
+most every BASELINE_TTL seconds per process.
+
+Settings:
+    LOOTSCOUT_DEAL_BASELINE_DAYS  Days of price history in a baseline (default: 90)
+    LOOTSCOUT_DEAL_BASELINE_TTL   Seconds a baseline is reused (default: 600)
+
+Requires NumPy (see requirements.txt); without it every deal_score is None
+and the first search says so on stderr. Run directly to list the best deals in the catalog index.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import catalog_index
+import entity_resolution
+import price_history
+from prices import MISSING_CENTS
+
+BASELINE_DAYS = float(os.environ.get('LOOTSCOUT_DEAL_BASELINE_DAYS', '90'))
+BASELINE_TTL = float(os.environ.get('LOOTSCOUT_DEAL_BASELINE_TTL', '600'))
+
+# Fewest prices a group needs before its listings are scored
+MIN_OBSERVATIONS = 3
+
+# MAD * MAD_SCALE estimates the standard deviation of normally distributed
+# prices. Groups whose prices barely vary still get a spread of at least
+# MIN_SPREAD_FRACTION of the median or MIN_SPREAD_CENTS, so a $0.50
+# discount doesn't score as a huge outlier.
+MAD_SCALE = 1.4826
+MIN_SPREAD_FRACTION = 0.05
+MIN_SPREAD_CENTS = 100
+
+_baseline = None
+_baseline_lock = threading.Lock()
+
+# Whether get_baseline has reported that NumPy is missing
+_reported_missing_numpy = False
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("deal_scoring requires numpy")
+
+def group_medians(codes, values, groups):
+    """
+    Compute the median of values within each group, without a per-group loop.
+
+    Args:
+        codes (ndarray): Group index (0 to groups - 1) of each value
+        values (ndarray): Values
+        groups (int): Number of groups
+
+    Returns:
+        tuple: (medians, counts) arrays of length groups; groups without
+        values have a NaN median
+    """
+    order = np.lexsort((values, codes))
+    sorted_values = values[order].astype(np.float64)
+    counts = np.bincount(codes, minlength=groups)
+    starts = np.cumsum(counts) - counts
+
+    medians = np.full(groups, np.nan)
+    present = counts > 0
+    lower = (starts + (counts - 1) // 2)[present]
+    upper = (starts + counts // 2)[present]
+    medians[present] = (sorted_values[lower] + sorted_values[upper]) / 2
+    return medians, counts
+
+def build_baseline(now=None, sources=None):
+    """
+    Build per-group price baselines from the catalog index and price history.
+
+    Args:
+        now (float, optional): End of the baseline window (defaults to time.time())
+        sources (list, optional): Source names to include (defaults to all)
+
+    Returns:
+        dict: {"groups": entity_resolution.index_groups of the rows,
+        "median", "mad", "count" (arrays by group), "listings": catalog rows,
+        "listing_groups": group of each row, "built_at"}
+    """
+    _require_numpy()
+    now = time.time() if now is None else now
+    rows = catalog_index.listings(sources)
+
+    groups = entity_resolution.index_groups(
+        [(title, platform, condition) for _, _, title, platform, condition, _ in rows],
+        entity_resolution.get_corpus())
+    listing_groups = np.array(groups['assignments'], dtype=np.int64)
+    listing_ids = np.fromiter((price_history.product_key({'url': row[0]}) for row in rows),
+                              dtype=np.int64, count=len(rows))
+    listing_prices = np.fromiter((MISSING_CENTS if row[5] is None else row[5] for row in rows),
+                                 dtype=np.int64, count=len(rows))
+
+    # Observed prices in the window, matched to their listing's group
+    try:
+        observed = price_history.query(start=now - BASELINE_DAYS * 86400, end=now + 1)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Could not read price history: {str(e)}", file=sys.stderr)
+        observed = None
+    if observed is not None and len(observed['product_id']) and len(rows):
+        order = np.argsort(listing_ids)
+        positions = np.searchsorted(listing_ids[order], observed['product_id'])
+        positions = np.minimum(positions, len(order) - 1)
+        matched = (listing_ids[order][positions] == observed['product_id']) & observed['in_stock']
+        ids = np.concatenate([observed['product_id'][matched], listing_ids])
+        days = np.concatenate([observed['timestamp'][matched] // 86400,
+                               np.full(len(rows), int(now) // 86400, dtype=np.int64)])
+        codes = np.concatenate([listing_groups[order[positions[matched]]], listing_groups])
+        prices = np.concatenate([observed['price_cents'][matched].astype(np.int64), listing_prices])
+    else:
+        ids, days = listing_ids, np.full(len(rows), int(now) // 86400, dtype=np.int64)
+        codes, prices = listing_groups, listing_prices
+
+    # One price per listing per day
+    priced = prices != MISSING_CENTS
+    ids, days, codes, prices = ids[priced], days[priced], codes[priced], prices[priced]
+    _, first = np.unique(np.stack([ids, days]), axis=1, return_index=True)
+    codes, prices = codes[first], prices[first]
+
+    medians, counts = group_medians(codes, prices, groups['groups'])
+    deviations = np.abs(prices - medians[codes])
+    mads, _ = group_medians(codes, deviations, groups['groups'])
+
+    return {
+        'groups': groups,
+        'median': medians,
+        'mad': mads,
+        'count': counts,
+        'listings': rows,
+        'listing_groups': listing_groups,
+        'built_at': now,
+    }
+
+def get_baseline(max_age=None):
+    """
+    Return this process's baseline, rebuilding it when older than max_age.
+
+    Returns:
+        dict: See build_baseline, or None without NumPy or if the catalog
+        can't be read
+    """
+    global _baseline, _reported_missing_numpy
+    if np is None:
+        if not _reported_missing_numpy:
+            _reported_missing_numpy = True
+            print("Deal scores are not being computed: numpy is not installed", file=sys.stderr)
+        return None
+    max_age = BASELINE_TTL if max_age is None else max_age
+    with _baseline_lock:
+        if _baseline is None or time.time() - _baseline['built_at'] > max_age:
+            try:
+                _baseline = build_baseline()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Could not build deal baselines: {str(e)}", file=sys.stderr)
+                return None
+        return _baseline
+
+def score(prices, groups, baseline):
+    """
+    Score listings against their groups' baselines.
+
+    Args:
+        prices (ndarray): Prices in cents, MISSING_CENTS for none
+        groups (ndarray): Group of each listing, -1 if its group has no baseline
+        baseline (dict): From build_baseline
+
+    Returns:
+        tuple: (deal scores, baseline medians) arrays; NaN where a listing
+        can't be scored
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    groups = np.asarray(groups, dtype=np.int64)
+    if not len(baseline['median']):
+        nan = np.full(len(prices), np.nan)
+        return nan, nan
+
+    known = groups >= 0
+    safe = np.where(known, groups, 0)
+    medians = baseline['median'][safe]
+    spread = np.maximum(MAD_SCALE * baseline['mad'][safe],
+                        np.maximum(MIN_SPREAD_FRACTION * medians, MIN_SPREAD_CENTS))
+    scores = (medians - prices) / spread
+
+    valid = known & (prices != MISSING_CENTS) & (baseline['count'][safe] >= MIN_OBSERVATIONS)
+    return np.where(valid, np.round(scores, 2), np.nan), np.where(valid, medians, np.nan)
+
+def score_products(products, baseline=None):
+    """
+    Add "deal_score" and "baseline_cents" to products.
+
+    Args:
+        products (list): Product dictionaries
+        baseline (dict, optional): Defaults to get_baseline()
+
+    Returns:
+        list: Copies of the products, with deal_score and baseline_cents
+        set (None where no baseline applies)
+    """
+    baseline = get_baseline() if baseline is None else baseline
+    if baseline is None or not products:
+        return [{**product, 'deal_score': None, 'baseline_cents': None} for product in products]
+
+    index = baseline['groups']
+    groups = np.fromiter(
+        (entity_resolution.match_group(index, product.get('title', ''), product.get('platform'),
+                                       product.get('condition'))
+         for product in products),
+        dtype=np.int64, count=len(products),
+    )
+    prices = np.fromiter(
+        (MISSING_CENTS if product.get('price_cents') is None else product['price_cents'] for product in products),
+        dtype=np.int64, count=len(products),
+    )
+    scores, medians = score(prices, groups, baseline)
+    return [
+        {**product,
+         'deal_score': None if np.isnan(deal) else float(deal),
+         'baseline_cents': None if np.isnan(median) else int(round(median))}
+        for product, deal, median in zip(products, scores.tolist(), medians.tolist())
+    ]
+
+def best_deals(baseline=None, limit=20, min_score=None):
+    """
+    Score every listing in the catalog index and return the best deals.
+
+    Args:
+        baseline (dict, optional): Defaults to get_baseline()
+        limit (int, optional): Most listings to return
+        min_score (float, optional): Only return listings scoring at least this
+
+    Returns:
+        list: {"url", "source", "title", "platform", "condition",
+        "price_cents", "baseline_cents", "deal_score"}, best first
+    """
+    baseline = get_baseline() if baseline is None else baseline
+    if baseline is None or not baseline['listings']:
+        return []
+
+    rows = baseline['listings']
+    prices = np.fromiter((MISSING_CENTS if row[5] is None else row[5] for row in rows),
+                         dtype=np.int64, count=len(rows))
+    scores, medians = score(prices, baseline['listing_groups'], baseline)
+
+    ranked = np.where(np.isnan(scores), -np.inf, scores)
+    if min_score is not None:
+        ranked = np.where(ranked >= min_score, ranked, -np.inf)
+    top = np.argsort(-ranked, kind='stable')[:limit]
+    top = top[np.isfinite(ranked[top])]
+    return [
+        {
+            'url': rows[i][0], 'source': rows[i][1], 'title': rows[i][2], 'platform': rows[i][3],
+            'condition': rows[i][4], 'price_cents': rows[i][5],
+            'baseline_cents': int(round(medians[i])), 'deal_score': float(scores[i]),
+        }
+        for i in top.tolist()
+    ]
+
+def main():
+    """List the best deals in the catalog index."""
+    parser = argparse.ArgumentParser(description='Rank catalog listings by deal score.')
+    parser.add_argument('--sources', type=str, default='all', help='Comma-separated sources, or "all"')
+    parser.add_argument('--limit', type=int, default=20, help='Most listings to print')
+    parser.add_argument('--min_score', type=float, help='Only print listings scoring at least this')
+
+    args = parser.parse_args()
+    _require_numpy()
+    sources = None if args.sources == 'all' else [s.strip() for s in args.sources.split(',') if s.strip()]
+
+    start = time.perf_counter()
+    baseline = build_baseline(sources=sources)
+    built = time.perf_counter()
+    deals = best_deals(baseline, args.limit, args.min_score)
+    scored = time.perf_counter()
+
+    print(f"Baseline: {baseline['groups']['groups']} groups from {len(baseline['listings'])} listings "
+          f"in {(built - start) * 1000:.1f} ms; scored in {(scored - built) * 1000:.1f} ms", file=sys.stderr)
+    print(json.dumps(deals))
+
+if __name__ == "__main__":
+    main()
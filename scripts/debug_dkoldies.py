@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 """
 Debug script for DKOldies.com requests
+
+The raw response is saved outside the repository (see --output). To add a
+page to the parse benchmark's corpus, use 'bench_parse.py record' instead.
 """
 
+import os
+import argparse
+import tempfile
+
 import requests
 from bs4 import BeautifulSoup
 from urllib.parse import quote_plus
 
-def debug_request():
-    """Test direct request to DKOldies.com"""
+DEFAULT_OUTPUT = os.path.join(tempfile.gettempdir(), 'dkoldies_response.html')
+
+def debug_request(query="zelda", output=DEFAULT_OUTPUT):
+    """Test direct request to DKOldies.com and save the response HTML to output"""
     # Set up headers to mimic a browser
     headers = {
         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
@@ -21,7 +30,6 @@ def debug_request():
     
     # Test URL
     base_url = "https://www.dkoldies.com/searchresults.html"
-    query = "zelda"
     encoded_query = quote_plus(query)
     search_url = f"{base_url}?search_query={encoded_query}"
     
@@ -51,12 +59,17 @@ def debug_request():
                 print(f"Element: {elem.name}, Classes: {elem.get('class', [])}")
         
         # Save HTML to file for inspection
-        with open('dkoldies_response.html', 'w', encoding='utf-8') as f:
+        with open(output, 'w', encoding='utf-8') as f:
             f.write(response.text)
-        print("\nSaved response HTML to dkoldies_response.html")
+        print(f"\nSaved response HTML to {output}")
         
     except Exception as e:
         print(f"Error: {str(e)}")
 
 if __name__ == "__main__":
-    debug_request() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Inspect a raw DKOldies.com search response.')
+    parser.add_argument('--query', type=str, default='zelda', help='Search term')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT, help='Where to save the response HTML')
+
+    args = parser.parse_args()
+    debug_request(args.query, args.output) 
\ No newline at end of file
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Entity Resolution
+
+Groups listings of the same game, platform and condition across stores, so
+each group can be shown once with every store's offer instead of one title
+overwriting another.
+
+Titles are reduced to their game words (platforms.canonical_title) and
+common abbreviations are expanded to the full name ("OOT" -> "legend zelda
+ocarina time"). Roman numerals become digits when they follow another title
+word or come right before the platform ("Final Fantasy X", "Rocky V PS2"),
+so "X-Men" keeps its "x". Two listings match when they share platform and
+condition, their numbers agree ("Zelda" is not "Zelda II"), and the
+IDF-weighted Jaccard similarity of their words is at least MATCH_THRESHOLD.
+Weighting by rarity means a missing "legend" barely matters, while a
+missing "double dash" keeps "Mario Kart" and "Mario Kart Double Dash" apart.
+
+Word rarity is counted over the catalog index's distinct titles (rebuilt
+at most every CORPUS_TTL seconds), so whether two listings match doesn't
+depend on which other listings are grouped with them. Until the index holds
+MIN_CORPUS_TITLES titles, rarity is counted within the listings being
+grouped.
+
+Comparing every pair would be quadratic, so:
+1. Listings with identical words are merged by hashing.
+2. Each distinct title is put in a block for each of its BLOCK_TOKENS
+   rarest words (within its platform and condition). Only titles sharing a
+   block are compared.
+3. Blocks bigger than MAX_BLOCK_SIZE are skipped, because a word that
+   common can't tell games apart.
+
+The cost stays close to linear in the number of listings. Matches are
+joined with union-find. index_groups keeps the blocks, so match_group can
+later place a single listing in one of the groups the same way.
+
+Settings:
+    LOOTSCOUT_ENTITY_CORPUS_TTL  Seconds word rarity from the catalog index is reused (default: 600)
+
+Run directly to group the whole catalog index and print timings, or with
+--show N to print the N largest cross-store groups.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+import functools
+import threading
+from collections import ChainMap, Counter, defaultdict
+
+import catalog_index
+from platforms import canonical_words
+
+MATCH_THRESHOLD = 0.7
+BLOCK_TOKENS = 2
+MAX_BLOCK_SIZE = 200
+
+# Fewest distinct titles the catalog index needs before word rarity is
+# counted over it instead of over the listings being grouped
+MIN_CORPUS_TITLES = 500
+CORPUS_TTL = float(os.environ.get('LOOTSCOUT_ENTITY_CORPUS_TTL', '600'))
+
+# Shorthand sellers use in titles, expanded to canonical_title's words. A
+# series' games expand to the series name too, so "Zelda OOT" and "Legend
+# of Zelda Ocarina of Time" have the same words.
+ABBREVIATIONS = {
+    'oot': 'legend zelda ocarina time',
+    'mm': 'legend zelda majoras mask',
+    'loz': 'legend zelda',
+    'alttp': 'legend zelda link to past',
+    'botw': 'legend zelda breath wild',
+    'totk': 'legend zelda tears kingdom',
+    'ff': 'final fantasy',
+    'gta': 'grand theft auto',
+    'cod': 'call duty',
+    'mgs': 'metal gear solid',
+    'kh': 'kingdom hearts',
+    'smb': 'super mario bros',
+    'sm64': 'super mario 64',
+    'ssb': 'super smash bros',
+    'dkc': 'donkey kong country',
+    'thps': 'tony hawks pro skater',
+}
+
+# Shorthand that is an ordinary word on its own, only expanded with its
+# number attached ("RE4")
+NUMBERED_ABBREVIATIONS = {
+    **ABBREVIATIONS,
+    're': 'resident evil',
+}
+
+_ROMAN_NUMERALS = {
+    'ii': '2', 'iii': '3', 'iv': '4', 'v': '5', 'vi': '6', 'vii': '7', 'viii': '8',
+    'ix': '9', 'x': '10', 'xi': '11', 'xii': '12', 'xiii': '13', 'xiv': '14', 'xv': '15',
+}
+
+_NUMBER = re.compile(r'^\d+$')
+_NUMBERED = re.compile(r'^([a-z]+)(\d+)$')
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def _word_tokens(word):
+    """Expand one canonical word; cached, since titles share a small vocabulary."""
+    if word not in ABBREVIATIONS:
+        # "FF7", "RE4": an abbreviation with its number attached
+        match = _NUMBERED.match(word)
+        if match and match.group(1) in NUMBERED_ABBREVIATIONS:
+            return tuple(NUMBERED_ABBREVIATIONS[match.group(1)].split()) + (match.group(2),)
+    return tuple(ABBREVIATIONS.get(word, word).split())
+
+def title_tokens(title):
+    """
+    Return the set of words that identify the game in a listing title.
+
+    Args:
+        title (str): Product title
+
+    Returns:
+        frozenset: Normalized words, abbreviations expanded and roman
+        numerals that follow a title word or precede the platform as digits
+    """
+    tokens = []
+    for i, (word, before_platform) in enumerate(canonical_words(title)):
+        if word in _ROMAN_NUMERALS and (i > 0 or before_platform):
+            word = _ROMAN_NUMERALS[word]
+        tokens.extend(_word_tokens(word))
+    return frozenset(tokens)
+
+def build_corpus():
+    """
+    Count the words of the catalog index's distinct titles.
+
+    Returns:
+        dict: {"frequency": Counter of how many titles contain each word,
+        "titles": number of distinct titles, "built_at"}
+    """
+    distinct = {
+        (platform or '', condition or '', title_tokens(title))
+        for _, _, title, platform, condition, _ in catalog_index.listings()
+    }
+    return {
+        'frequency': Counter(token for _, _, tokens in distinct for token in tokens),
+        'titles': len(distinct),
+        'built_at': time.time(),
+    }
+
+def get_corpus(max_age=None):
+    """
+    Return this process's word counts, rebuilding them when older than max_age.
+
+    Returns:
+        dict: See build_corpus, or None if the catalog can't be read
+    """
+    global _corpus
+    max_age = CORPUS_TTL if max_age is None else max_age
+    with _corpus_lock:
+        if _corpus is None or time.time() - _corpus['built_at'] > max_age:
+            try:
+                _corpus = build_corpus()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Could not read word rarity from the catalog index: {str(e)}", file=sys.stderr)
+                return None
+        return _corpus
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+def resolve(listings, corpus=None):
+    """
+    Assign every listing to a group.
+
+    Args:
+        listings (list): (title, platform, condition) tuples
+        corpus (dict, optional): Word counts from build_corpus; without one
+            (or with fewer than MIN_CORPUS_TITLES titles), rarity is counted
+            within listings
+
+    Returns:
+        list: Group number of each listing, numbered in order of first appearance
+    """
+    return index_groups(listings, corpus)['assignments']
+
+def _rarity(tokens, rarity):
+    """IDF of each word; words the counts haven't seen count as the rarest."""
+    titles, frequency = rarity
+    return {token: math.log(1 + titles / max(frequency.get(token, 0), 1)) for token in tokens}
+
+def _rarest(tokens, idf):
+    """A title's blocking words."""
+    return sorted(tokens, key=lambda token: (-idf[token], token))[:BLOCK_TOKENS]
+
+def _matches(tokens_a, weight_a, tokens_b, weight_b, idf):
+    """Whether two titles' words are similar enough to be the same game."""
+    # The weighted Jaccard similarity is w(A & B) / (w(A) + w(B) - w(A & B)),
+    # which can't reach the threshold when one title's total weight is far
+    # below the other's, so most pairs are rejected before their words are
+    # intersected.
+    if min(weight_a, weight_b) < MATCH_THRESHOLD * max(weight_a, weight_b):
+        return False
+    shared = sum(idf[token] for token in tokens_a & tokens_b)
+    return shared >= MATCH_THRESHOLD * (weight_a + weight_b - shared)
+
+def _numbers(tokens):
+    return frozenset(token for token in tokens if _NUMBER.match(token))
+
+def index_groups(listings, corpus=None):
+    """
+    Group listings, keeping what match_group needs to place other listings
+    in the same groups.
+
+    Args:
+        listings (list): (title, platform, condition) tuples
+        corpus (dict, optional): Word counts, as for resolve()
+
+    Returns:
+        dict: {"assignments": group of each listing (see resolve), "groups":
+        number of groups, "tokens": each group's words, plus lookup tables
+        for match_group}
+    """
+    # 1. Identical words, platform and condition: merged by hashing
+    distinct = {}
+    listing_keys = []
+    for title, platform, condition in listings:
+        key = (platform or '', condition or '', title_tokens(title))
+        listing_keys.append(distinct.setdefault(key, len(distinct)))
+    keys = list(distinct)
+
+    # Word rarity over the catalog's distinct titles, or these ones
+    if corpus is not None and corpus['titles'] >= MIN_CORPUS_TITLES:
+        rarity = (corpus['titles'], corpus['frequency'])
+    else:
+        rarity = (len(keys), Counter(token for _, _, tokens in keys for token in tokens))
+    idf = _rarity({token for _, _, tokens in keys for token in tokens}, rarity)
+
+    # 2. Block each distinct title under its rarest words
+    blocks = defaultdict(list)
+    for i, (platform, condition, tokens) in enumerate(keys):
+        for token in _rarest(tokens, idf):
+            blocks[(platform, condition, token)].append(i)
+
+    # 3. Compare within blocks and join matches
+    weights = [sum(idf[token] for token in tokens) for _, _, tokens in keys]
+    numbers = [_numbers(tokens) for _, _, tokens in keys]
+    groups = _UnionFind(len(keys))
+    compared = set()
+    for members in blocks.values():
+        if len(members) < 2 or len(members) > MAX_BLOCK_SIZE:
+            continue
+        for x, a in enumerate(members):
+            tokens_a, weight_a, numbers_a = keys[a][2], weights[a], numbers[a]
+            for b in members[x + 1:]:
+                if numbers_a != numbers[b] or (a, b) in compared:
+                    continue
+                compared.add((a, b))
+                if _matches(tokens_a, weight_a, keys[b][2], weights[b], idf):
+                    groups.union(a, b)
+
+    numbering = {}
+    key_groups = [numbering.setdefault(groups.find(i), len(numbering)) for i in range(len(keys))]
+    return {
+        'assignments': [key_groups[key] for key in listing_keys],
+        'groups': len(numbering),
+        'tokens': [keys[root][2] for root in numbering],
+        'keys': {key: key_groups[i] for i, key in enumerate(keys)},
+        'distinct': keys,
+        'key_groups': key_groups,
+        'blocks': blocks,
+        'rarity': rarity,
+        'idf': idf,
+        'weights': weights,
+        'numbers': numbers,
+    }
+
+def match_group(index, title, platform=None, condition=None):
+    """
+    Find the group a listing belongs to among already grouped listings.
+
+    A listing matches a group the same way two listings are matched in
+    index_groups, comparing it with the titles it shares a block with.
+
+    Args:
+        index (dict): From index_groups
+        title (str): Product title
+        platform (str, optional): Platform key
+        condition (str, optional): Condition
+
+    Returns:
+        int: The group, or -1 if no grouped listing matches
+    """
+    key = (platform or '', condition or '', title_tokens(title))
+    group = index['keys'].get(key)
+    if group is not None:
+        return group
+
+    platform, condition, tokens = key
+    idf = ChainMap(_rarity(tokens - index['idf'].keys(), index['rarity']), index['idf'])
+    weight, numbers = sum(idf[token] for token in tokens), _numbers(tokens)
+    for token in _rarest(tokens, idf):
+        members = index['blocks'].get((platform, condition, token), ())
+        if len(members) > MAX_BLOCK_SIZE:
+            continue
+        for i in members:
+            if numbers == index['numbers'][i] and \
+                    _matches(tokens, weight, index['distinct'][i][2], index['weights'][i], idf):
+                return index['key_groups'][i]
+    return -1
+
+def group_products(products, corpus=None):
+    """
+    Group products of the same game, platform and condition across stores.
+
+    Args:
+        products (list): Product dictionaries
+        corpus (dict, optional): Word counts (defaults to get_corpus())
+
+    Returns:
+        list: Groups in order of first appearance, each {"key", "title",
+        "platform", "condition", "stores", "best_price_cents", "offers"};
+        offers are the group's products, cheapest first
+    """
+    index = index_groups([
+        (product.get('title', ''), product.get('platform'), product.get('condition'))
+        for product in products
+    ], get_corpus() if corpus is None else corpus)
+    assignments, group_tokens = index['assignments'], index['tokens']
+    members = defaultdict(list)
+    for product, group in zip(products, assignments):
+        members[group].append(product)
+
+    groups = []
+    for group in range(len(members)):
+        offers = sorted(members[group], key=lambda p: (p.get('price_cents') is None, p.get('price_cents') or 0))
+        # The longest title usually spells the game out in full
+        title = max((offer.get('title', '') for offer in offers), key=len)
+        prices = [offer['price_cents'] for offer in offers if offer.get('price_cents') is not None]
+        groups.append({
+            'key': f"{' '.join(sorted(group_tokens[group]))}|{offers[0].get('platform') or ''}|"
+                   f"{offers[0].get('condition') or ''}",
+            'title': title,
+            'platform': offers[0].get('platform'),
+            'condition': offers[0].get('condition'),
+            'stores': len({offer.get('source') for offer in offers}),
+            'best_price_cents': min(prices) if prices else None,
+            'offers': offers,
+        })
+    return groups
+
+def main():
+    """Group the catalog index and report how long it took."""
+    parser = argparse.ArgumentParser(description='Group the same game across stores.')
+    parser.add_argument('--sources', type=str, default='all', help='Comma-separated sources, or "all"')
+    parser.add_argument('--show', type=int, default=0, help='Print this many of the largest cross-store groups')
+
+    args = parser.parse_args()
+    sources = None if args.sources == 'all' else [s.strip() for s in args.sources.split(',') if s.strip()]
+
+    rows = catalog_index.listings(sources)
+    products = [
+        {'url': url, 'source': source, 'title': title, 'platform': platform, 'condition': condition,
+         'price_cents': price_cents}
+        for url, source, title, platform, condition, price_cents in rows
+    ]
+    start = time.perf_counter()
+    groups = group_products(products)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    cross_store = [group for group in groups if group['stores'] > 1]
+    print(f"{len(products)} listings -> {len(groups)} groups ({len(cross_store)} in more than one store) "
+          f"in {elapsed:.1f} ms", file=sys.stderr)
+    if args.show:
+        cross_store.sort(key=lambda group: (-group['stores'], -len(group['offers'])))
+        print(json.dumps(cross_store[:args.show], indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Declarative Product Extraction
+
+The HTML stores' search pages all come down to the same steps: find the
+product cards, read a title, URL, price and image from each through a chain
+of fallback selectors, skip out-of-stock cards and make relative URLs
+absolute. Each store describes those steps in a JSON spec under
+extraction_specs/, and extract_products() runs any spec:
+
+    {
+      "name": "LukieGames.com",             store name for messages
+      "source": "LukieGames",               product "source" field
+      "id_prefix": "lukie",                 prefix for stable_id()
+      "base_url": "https://www.lukiegames.com",
+      "products": [".ss__result--item"],    product card selectors
+      "card": ["article.card"],             optional: element inside each
+                                            card that holds the fields
+      "out_of_stock": {"select": [".sold-out"], "text": ["sold out"]},
+      "fields": {
+        "title": {"select": [".ss__result__name a"]},
+        "url": {"select": [".ss__result__name a"], "attr": "href",
+                "absolute": true, "required": true},
+        "price": {"select": [".price--on-sale", ".price"], "ordered": true,
+                  "default": "Price not available"},
+        "image": {"select": [".ss__result__image img"], "attr": "src",
+                  "absolute": true},
+        "description": {"default": "From LukieGames.com"}
+      }
+    }
+
+A selector list is a fallback chain: the first selector that yields a
+non-empty value wins. Each field can also set:
+    attr       Read this attribute instead of the element's text
+    compact    Join the element's text fragments with surrounding whitespace
+               stripped (e.g. "On Sale:$40.97")
+    after      Keep only the text after the last occurrence of this string
+    format     "dollars" rewrites the price as "$1040.97"
+    truncate   Cut longer text to this many characters plus "..."
+    append     Separator to add the matched text to "default" with, instead
+               of replacing it
+    absolute   Prefix relative URLs with base_url
+    required   Skip the card when nothing matches (title always is)
+    ordered    Always try the chain in order (see below)
+    default    Value when nothing matches (default: "")
+
+Card selectors are tried in order and the first that finds any cards wins.
+A card is out of stock if any "out_of_stock" selector matches inside it or
+its text contains any of the (lowercase) "text" phrases.
+
+Every selector is compiled once per store and parser backend
+(html_parser.compile_selector) and reused for every card on every page. The
+engine also remembers, per store and field, which fallback matched last and
+tries it first, so a store whose markup has moved to a fallback layout
+doesn't pay for the selectors that no longer match on every card. Chains
+whose later selectors are broader versions of earlier ones (".price--main",
+then ".price") would pick the wrong element that way, so those set
+"ordered": true and are always walked in order.
+
+Adding an HTML store is a spec file plus its fetching code; JJGames is read
+from a JSON API and has its own extraction. Try a spec on a saved page with:
+    python extractor.py --spec vgny --file page.html
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+from html_parser import compile_selector, parse_html, resolve_backend
+from platforms import classify_condition, classify_platform
+from prices import parse_price
+from product_ids import stable_id
+
+SPEC_DIR = Path(__file__).resolve().parent / 'extraction_specs'
+
+FIELDS = ('title', 'url', 'price', 'image', 'description')
+
+# Loaded specs by store
+_specs = {}
+
+# (store, backend) -> selectors compiled for that parser backend
+_compiled = {}
+
+# (store, field) -> index of the fallback selector that matched last
+_last_match = {}
+
+def load_spec(store):
+    """
+    Load and check a store's extraction spec.
+
+    Args:
+        store (str): Spec name, the file extraction_specs/<store>.json
+
+    Returns:
+        dict: The spec
+
+    Raises:
+        ValueError: If the spec is missing something the engine needs
+    """
+    spec = _specs.get(store)
+    if spec is not None:
+        return spec
+
+    spec = json.loads((SPEC_DIR / f"{store}.json").read_text(encoding='utf-8'))
+    for key in ('name', 'source', 'id_prefix', 'base_url', 'products', 'fields'):
+        if key not in spec:
+            raise ValueError(f"Extraction spec '{store}' has no '{key}'")
+    unknown = set(spec['fields']) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Extraction spec '{store}' has unknown fields: {', '.join(sorted(unknown))}")
+    for field in ('title', 'url'):
+        if not spec['fields'].get(field, {}).get('select'):
+            raise ValueError(f"Extraction spec '{store}' has no selectors for '{field}'")
+
+    spec['store'] = store
+    _specs[store] = spec
+    return spec
+
+def _compile(spec, backend):
+    """Return the spec's selectors compiled for a parser backend."""
+    key = (spec['store'], backend)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        def chain(selectors):
+            return [compile_selector(css, backend) for css in selectors]
+
+        out_of_stock = spec.get('out_of_stock', {})
+        compiled = {
+            'products': chain(spec['products']),
+            'card': chain(spec.get('card', [])),
+            'out_of_stock': chain(out_of_stock.get('select', [])),
+            'fields': {field: chain(rules.get('select', [])) for field, rules in spec['fields'].items()},
+        }
+        _compiled[key] = compiled
+    return compiled
+
+def _chain_order(store, field, rules, count):
+    """Selector indexes to try for a field, last match first unless ordered."""
+    last = _last_match.get((store, field), 0)
+    if rules.get('ordered') or last == 0 or last >= count:
+        return range(count)
+    return [last] + [i for i in range(count) if i != last]
+
+def _read(element, rules):
+    """Read a field's raw value from a matched element."""
+    if rules.get('attr'):
+        return element.get(rules['attr']) or ''
+    if rules.get('compact'):
+        return element.get_text(strip=True)
+    return element.text.strip()
+
+def _field(spec, field, card, selectors, found):
+    """
+    Extract one field from a product card.
+
+    Args:
+        spec (dict): Store spec
+        field (str): Field name
+        card: Node holding the card's fields
+        selectors (list): The field's compiled fallback chain
+        found (dict): Elements already selected from this card, by selector
+            text, so fields that read the same element select it once
+
+    Returns:
+        str or None: The value, or None if a required field didn't match
+    """
+    rules = spec['fields'].get(field, {})
+    sources = rules.get('select', [])
+    value = ''
+    for i in _chain_order(spec['store'], field, rules, len(sources)):
+        if sources[i] not in found:
+            found[sources[i]] = card.select_one(selectors[i])
+        element = found[sources[i]]
+        if element is None:
+            continue
+        value = _read(element, rules)
+        if value:
+            _last_match[(spec['store'], field)] = i
+            break
+
+    if not value:
+        if rules.get('required') or field == 'title':
+            return None
+        return rules.get('default', '')
+
+    after = rules.get('after')
+    if after and after in value:
+        value = value.split(after)[-1]
+    if rules.get('truncate') and len(value) > rules['truncate']:
+        value = value[:rules['truncate']] + "..."
+    if rules.get('absolute') and not value.startswith('http'):
+        value = f"{spec['base_url']}{value}"
+    if rules.get('append'):
+        value = f"{rules.get('default', '')}{rules['append']}{value}"
+    return value
+
+def _format_price(price, rules):
+    """Apply a price field's "format" rule."""
+    if rules.get('format') != 'dollars':
+        return price
+    price = price.replace('$', '').strip()
+    try:
+        return f"${float(price.replace(',', '')):.2f}"
+    except ValueError:
+        return f"${price}"  # Keep original format if parsing fails
+
+def _is_out_of_stock(spec, product_elem, selectors):
+    """Whether a card matches any of the spec's out-of-stock rules."""
+    if any(product_elem.select_one(selector) is not None for selector in selectors):
+        return True
+    phrases = spec.get('out_of_stock', {}).get('text')
+    if phrases:
+        text = product_elem.text.lower()
+        return any(phrase in text for phrase in phrases)
+    return False
+
+def extract_products(spec, content, platform=None, max_results=16, debug=False, backend=None, encoding=None,
+                     stats=None):
+    """
+    Extract products from a store's search results page, yielding each one
+    as soon as it is built.
+
+    Args:
+        spec (dict): Store spec from load_spec()
+        content (bytes or str): Raw page HTML
+        platform (str, optional): Game platform (e.g., 'ps1', 'snes')
+        max_results (int, optional): Maximum number of product cards to read
+            (None for every product on the page)
+        debug (bool, optional): Report skipped cards on stderr
+        backend (str, optional): HTML parser backend (see html_parser.py)
+        encoding (str, optional): Charset from the response headers, if any
+        stats (dict, optional): Given the page's product card count as
+            "cards", before any filtering, when extraction starts
+
+    Yields:
+        dict: Product dictionaries
+    """
+    backend = resolve_backend(backend)
+    compiled = _compile(spec, backend)
+    soup = parse_html(content, backend, encoding)
+
+    product_elements = []
+    for selector in compiled['products']:
+        product_elements = soup.select(selector)
+        if product_elements:
+            break
+    print(f"Found {len(product_elements)} products on {spec['name']}", file=sys.stderr)
+    if stats is not None:
+        stats['cards'] = len(product_elements)
+
+    fields = compiled['fields']
+    price_rules = spec['fields'].get('price', {})
+    for product_elem in product_elements[:max_results]:
+        try:
+            card = product_elem
+            for selector in compiled['card']:
+                card = product_elem.select_one(selector) or product_elem
+                if card is not product_elem:
+                    break
+
+            found = {}
+            product_name = _field(spec, 'title', card, fields['title'], found)
+            if product_name is None:
+                if debug:
+                    print(f"Could not find product name element on {spec['name']}", file=sys.stderr)
+                continue
+
+            # Skip if platform filter is provided and doesn't match
+            if platform and platform.lower() not in product_name.lower():
+                continue
+
+            if _is_out_of_stock(spec, product_elem, compiled['out_of_stock']):
+                if debug:
+                    print(f"Skipping out of stock product: {product_name}", file=sys.stderr)
+                continue
+
+            product_url = _field(spec, 'url', card, fields['url'], found)
+            if product_url is None:
+                if debug:
+                    print(f"Could not find product URL for: {product_name}", file=sys.stderr)
+                continue
+
+            price = _format_price(_field(spec, 'price', card, fields.get('price', []), found), price_rules)
+            price_cents, currency = parse_price(price)
+
+            product = {
+                "id": stable_id(spec['id_prefix'], product_url),
+                "title": product_name,
+                "description": _field(spec, 'description', card, fields.get('description', []), found),
+                "price": price,
+                "price_cents": price_cents,
+                "currency": currency,
+                "source": spec['source'],
+                "time": "Just now",  # We don't have actual listing time
+                "image": _field(spec, 'image', card, fields.get('image', []), found),
+                # Condition and platform are approximated from the title
+                "condition": classify_condition(product_name),
+                "url": product_url,
+                "platform": classify_platform(product_name),
+            }
+        except Exception as e:
+            print(f"Error parsing product on {spec['name']}: {str(e)}", file=sys.stderr)
+            continue
+
+        yield product
+
+def main():
+    """Run a store's spec on a saved search results page."""
+    parser = argparse.ArgumentParser(description='Extract products from a saved page with a store spec.')
+    parser.add_argument('--spec', type=str, required=True, help='Spec name in extraction_specs/ (e.g. "vgny")')
+    parser.add_argument('--file', type=str, required=True, help='Saved search results page')
+    parser.add_argument('--platform', type=str, help='Platform filter')
+    parser.add_argument('--backend', type=str, help='HTML parser backend (see html_parser.py)')
+
+    args = parser.parse_args()
+    spec = load_spec(args.spec)
+    content = Path(args.file).read_bytes()
+    products = list(extract_products(spec, content, args.platform, None, True, args.backend))
+    print(json.dumps(products, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
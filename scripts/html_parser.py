@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Pluggable HTML Parser
+
+Scrapers parse pages through this module instead of calling BeautifulSoup
+directly, so the parsing engine can be swapped without touching extraction
+code. Every backend exposes the same small node API (select, select_one,
+text, get_text, attrs, [] and get), which is all the scrapers use.
+
+compile_selector() parses a CSS selector once so code that applies the same
+selectors to every product on a page (extractor.py) doesn't re-parse them.
+select and select_one take either a selector string or a compiled selector.
+
+Backends, chosen with LOOTSCOUT_HTML_PARSER (default: lxml):
+    selectolax   - Lexbor engine via the `selectolax` package (fastest)
+    lxml         - BeautifulSoup on the lxml tree builder
+    html.parser  - BeautifulSoup on the standard library parser (always available)
+
+A backend that isn't installed falls back to the next one down the list.
+"""
+
+import os
+import sys
+
+import soupsieve
+from bs4 import BeautifulSoup
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import lxml  # noqa: F401 - only needed as a BeautifulSoup tree builder
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+BACKENDS = ['selectolax', 'lxml', 'html.parser']
+
+DEFAULT_BACKEND = os.environ.get('LOOTSCOUT_HTML_PARSER', 'lxml')
+
+def is_available(backend):
+    """Return True if the backend's parsing library is installed."""
+    if backend == 'selectolax':
+        return LexborHTMLParser is not None
+    if backend == 'lxml':
+        return HAS_LXML
+    return backend == 'html.parser'
+
+def resolve_backend(backend=None):
+    """Return the requested backend, or the next available one after it."""
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        print(f"Unknown HTML parser '{backend}', using html.parser", file=sys.stderr)
+        return 'html.parser'
+
+    for candidate in BACKENDS[BACKENDS.index(backend):]:
+        if is_available(candidate):
+            return candidate
+    return 'html.parser'
+
+def available_backends():
+    """Return every backend that can run in this environment."""
+    return [backend for backend in BACKENDS if is_available(backend)]
+
+class SoupNode:
+    """Node API over a BeautifulSoup tag."""
+
+    __slots__ = ('_tag',)
+
+    def __init__(self, tag):
+        self._tag = tag
+
+    def select(self, css):
+        tags = self._tag.select(css) if isinstance(css, str) else css.select(self._tag)
+        return [SoupNode(tag) for tag in tags]
+
+    def select_one(self, css):
+        tag = self._tag.select_one(css) if isinstance(css, str) else css.select_one(self._tag)
+        return SoupNode(tag) if tag is not None else None
+
+    @property
+    def text(self):
+        return self._tag.get_text()
+
+    def get_text(self, strip=False):
+        return self._tag.get_text(strip=strip)
+
+    @property
+    def attrs(self):
+        return self._tag.attrs
+
+    def get(self, name, default=None):
+        return self._tag.get(name, default)
+
+    def __getitem__(self, name):
+        return self._tag[name]
+
+class LexborNode:
+    """Node API over a selectolax Lexbor node."""
+
+    __slots__ = ('_node',)
+
+    def __init__(self, node):
+        self._node = node
+
+    def select(self, css):
+        return [LexborNode(node) for node in self._node.css(css)]
+
+    def select_one(self, css):
+        node = self._node.css_first(css)
+        return LexborNode(node) if node is not None else None
+
+    @property
+    def text(self):
+        return self._node.text(deep=True)
+
+    def get_text(self, strip=False):
+        return self._node.text(deep=True, strip=strip)
+
+    @property
+    def attrs(self):
+        return self._node.attributes
+
+    def get(self, name, default=None):
+        return self._node.attributes.get(name, default)
+
+    def __getitem__(self, name):
+        return self._node.attributes[name]
+
+def compile_selector(css, backend=None):
+    """
+    Compile a CSS selector for repeated use on documents parsed by a backend.
+
+    Args:
+        css (str): CSS selector
+        backend (str, optional): Parser backend the selector will run on
+
+    Returns:
+        A compiled selector for the BeautifulSoup backends (soupsieve), or
+        the selector string for selectolax, which has no compiled form
+    """
+    if resolve_backend(backend) == 'selectolax':
+        return css
+    return soupsieve.compile(css)
+
+def parse_html(content, backend=None, encoding=None):
+    """
+    Parse an HTML document.
+
+    Args:
+        content (bytes or str): Raw response body or HTML text
+        backend (str, optional): Parser backend (defaults to LOOTSCOUT_HTML_PARSER)
+        encoding (str, optional): Charset from the response headers, if any
+
+    Returns:
+        Root node of the document
+    """
+    backend = resolve_backend(backend)
+
+    if backend == 'selectolax':
+        # Lexbor reads UTF-8 bytes natively; only other charsets need decoding
+        if isinstance(content, bytes) and encoding and encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            content = content.decode(encoding, errors='replace')
+        return LexborNode(LexborHTMLParser(content).root)
+
+    if isinstance(content, bytes) and encoding:
+        return SoupNode(BeautifulSoup(content, backend, from_encoding=encoding))
+    return SoupNode(BeautifulSoup(content, backend))
+
+def response_charset(response):
+    """
+    Return the charset declared in a response's Content-Type header.
+
+    Unlike response.encoding this never falls back to a guessed or default
+    charset, so pages without one are left for the parser to detect.
+    """
+    content_type = response.headers.get('content-type', '')
+    for part in content_type.split(';')[1:]:
+        key, _, value = part.strip().partition('=')
+        if key.lower() == 'charset' and value:
+            return value.strip('"\' ')
+    return None
+
+def parse_response(response, backend=None):
+    """Parse an HTTP response's raw bytes, skipping response.text decoding."""
+    return parse_html(response.content, backend, response_charset(response))
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP Client
+
+Every scraper fetches through this module so connections are pooled per host
+and kept alive between searches instead of being rebuilt on every request.
+Responses are negotiated with gzip/deflate (and brotli when the `brotli`
+package is installed).
+
+HTTP/2 is used when LOOTSCOUT_HTTP2=1 and `httpx[http2]` is installed; hosts
+that don't offer h2 fall back to HTTP/1.1 over the same client. Errors on
+either backend surface as `requests.RequestException` so the scrapers only
+have one exception family to handle.
+
+Each host has a circuit breaker (see circuit_breaker.py): once a host keeps
+failing, requests to it raise CircuitOpenError straight away. Requests are
+also paced per host by the shared token bucket in rate_limiter.py.
+
+Callers fetching untrusted URLs (image_cache.py) can turn off redirects and
+cap the body size; a capped body is streamed and the download stops as soon
+as it goes over.
+"""
+
+import os
+import sys
+import time
+import json
+import threading
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+    import h2  # noqa: F401 - httpx needs it for http2=True
+except ImportError:
+    httpx = None
+
+import rate_limiter
+from circuit_breaker import CircuitOpenError, get_breaker
+
+# Retry policy shared by every scraper
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.5  # wait 0.5s * (2 ** retry) between retries
+RETRY_STATUSES = [500, 502, 503, 504]
+
+# Connections kept open per host, and how many host pools to keep around
+POOL_MAXSIZE = int(os.environ.get('LOOTSCOUT_HTTP_POOL_SIZE', '10'))
+POOL_CONNECTIONS = 32
+
+USE_HTTP2 = os.environ.get('LOOTSCOUT_HTTP2') == '1' and httpx is not None
+
+# Bytes read at a time from a response with a size cap
+CHUNK_SIZE = 64 * 1024
+
+# Every encoding urllib3 can decode here, e.g. "gzip,deflate,br"
+ACCEPT_ENCODING = urllib3.util.make_headers(accept_encoding=True)['accept-encoding']
+
+class ResponseTooLargeError(requests.RequestException):
+    """Raised when a response body is longer than the caller's max_bytes."""
+
+_lock = threading.Lock()
+_session = None
+_httpx_client = None
+
+# host -> {"requests": n, "connections": n, "bytes": n, "http_versions": {...}}
+_host_stats = {}
+
+def _record(host, connections=0, http_version=None, size=0):
+    """Update the per-host counters."""
+    with _lock:
+        stats = _host_stats.setdefault(host, {'requests': 0, 'connections': 0, 'bytes': 0, 'http_versions': {}})
+        if http_version is not None:
+            stats['requests'] += 1
+            stats['http_versions'][http_version] = stats['http_versions'].get(http_version, 0) + 1
+        stats['connections'] += connections
+        stats['bytes'] += size
+
+class _CountingHTTPConnection(HTTPConnection):
+    """HTTP connection that records every socket it opens."""
+
+    def connect(self):
+        super().connect()
+        _record(self.host, connections=1)
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    """HTTPS connection that records every socket (and TLS handshake) it opens."""
+
+    def connect(self):
+        super().connect()
+        _record(self.host, connections=1)
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose per-host pools count new connections."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+def create_retry():
+    """Create the shared retry policy."""
+    return Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        # Retry-After is handled by rate_limiter for every process at once,
+        # rather than by sleeping inside this request's retries
+        respect_retry_after_header=False,
+    )
+
+def get_session():
+    """Return the process-wide requests session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = _PooledAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    max_retries=create_retry(),
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+                _session = session
+    return _session
+
+def _get_httpx_client():
+    """Return the process-wide HTTP/2-capable client, creating it on first use."""
+    global _httpx_client
+    if _httpx_client is None:
+        with _lock:
+            if _httpx_client is None:
+                limits = httpx.Limits(max_keepalive_connections=POOL_MAXSIZE * POOL_CONNECTIONS,
+                                      max_connections=None)
+                _httpx_client = httpx.Client(
+                    transport=httpx.HTTPTransport(http2=True, limits=limits, retries=RETRY_TOTAL),
+                    headers={'Accept-Encoding': ACCEPT_ENCODING},
+                    follow_redirects=True,
+                )
+    return _httpx_client
+
+class _HttpxResponse:
+    """Wrap an httpx response in the parts of the requests API scrapers use."""
+
+    def __init__(self, response, content):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.content = content
+        self.encoding = response.encoding
+        self.http_version = response.http_version
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        try:
+            self._response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            raise requests.HTTPError(str(e), response=self) from e
+
+def _read_body(headers, chunks, max_bytes):
+    """
+    Read a response body, giving up once it is longer than max_bytes.
+
+    Args:
+        headers: Response headers
+        chunks: Iterator over the decoded body
+        max_bytes (int): Longest body accepted, or None for any
+
+    Returns:
+        bytes: The body
+
+    Raises:
+        ResponseTooLargeError: If Content-Length or the body itself is over max_bytes
+    """
+    if max_bytes is not None:
+        try:
+            length = int(headers.get('Content-Length') or 0)
+        except ValueError:
+            length = 0
+        if length > max_bytes:
+            raise ResponseTooLargeError(f"Response is {length} bytes, over the {max_bytes} byte limit")
+
+    body = bytearray()
+    for chunk in chunks:
+        body += chunk
+        if max_bytes is not None and len(body) > max_bytes:
+            raise ResponseTooLargeError(f"Response is over the {max_bytes} byte limit")
+    return bytes(body)
+
+def _get_httpx(url, params, headers, timeout, allow_redirects, max_bytes):
+    """GET over httpx, applying the shared status retry policy."""
+    client = _get_httpx_client()
+    host = urlsplit(url).hostname
+
+    def trace(event_name, info):
+        # httpcore reports a TCP connect only when it opens a new connection
+        if event_name == 'connection.connect_tcp.complete':
+            _record(host, connections=1)
+
+    for attempt in range(RETRY_TOTAL + 1):
+        try:
+            with client.stream('GET', url, params=params, headers=headers, timeout=timeout,
+                               follow_redirects=allow_redirects, extensions={'trace': trace}) as response:
+                content = _read_body(response.headers, response.iter_bytes(CHUNK_SIZE), max_bytes)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(str(e)) from e
+
+        _record(host, http_version=response.http_version, size=len(content))
+        if response.status_code not in RETRY_STATUSES or attempt == RETRY_TOTAL:
+            return _HttpxResponse(response, content)
+        time.sleep(RETRY_BACKOFF_FACTOR * (2 ** attempt))
+
+def _get_requests(url, params, headers, timeout, allow_redirects, max_bytes):
+    """GET over the requests session, streaming the body when it is capped."""
+    response = get_session().get(url, params=params, headers=headers, timeout=timeout,
+                                 allow_redirects=allow_redirects, stream=max_bytes is not None)
+    if max_bytes is not None:
+        try:
+            # Stored where requests keeps a body it has read, so .content works
+            response._content = _read_body(response.headers, response.iter_content(CHUNK_SIZE), max_bytes)
+        finally:
+            response.close()
+    return response
+
+def get(url, params=None, headers=None, timeout=15, limit_key=None, limits=None, allow_redirects=True,
+        max_bytes=None):
+    """
+    Send a GET request through the shared connection pool.
+
+    Args:
+        url (str): Request URL
+        params (dict, optional): Query string parameters
+        headers (dict, optional): Extra request headers
+        timeout (float, optional): Timeout in seconds
+        limit_key (str, optional): Rate limit bucket and circuit breaker to
+            use instead of the host's, so side traffic (e.g. images) doesn't
+            use up the host's search budget
+        limits (tuple, optional): (requests per second, burst) for the
+            limit_key bucket, instead of rate_limiter's for the host
+        allow_redirects (bool, optional): Follow redirects; without, a 3xx
+            response is returned as is
+        max_bytes (int, optional): Longest body to download
+
+    Returns:
+        Response object with status_code, headers, content, text, json()
+        and raise_for_status()
+
+    Raises:
+        CircuitOpenError: If the host's circuit breaker is open
+        RateLimitedError: If the host's rate limit would delay the request
+            by more than `timeout`
+        ResponseTooLargeError: If the body is longer than max_bytes
+    """
+    host = urlsplit(url).hostname
+    limit_key = limit_key or host
+    breaker = get_breaker(limit_key)
+    if breaker.is_open():
+        raise CircuitOpenError(f"Circuit open for {limit_key}; skipping request")
+
+    # Wait for a token, but never longer than the request itself may take
+    rate_limiter.acquire(limit_key, max_wait=timeout, limits=limits)
+
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {limit_key}; skipping request")
+
+    try:
+        if USE_HTTP2:
+            response = _get_httpx(url, params, headers, timeout, allow_redirects, max_bytes)
+        else:
+            response = _get_requests(url, params, headers, timeout, allow_redirects, max_bytes)
+            _record(urlsplit(response.url).hostname or host, http_version='HTTP/1.1',
+                    size=len(response.content))
+    except ResponseTooLargeError:
+        # The host answered; the caller just doesn't want that much
+        breaker.record_success()
+        raise
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        # Not the host's fault, and the host never answered either
+        breaker.release_trial()
+        raise
+
+    rate_limiter.note_response(limit_key, response.status_code, response.headers)
+
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+def connection_stats():
+    """
+    Report per-host request counts, connection reuse and body bytes received.
+
+    Returns:
+        dict: host -> {"requests", "connections", "reuse_rate", "bytes", "http_versions"}
+    """
+    report = {}
+    with _lock:
+        for host, stats in _host_stats.items():
+            connections = stats['connections']
+            requests_made = stats['requests']
+            reuse_rate = 1 - (connections / requests_made) if requests_made else 0.0
+            report[host] = {
+                'requests': requests_made,
+                'connections': connections,
+                'reuse_rate': round(max(reuse_rate, 0.0), 3),
+                'bytes': stats['bytes'],
+                'http_versions': dict(stats['http_versions']),
+            }
+    return report
+
+if __name__ == "__main__":
+    print(f"Accept-Encoding: {ACCEPT_ENCODING}", file=sys.stderr)
+    print(f"HTTP/2: {'enabled' if USE_HTTP2 else 'disabled'}", file=sys.stderr)
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Product Image Thumbnails
+
+Fetches each listing image once and serves small thumbnails from a bounded
+disk cache. This way result grids don't hotlink dozens of full-size images
+from the stores' CDNs.
+
+A thumbnail is made the first time it is asked for:
+- The source image is fetched through http_client, under its own rate
+  limit bucket and circuit breaker per host (so images never use up a
+  store's search budget).
+- It is resized in a process pool to every size in SIZES, and encoded as
+  WebP and JPEG.
+- The source image itself isn't kept.
+
+Thumbnails are stored under a hash of the image's canonical URL. After
+IMAGE_TTL seconds the image is revalidated with a conditional request
+(If-None-Match / If-Modified-Since). A 304 keeps the thumbnails. If the
+store can't be reached, the old thumbnails are served.
+
+The cache is bounded by MAX_BYTES. Once it is over, the least recently
+used images are evicted, with all their thumbnails, until it is back
+under 90%. Images whose fetch failed aren't retried for NEGATIVE_TTL
+seconds.
+
+Only images on the stores' hosts and the exact CDN hosts their listings
+point at (IMAGE_HOSTS) are fetched, so the cache can't be used as an open
+proxy. Redirects aren't followed blindly: each Location is checked against
+IMAGE_HOSTS before it is fetched. Source images are streamed and the
+download stops once it passes MAX_SOURCE_BYTES.
+
+Settings:
+    LOOTSCOUT_IMAGE_CACHE_DIR        Cache directory (default: ~/.cache/lootscout/images)
+    LOOTSCOUT_IMAGE_CACHE_MAX_BYTES  Disk budget for thumbnails (default: 256 MiB)
+    LOOTSCOUT_IMAGE_TTL              Seconds before an image is revalidated (default: 604800)
+    LOOTSCOUT_IMAGE_WORKERS          Resize processes (default: 2)
+    LOOTSCOUT_IMAGE_RATE_LIMIT       Image requests per second per host (default: 10)
+
+Requires Pillow. Run with --url to make (or look up) a thumbnail, or with
+no arguments for cache statistics.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import requests
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
+import http_client
+from product_ids import canonical_url
+
+IMAGE_CACHE_DIR = Path(os.path.expanduser(os.environ.get('LOOTSCOUT_IMAGE_CACHE_DIR', '~/.cache/lootscout/images')))
+MAX_BYTES = int(os.environ.get('LOOTSCOUT_IMAGE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+IMAGE_TTL = float(os.environ.get('LOOTSCOUT_IMAGE_TTL', str(7 * 24 * 3600)))
+IMAGE_WORKERS = int(os.environ.get('LOOTSCOUT_IMAGE_WORKERS', '2'))
+IMAGE_RATE_LIMIT = float(os.environ.get('LOOTSCOUT_IMAGE_RATE_LIMIT', '10'))
+
+# Longest side of each thumbnail, in pixels
+SIZES = {
+    'small': 160,
+    'medium': 320,
+}
+
+# Format -> (Pillow format, content type, save options)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Hosts images may be fetched from, matched exactly: the stores, the CDN
+# hosts their listings point at (BigCommerce for VGNY and DKOldies, Shopify
+# for LukieGames, Ecwid's CloudFront distribution for JJGames), and eBay's
+# image host
+IMAGE_HOSTS = frozenset({
+    'videogamesnewyork.com',
+    'www.videogamesnewyork.com',
+    'www.lukiegames.com',
+    'www.dkoldies.com',
+    'www.jjgames.com',
+    'cdn11.bigcommerce.com',
+    'cdn.shopify.com',
+    'd2j6dbq0eux0bg.cloudfront.net',
+    'i.ebayimg.com',
+})
+
+# Redirects followed per image, each to an IMAGE_HOSTS host
+MAX_REDIRECTS = 3
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# Seconds a failed image isn't fetched again
+NEGATIVE_TTL = 300.0
+
+# Largest source image downloaded, and most pixels decoded
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+MAX_PIXELS = 40_000_000
+
+# The cache is trimmed to this fraction of MAX_BYTES once it is over
+LOW_WATERMARK = 0.9
+
+# last_used is only rewritten when older than this, so cache hits don't all write
+TOUCH_INTERVAL = 60.0
+
+FETCH_TIMEOUT = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    fetched_at REAL,
+    checked_at REAL,
+    failed_at REAL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used);
+"""
+
+class ImageError(Exception):
+    """Raised when a thumbnail can't be made."""
+
+_local = threading.local()
+
+# Image key -> lock, so one image is fetched once however many requests want it
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'fetched': 0, 'revalidated': 0, 'not_modified': 0, 'stale_served': 0,
+          'failed': 0, 'evicted': 0, 'render_ms_total': 0.0}
+
+def _count(field, amount=1):
+    with _stats_lock:
+        _stats[field] += amount
+
+def _connect():
+    """Return this thread's connection to the cache index, creating it on first use."""
+    path = IMAGE_CACHE_DIR / 'index.db'
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and getattr(_local, 'path', None) == path:
+        return conn
+
+    IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=10, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(_SCHEMA)
+    conn.row_factory = sqlite3.Row
+
+    _local.conn = conn
+    _local.path = path
+    return conn
+
+def _require_pillow():
+    if Image is None:
+        raise ImportError("image_cache requires Pillow")
+
+def image_key(url):
+    """Return the key an image's thumbnails are stored under."""
+    return hashlib.blake2b(canonical_url(url).encode(), digest_size=16).hexdigest()
+
+def _image_dir(key):
+    return IMAGE_CACHE_DIR / 'thumbs' / key[:2] / key
+
+def thumbnail_path(key, size, fmt):
+    """Return where a thumbnail is (or would be) stored."""
+    return _image_dir(key) / f"{size}.{fmt}"
+
+def allowed(url):
+    """Whether an image URL may be fetched."""
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    return parts.scheme in ('http', 'https') and host in IMAGE_HOSTS
+
+def _render(data, sizes, formats):
+    """
+    Decode an image and encode every thumbnail; runs in the process pool.
+
+    Returns:
+        dict: (size, format) -> encoded bytes
+    """
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    with Image.open(io.BytesIO(data)) as source:
+        largest = max(sizes.values())
+        # JPEGs can be decoded straight at a fraction of their size
+        source.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(source)
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    encoded = {}
+    # Largest first, each size resized from the one before
+    for size, edge in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        for fmt, (pillow_format, _, options) in formats.items():
+            frame = image
+            if has_alpha and pillow_format == 'JPEG':
+                frame = Image.new('RGB', image.size, (255, 255, 255))
+                frame.paste(image, mask=image.getchannel('A'))
+            buffer = io.BytesIO()
+            frame.save(buffer, pillow_format, **options)
+            encoded[(size, fmt)] = buffer.getvalue()
+    return encoded
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked: the worker process runs threads
+            _pool = ProcessPoolExecutor(max_workers=max(1, IMAGE_WORKERS),
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def render(data):
+    """Make every thumbnail of an image in the process pool."""
+    global _pool
+    start = time.perf_counter()
+    try:
+        encoded = _get_pool().submit(_render, data, SIZES, {fmt: FORMATS[fmt] for fmt in FORMATS}).result()
+    except BrokenProcessPool:
+        # A resize process died (e.g. out of memory); start a fresh pool next time
+        with _pool_lock:
+            _pool = None
+        raise ImageError("Image resize process died")
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError(f"Could not decode image: {str(e)}")
+    _count('render_ms_total', (time.perf_counter() - start) * 1000)
+    return encoded
+
+def _write_thumbnails(key, encoded):
+    """Replace an image's thumbnails; returns their total size in bytes."""
+    directory = _image_dir(key)
+    directory.mkdir(parents=True, exist_ok=True)
+    total = 0
+    for (size, fmt), data in encoded.items():
+        path = thumbnail_path(key, size, fmt)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        total += len(data)
+    return total
+
+def _complete(key):
+    return all(thumbnail_path(key, size, fmt).exists() for size in SIZES for fmt in FORMATS)
+
+def _key_lock(key):
+    with _key_locks_lock:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = _key_locks[key] = threading.Lock()
+        return lock
+
+def _fetch(url, row):
+    """Fetch an image, conditionally if its thumbnails exist; None if unchanged."""
+    headers = {'Accept': 'image/avif,image/webp,image/*;q=0.8'}
+    if row is not None:
+        if row['etag']:
+            headers['If-None-Match'] = row['etag']
+        if row['last_modified']:
+            headers['If-Modified-Since'] = row['last_modified']
+
+    for _ in range(MAX_REDIRECTS + 1):
+        # Images get their own bucket per host, so they never delay searches
+        response = http_client.get(url, headers=headers, timeout=FETCH_TIMEOUT,
+                                   limit_key=f"{urlsplit(url).hostname}#images",
+                                   limits=(IMAGE_RATE_LIMIT, IMAGE_RATE_LIMIT * 2),
+                                   allow_redirects=False, max_bytes=MAX_SOURCE_BYTES)
+        location = response.headers.get('Location')
+        if response.status_code not in REDIRECT_STATUSES or not location:
+            break
+        url = urljoin(url, location)
+        if not allowed(url):
+            raise ImageError(f"Image redirects to {urlsplit(url).hostname}, which isn't allowed")
+    else:
+        raise ImageError(f"Image redirected more than {MAX_REDIRECTS} times")
+
+    if response.status_code == 304 and row is not None:
+        return None
+    response.raise_for_status()
+    return response
+
+def get_thumbnail(url, size='small', fmt='webp'):
+    """
+    Return a thumbnail of an image, making it on first use.
+
+    Args:
+        url (str): Image URL from a product's "image"
+        size (str, optional): A key of SIZES
+        fmt (str, optional): A key of FORMATS
+
+    Returns:
+        tuple: (Path of the thumbnail, content type)
+
+    Raises:
+        ValueError: For an unknown size or format, or a URL that isn't on an
+            allowed host
+        ImageError: If the image can't be fetched or decoded and there is no
+            earlier thumbnail to fall back on
+    """
+    _require_pillow()
+    if size not in SIZES or fmt not in FORMATS:
+        raise ValueError(f"Unknown thumbnail {size}.{fmt}")
+    if not allowed(url):
+        raise ValueError(f"Images aren't fetched from {urlsplit(url).hostname}")
+
+    key = image_key(url)
+    path = thumbnail_path(key, size, fmt)
+    content_type = FORMATS[fmt][1]
+
+    with _key_lock(key):
+        conn = _connect()
+        row = conn.execute("SELECT * FROM images WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        present = row is not None and row['checked_at'] is not None and _complete(key)
+
+        if present and now - row['checked_at'] < IMAGE_TTL:
+            _count('hits')
+            if now - row['last_used'] > TOUCH_INTERVAL:
+                conn.execute("UPDATE images SET last_used = ? WHERE key = ?", (now, key))
+            return path, content_type
+        if row is not None and row['failed_at'] and now - row['failed_at'] < NEGATIVE_TTL:
+            if present:
+                _count('stale_served')
+                return path, content_type
+            raise ImageError(f"Image failed recently: {url}")
+
+        try:
+            response = _fetch(url, row if present else None)
+            if response is None:
+                _count('not_modified')
+                conn.execute("UPDATE images SET checked_at = ?, last_used = ?, failed_at = NULL WHERE key = ?",
+                             (now, now, key))
+                return path, content_type
+            encoded = render(response.content)
+        except (requests.RequestException, ImageError) as e:
+            _count('failed')
+            conn.execute(
+                "INSERT INTO images (key, url, failed_at, last_used) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET failed_at = excluded.failed_at",
+                (key, url, now, now),
+            )
+            if present:
+                _count('stale_served')
+                print(f"Serving stale thumbnail for {url}: {str(e)}", file=sys.stderr)
+                return path, content_type
+            raise ImageError(str(e)) from e
+
+        total = _write_thumbnails(key, encoded)
+        _count('revalidated' if present else 'fetched')
+        conn.execute(
+            "INSERT OR REPLACE INTO images (key, url, etag, last_modified, bytes, fetched_at, checked_at, "
+            "failed_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?)",
+            (key, url, response.headers.get('ETag'), response.headers.get('Last-Modified'), total, now, now, now),
+        )
+
+    evict()
+    return path, content_type
+
+def evict(max_bytes=None):
+    """
+    Remove the least recently used images until the cache fits its budget.
+
+    Args:
+        max_bytes (int, optional): Budget (default: MAX_BYTES)
+
+    Returns:
+        int: Images evicted
+    """
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    conn = _connect()
+    total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM images").fetchone()[0]
+    if total <= max_bytes:
+        return 0
+
+    target = total - int(max_bytes * LOW_WATERMARK)
+    victims = []
+    for key, size in conn.execute("SELECT key, bytes FROM images ORDER BY last_used"):
+        if target <= 0:
+            break
+        victims.append(key)
+        target -= size
+
+    for key in victims:
+        with _key_lock(key):
+            shutil.rmtree(_image_dir(key), ignore_errors=True)
+            conn.execute("DELETE FROM images WHERE key = ?", (key,))
+    _count('evicted', len(victims))
+    return len(victims)
+
+def cache_stats():
+    """
+    Report thumbnail cache size and this process's counters.
+
+    Returns:
+        dict: {"images", "bytes", "max_bytes", "hits", "fetched",
+        "revalidated", "not_modified", "stale_served", "failed", "evicted",
+        "render_ms_avg"}
+    """
+    images, total = _connect().execute(
+        "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM images WHERE checked_at IS NOT NULL"
+    ).fetchone()
+    with _stats_lock:
+        stats = dict(_stats)
+    rendered = stats['fetched'] + stats['revalidated']
+    render_ms = stats.pop('render_ms_total')
+    return {
+        'images': images,
+        'bytes': total,
+        'max_bytes': MAX_BYTES,
+        **stats,
+        'render_ms_avg': round(render_ms / rendered, 1) if rendered else 0.0,
+    }
+
+def main():
+    """Make a thumbnail, or print cache statistics."""
+    parser = argparse.ArgumentParser(description='Product image thumbnail cache.')
+    parser.add_argument('--url', type=str, help='Image URL to make a thumbnail of')
+    parser.add_argument('--size', choices=list(SIZES), default='small', help='Thumbnail size')
+    parser.add_argument('--format', choices=list(FORMATS), default='webp', help='Thumbnail format')
+    parser.add_argument('--evict', action='store_true', help='Trim the cache to its budget')
+
+    args = parser.parse_args()
+    if args.url:
+        try:
+            path, content_type = get_thumbnail(args.url, args.size, args.format)
+        except (ValueError, ImageError, ImportError) as e:
+            print(json.dumps({'error': str(e)}))
+            sys.exit(1)
+        print(json.dumps({'path': str(path), 'content_type': content_type, 'bytes': path.stat().st_size}))
+    elif args.evict:
+        print(json.dumps({'evicted': evict()}))
+    else:
+        print(json.dumps(cache_stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+LootScout Multi-Source Search
+
+This script searches every store concurrently and combines the results.
+Each source gets its own deadline; when a source misses it, the search returns
+whatever the other sources found along with a per-source status instead of
+waiting on the slowest store. Sources whose circuit breaker is open are
+skipped and reported as "unavailable".
+
+With --stream, each source's products are written as NDJSON records as soon
+as that source finishes (see streaming.py), followed by a summary record.
+
+Every product carries a deal_score (see deal_scoring.py): how far below the
+usual price for that game, platform and condition it is listed.
+
+With --group, the result also lists the products grouped by game, platform
+and condition across stores (see entity_resolution.py).
+
+With --delta, the result also reports what changed in each source since
+the previous identical search: listings added, removed or repriced (see
+product_ids.py).
+
+With --from_index, the search is answered from the local catalog index
+(catalog_index.py) instead. Only the sources behind the top VERIFY_TOP hits
+are searched live, to confirm those hits and refresh their prices.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import catalog_index
+import result_cache
+import scheduler
+from deal_scoring import score_products
+from entity_resolution import group_products
+from prices import cents_from_amount, filter_and_sort
+from product_ids import diff_snapshot
+from circuit_breaker import CircuitOpenError
+from sources import SOURCES, run_source, shutdown
+from streaming import NDJSONWriter
+
+SORT_OPTIONS = ['price-asc', 'price-desc', 'deal']
+
+# Index hits confirmed by a live search, and how long that may take
+VERIFY_TOP = int(os.environ.get('LOOTSCOUT_INDEX_VERIFY_TOP', '5'))
+VERIFY_DEADLINE = float(os.environ.get('LOOTSCOUT_INDEX_VERIFY_DEADLINE', '3'))
+
+# Seconds each source is given before it is reported as timed out. DKOldies
+# renders in a headless browser, so it gets the most headroom.
+DEFAULT_DEADLINES = {
+    'vgny': 10.0,
+    'jjgames': 10.0,
+    'lukie-games': 10.0,
+    'dkoldies': 20.0,
+}
+
+async def _search_source(source, query, platform, max_results, deadline, deep=False, tenant=None):
+    """Run one source under its deadline and return (products, status)."""
+    start = time.perf_counter()
+    status = {'status': 'ok', 'count': 0}
+
+    try:
+        products = await asyncio.wait_for(
+            run_source(source, query, platform, max_results, deep=deep, tenant=tenant),
+            timeout=deadline,
+        )
+        status['count'] = len(products)
+    except asyncio.TimeoutError:
+        products = []
+        status['status'] = 'timeout'
+    except CircuitOpenError as e:
+        products = []
+        status['status'] = 'unavailable'
+        status['error'] = str(e)
+    except Exception as e:
+        products = []
+        status['status'] = 'error'
+        status['error'] = str(e)
+
+    status['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return products, status
+
+async def aggregate_search(query, platform=None, sources=None, max_results=16, deadlines=None,
+                           sort=None, min_price=None, max_price=None, deep=False, group=False, delta=False,
+                           tenant=None):
+    """
+    Search several sources concurrently, each under its own deadline.
+
+    Args:
+        query (str): Search term
+        platform (str, optional): Game platform (e.g., 'ps1', 'snes')
+        sources (list, optional): Source names to search (defaults to all)
+        max_results (int, optional): Maximum number of results per source
+        deadlines (dict, optional): Per-source deadlines in seconds, merged
+            over DEFAULT_DEADLINES
+        sort (str, optional): "price-asc", "price-desc" or "deal" (best deal first)
+        min_price (float, optional): Lowest price to keep, in dollars (inclusive)
+        max_price (float, optional): Highest price to keep, in dollars (exclusive)
+        deep (bool, optional): Read every result page of sources that paginate
+        group (bool, optional): Also return the products grouped across stores
+        delta (bool, optional): Also return each source's changes since the
+            previous identical search
+        tenant (str, optional): Who the search is for; the scheduler shares
+            interactive slots fairly between tenants
+
+    Returns:
+        dict: {"products": [...], "sources": {name: status}, "elapsed_ms": float},
+        plus "groups" (see entity_resolution.group_products) with group and
+        "delta" ({name: product_ids.diff_snapshot result}) with delta
+    """
+    start = time.perf_counter()
+    sources = list(sources or SOURCES.keys())
+    deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+
+    results = await asyncio.gather(*[
+        _search_source(source, query, platform, max_results, deadlines.get(source, 10.0), deep, tenant)
+        for source in sources
+    ])
+
+    products = []
+    statuses = {}
+    deltas = {}
+    for source, (source_products, status) in zip(sources, results):
+        products.extend(source_products)
+        statuses[source] = status
+        # A source that failed says nothing about which listings are gone, and
+        # a failed search is cached as empty for a while (result_cache.put_failure)
+        if delta and status['status'] == 'ok' and source_products:
+            deltas[source] = await asyncio.to_thread(diff_snapshot, source, query, platform, source_products, deep)
+
+    products = await asyncio.to_thread(score_products, products)
+    if sort or min_price is not None or max_price is not None:
+        products = filter_and_sort(products, sort, cents_from_amount(min_price), cents_from_amount(max_price))
+
+    result = {
+        'products': products,
+        'sources': statuses,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+    }
+    if group:
+        result['groups'] = group_products(products)
+    if delta:
+        result['delta'] = deltas
+    return result
+
+async def index_search(query, platform=None, sources=None, max_results=16, deadlines=None,
+                       sort=None, min_price=None, max_price=None, deep=False, verify_top=None, group=False,
+                       tenant=None):
+    """
+    Answer a search from the catalog index, checking the top hits live.
+
+    Index hits come back in milliseconds. The sources behind the top
+    verify_top hits are then searched live (through the result cache and
+    request coalescing, under VERIFY_DEADLINE). Hits found live are replaced
+    with the live product and marked "verified"; the live results are also
+    written back to the index. Hits not found live are kept, marked
+    "verified": false, until the next crawl confirms or drops them.
+
+    Takes the same arguments as aggregate_search, plus:
+        verify_top (int, optional): Hits to verify (default: VERIFY_TOP; 0 to skip)
+
+    Returns:
+        dict: {"products": [...], "sources": {name: status}, "index": {...},
+               "elapsed_ms": float}, plus "groups" with group
+    """
+    start = time.perf_counter()
+    verify_top = VERIFY_TOP if verify_top is None else verify_top
+
+    products = catalog_index.search(query, platform, sources, max_results,
+                                    cents_from_amount(min_price), cents_from_amount(max_price))
+    index_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    top = products[:verify_top]
+    verify_sources = sorted({product['source_key'] for product in top if product.get('source_key')})
+    verify_deadlines = {source: VERIFY_DEADLINE for source in verify_sources}
+    verify_deadlines.update(deadlines or {})
+
+    statuses = {}
+    if verify_sources:
+        results = await asyncio.gather(*[
+            _search_source(source, query, platform, max_results, verify_deadlines[source], deep, tenant)
+            for source in verify_sources
+        ])
+        live = {}
+        for source, (source_products, status) in zip(verify_sources, results):
+            statuses[source] = status
+            if status['status'] == 'ok' and source_products:
+                await asyncio.to_thread(catalog_index.upsert, source, source_products)
+                live.update((product['url'], product) for product in source_products)
+
+        for i, product in enumerate(top):
+            if statuses.get(product.get('source_key'), {}).get('status') != 'ok':
+                continue
+            if product['url'] in live:
+                products[i] = {**live[product['url']], 'source_key': product['source_key'], 'verified': True}
+            else:
+                product['verified'] = False
+
+    await asyncio.to_thread(catalog_index.record_views, [product['url'] for product in products])
+    products = await asyncio.to_thread(score_products, products)
+
+    # Live prices may have moved outside the requested range
+    if sort or min_price is not None or max_price is not None:
+        products = filter_and_sort(products, sort, cents_from_amount(min_price), cents_from_amount(max_price))
+
+    result = {
+        'products': products,
+        'sources': statuses,
+        'index': {
+            'hits': len(products),
+            'verified': sum(1 for product in products if product.get('verified')),
+            'elapsed_ms': index_ms,
+        },
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+    }
+    if group:
+        result['groups'] = group_products(products)
+    return result
+
+async def stream_search(stream, query, platform=None, sources=None, max_results=16, deadlines=None,
+                        sort=None, min_price=None, max_price=None, deep=False, tenant=None):
+    """
+    Search several sources concurrently, writing each source's products to
+    the stream as soon as that source finishes.
+
+    Takes the same arguments as aggregate_search, after the NDJSONWriter to
+    write to. Products are filtered by price and, with sort, ordered within
+    each source's batch; the batches arrive in completion order.
+
+    Returns:
+        dict: {name: status} for every source
+    """
+    sources = list(sources or SOURCES.keys())
+    deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+    min_cents = cents_from_amount(min_price)
+    max_cents = cents_from_amount(max_price)
+
+    async def search(source):
+        products, status = await _search_source(source, query, platform, max_results,
+                                                deadlines.get(source, 10.0), deep, tenant)
+        return source, products, status
+
+    for source in sources:
+        stream.status('searching', source=source)
+
+    statuses = {}
+    for next_result in asyncio.as_completed([search(source) for source in sources]):
+        source, products, status = await next_result
+        products = await asyncio.to_thread(score_products, products)
+        if sort or min_cents is not None or max_cents is not None:
+            products = filter_and_sort(products, sort, min_cents, max_cents)
+        for product in products:
+            stream.product(product, source=source)
+        # Written directly: one failed source doesn't make the whole search an error
+        stream.write({'type': 'status', 'source': source, **status})
+        statuses[source] = status
+
+    return statuses
+
+async def _run_once(query, platform, sources, max_results, deadlines, **options):
+    """Run one aggregate search and release scraper resources afterwards."""
+    try:
+        return await aggregate_search(query, platform, sources, max_results, deadlines, **options)
+    finally:
+        await shutdown()
+
+async def _index_once(query, platform, sources, max_results, deadlines, **options):
+    """Run one index search and release scraper resources afterwards."""
+    try:
+        return await index_search(query, platform, sources, max_results, deadlines, **options)
+    finally:
+        await shutdown()
+
+async def _stream_once(stream, query, platform, sources, max_results, deadlines, **options):
+    """Run one streaming search and release scraper resources afterwards."""
+    try:
+        return await stream_search(stream, query, platform, sources, max_results, deadlines, **options)
+    finally:
+        await shutdown()
+
+def parse_sources(value):
+    """Parse the --sources argument into a list of source names."""
+    if value == 'all':
+        return list(SOURCES.keys())
+
+    sources = [s.strip() for s in value.split(',') if s.strip()]
+    unknown = [s for s in sources if s not in SOURCES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown source(s): {', '.join(unknown)}")
+    return sources
+
+def parse_deadline(value):
+    """Parse a --deadline argument: either SECONDS or SOURCE=SECONDS."""
+    if '=' in value:
+        source, seconds = value.split('=', 1)
+        return source.strip(), float(seconds)
+    return None, float(value)
+
+def main():
+    """Main function to handle command line arguments and execute the search."""
+    parser = argparse.ArgumentParser(description='Search all LootScout sources concurrently.')
+    parser.add_argument('--query', type=str, required=True, help='Search term')
+    parser.add_argument('--platform', type=str, help='Game platform (e.g., ps1, snes)')
+    parser.add_argument('--sources', type=parse_sources, default='all',
+                        help='Comma-separated sources to search, or "all"')
+    parser.add_argument('--max_results', type=int, default=16, help='Maximum number of results per source')
+    parser.add_argument('--deadline', type=parse_deadline, action='append', default=[],
+                        help='Deadline in seconds for every source, or SOURCE=SECONDS (repeatable)')
+    parser.add_argument('--sort', choices=SORT_OPTIONS, help='Sort combined results by price, or best deal first')
+    parser.add_argument('--min_price', type=float, help='Lowest price to include, in dollars')
+    parser.add_argument('--max_price', type=float, help='Only include prices below this, in dollars')
+    parser.add_argument('--deep', action='store_true',
+                        help='Read every result page of sources that paginate, not just the first')
+    parser.add_argument('--stream', action='store_true',
+                        help='Write NDJSON records as each source finishes')
+    parser.add_argument('--from_index', action='store_true',
+                        help='Answer from the local catalog index, verifying the top hits live')
+    parser.add_argument('--group', action='store_true',
+                        help='Also list the products grouped by game across stores')
+    parser.add_argument('--delta', action='store_true',
+                        help="Also report each source's changes since the previous identical search")
+    parser.add_argument('--verify_top', type=int,
+                        help=f'Index hits to verify live (default: {VERIFY_TOP}; 0 to skip)')
+    parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+
+    args = parser.parse_args()
+    if args.stream and args.from_index:
+        parser.error('--stream and --from_index cannot be combined')
+    if args.stream and args.group:
+        parser.error('--stream and --group cannot be combined')
+    if args.delta and (args.stream or args.from_index):
+        parser.error('--delta cannot be combined with --stream or --from_index')
+    sources = args.sources
+
+    deadlines = {}
+    for source, seconds in args.deadline:
+        if source is None:
+            deadlines.update({s: seconds for s in sources})
+        else:
+            deadlines[source] = seconds
+
+    if args.debug:
+        print(f"Searching for '{args.query}' on {', '.join(sources)}...", file=sys.stderr)
+
+    options = {
+        'sort': args.sort, 'min_price': args.min_price, 'max_price': args.max_price, 'deep': args.deep,
+    }
+
+    if args.stream:
+        with NDJSONWriter('aggregate') as stream:
+            statuses = asyncio.run(_stream_once(
+                stream, args.query, args.platform, sources, args.max_results, deadlines, **options
+            ))
+            stream.summary(sources=statuses)
+    else:
+        try:
+            if args.from_index:
+                result = asyncio.run(_index_once(args.query, args.platform, sources, args.max_results, deadlines,
+                                                 verify_top=args.verify_top, group=args.group, **options))
+            else:
+                result = asyncio.run(_run_once(args.query, args.platform, sources, args.max_results, deadlines,
+                                               group=args.group, delta=args.delta, **options))
+
+            if args.debug:
+                for source, status in result['sources'].items():
+                    print(f"{source}: {status['status']} ({status['count']} products, {status['elapsed_ms']} ms)",
+                          file=sys.stderr)
+
+            print(json.dumps(result))
+        except Exception as e:
+            if args.debug:
+                print(f"Error in main function: {str(e)}", file=sys.stderr)
+            print(json.dumps({'products': [], 'sources': {}, 'error': str(e)}))
+
+    # A timed-out scraper thread can't be cancelled and would hold up
+    # interpreter shutdown, so exit as soon as the output is written.
+    # os._exit skips atexit handlers, so write what they would have first.
+    scheduler.flush()
+    result_cache.flush_reads()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+LootScout Scraper Worker
+
+Long-lived process that loads every scraper once and serves search requests
+over stdin/stdout, so the API routes don't pay for interpreter startup and
+imports on every search.
+
+Protocol (one JSON object per line):
+    request:  {"id": "1", "op": "search", "source": "vgny", "query": "zelda",
+               "platform": "n64", "max_results": 16}
+    response: {"id": "1", "ok": true, "products": [...]}
+              {"id": "1", "ok": false, "error": "..."}
+
+A "stats" op returns per-host HTTP connection reuse counters, result cache
+hit/miss/eviction counters, request coalescing counters, circuit breaker
+states, rate limiter queue wait times, scheduler queue depth and wait
+times per priority class, and thumbnail cache counters.
+
+A "thumbnail" op ({"url", "size", "format"}) makes or looks up a product
+image thumbnail (see image_cache.py) and responds with {"id", "ok",
+"result": {"path", "content_type"}}.
+
+Searches are scheduled as interactive. A "tenant" field (e.g. the user id)
+makes concurrent users share each source's slots fairly.
+
+An "aggregate" op searches several sources at once with per-source deadlines
+(see lootscout_search.py) and responds with {"id", "ok", "result"}. With
+"from_index": true it is answered from the local catalog index instead;
+with "delta": true a live search also reports each source's changes since
+the previous identical search.
+
+Requests are handled concurrently and responses may arrive out of order;
+callers match them up by id. A {"event": "ready"} line is written once the
+scrapers are loaded.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from sources import run_source, available_sources, coalescing_stats, shutdown, IMPORT_ERRORS
+from lootscout_search import aggregate_search, index_search
+import http_client
+import result_cache
+import circuit_breaker
+import rate_limiter
+import scheduler
+import image_cache
+
+# Keep a handle on the real stdout for protocol messages and send any stray
+# print() from the scrapers to stderr so it can't corrupt the stream.
+_protocol_out = sys.stdout
+sys.stdout = sys.stderr
+
+# Thumbnail requests block on image downloads, so they get their own threads
+# rather than the default executor the cache and scheduler calls share
+THUMBNAIL_THREADS = int(os.environ.get('LOOTSCOUT_THUMBNAIL_THREADS', '4'))
+_thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_THREADS, thread_name_prefix='thumbnail')
+
+def write_message(message):
+    """
+    Write a single protocol message as one line of JSON.
+
+    Writes happen on the event loop thread with no await in between, so
+    concurrent requests can't interleave partial lines.
+    """
+    _protocol_out.write(json.dumps(message) + "\n")
+    _protocol_out.flush()
+
+async def handle_search(request):
+    """Run a search request and return its products."""
+    query = request.get('query')
+    if not query:
+        raise ValueError("Search query is required")
+
+    return await run_source(
+        request.get('source'),
+        query,
+        request.get('platform') or None,
+        int(request.get('max_results', 16)),
+        deep=bool(request.get('deep')),
+        tenant=request.get('tenant') or None,
+    )
+
+async def handle_aggregate(request):
+    """Run a multi-source search request and return the combined result."""
+    query = request.get('query')
+    if not query:
+        raise ValueError("Search query is required")
+
+    options = {}
+    if request.get('from_index'):
+        search = index_search
+    else:
+        search, options['delta'] = aggregate_search, bool(request.get('delta'))
+    return await search(
+        query,
+        request.get('platform') or None,
+        request.get('sources') or None,
+        int(request.get('max_results', 16)),
+        request.get('deadlines') or None,
+        sort=request.get('sort') or None,
+        min_price=request.get('min_price'),
+        max_price=request.get('max_price'),
+        deep=bool(request.get('deep')),
+        group=bool(request.get('group')),
+        tenant=request.get('tenant') or None,
+        **options,
+    )
+
+async def handle_thumbnail(request):
+    """Make or look up a product image thumbnail."""
+    loop = asyncio.get_running_loop()
+    path, content_type = await loop.run_in_executor(_thumbnail_executor, functools.partial(
+        image_cache.get_thumbnail,
+        request.get('url') or '',
+        request.get('size') or 'small',
+        request.get('format') or 'webp',
+    ))
+    return {'path': str(path), 'content_type': content_type}
+
+async def handle_request(request, semaphore, debug=False):
+    """Dispatch one request and write its response, never raising."""
+    request_id = request.get('id')
+    op = request.get('op', 'search')
+
+    try:
+        if op == 'thumbnail':
+            # Thumbnails are bounded by their own thread pool and the image
+            # rate limits, so a page of them doesn't hold searches up
+            result = await handle_thumbnail(request)
+            write_message({'id': request_id, 'ok': True, 'result': result})
+            return
+        async with semaphore:
+            if op == 'ping':
+                write_message({'id': request_id, 'ok': True, 'result': 'pong'})
+            elif op == 'search':
+                products = await handle_search(request)
+                write_message({'id': request_id, 'ok': True, 'products': products})
+            elif op == 'stats':
+                write_message({'id': request_id, 'ok': True, 'result': {
+                    'http': http_client.connection_stats(),
+                    'cache': result_cache.cache_stats(),
+                    'coalescing': coalescing_stats(),
+                    'breakers': circuit_breaker.breaker_stats(),
+                    'rate_limits': rate_limiter.limiter_stats(),
+                    'scheduler': scheduler.scheduler_stats(),
+                    'images': image_cache.cache_stats(),
+                }})
+            elif op == 'aggregate':
+                result = await handle_aggregate(request)
+                write_message({'id': request_id, 'ok': True, 'result': result})
+            else:
+                raise ValueError(f"Unknown op: {op}")
+    except Exception as e:
+        if debug:
+            print(f"Request {request_id} failed: {str(e)}", file=sys.stderr)
+        write_message({'id': request_id, 'ok': False, 'error': str(e)})
+
+async def serve(concurrency=8, debug=False):
+    """Read requests from stdin until EOF, handling them concurrently."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    write_message({
+        'event': 'ready',
+        'sources': available_sources(),
+        'unavailable': IMPORT_ERRORS,
+    })
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            write_message({'id': None, 'ok': False, 'error': f"Invalid JSON: {str(e)}"})
+            continue
+
+        if not isinstance(request, dict):
+            write_message({'id': None, 'ok': False, 'error': "Request must be a JSON object"})
+            continue
+
+        task = asyncio.create_task(handle_request(request, semaphore, debug))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    # Stdin closed: finish whatever is still in flight before exiting
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    await shutdown()
+
+def main():
+    """Main function to handle command line arguments and run the worker."""
+    parser = argparse.ArgumentParser(description='Serve LootScout scraper requests over stdin/stdout.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum requests handled at once')
+    parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+
+    args = parser.parse_args()
+
+    if args.debug:
+        print(f"Worker starting with sources: {', '.join(available_sources())}", file=sys.stderr)
+
+    try:
+        asyncio.run(serve(args.concurrency, args.debug))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Multi-Page Search Helpers
+
+Deep searches read the page count from the first results page and fetch the
+remaining pages concurrently, at most PAGE_CONCURRENCY at a time. Pages are
+consumed in order and fetching stops as soon as enough products have been
+collected; pages that haven't started yet are never requested.
+
+Settings:
+    LOOTSCOUT_PAGE_CONCURRENCY  Pages fetched at once per search (default: 4)
+    LOOTSCOUT_MAX_PAGES         Most pages a deep search reads (default: 10)
+"""
+
+import os
+import re
+import sys
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from html_parser import parse_html
+
+PAGE_CONCURRENCY = int(os.environ.get('LOOTSCOUT_PAGE_CONCURRENCY', '4'))
+MAX_PAGES = int(os.environ.get('LOOTSCOUT_MAX_PAGES', '10'))
+
+# BigCommerce storefront pagination links (VGNY, DKOldies)
+PAGINATION_LINKS = '.pagination-link, .pagination-item a'
+
+_PAGE_PARAM = re.compile(r'[?&](?:amp;)?page=(\d+)')
+
+def page_count(content, backend=None, encoding=None):
+    """
+    Read the number of result pages from a storefront search page.
+
+    Args:
+        content (bytes or str): Raw page HTML
+        backend (str, optional): HTML parser backend (see html_parser.py)
+        encoding (str, optional): Charset from the response headers, if any
+
+    Returns:
+        int: Highest page number linked from the pagination, or 1
+    """
+    root = parse_html(content, backend, encoding)
+    pages = 1
+    for link in root.select(PAGINATION_LINKS):
+        match = _PAGE_PARAM.search(link.get('href') or '')
+        if match:
+            pages = max(pages, int(match.group(1)))
+    return pages
+
+def merge_products(products, new_products, seen_urls, limit=None, on_product=None):
+    """
+    Append products whose URL hasn't been seen (listings shift between pages).
+
+    Args:
+        products (list): Products collected so far; appended to in place
+        new_products (iterable): Products from the next page
+        seen_urls (set): URLs already in products
+        limit (int, optional): Stop once products holds this many
+        on_product (callable, optional): Called with each product appended
+    """
+    for product in new_products:
+        if limit is not None and len(products) >= limit:
+            break
+        if product['url'] not in seen_urls:
+            seen_urls.add(product['url'])
+            products.append(product)
+            if on_product:
+                on_product(product)
+
+def fetch_pages(fetch_page, pages, enough, concurrency=None):
+    """
+    Fetch pages on a bounded thread pool, yielding results in page order.
+
+    Args:
+        fetch_page (callable): fetch_page(page) -> result
+        pages (iterable): Page numbers (or offsets) to fetch
+        enough (callable): Returns True once no more pages are needed
+        concurrency (int, optional): Pages in flight at once
+
+    Yields:
+        Each page's result, in order, until enough() is True
+    """
+    pages = list(pages)
+    if not pages:
+        return
+
+    workers = min(concurrency or PAGE_CONCURRENCY, len(pages))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='page')
+    # Only `workers` pages are ever submitted ahead of the reader, so
+    # stopping early never leaves queued requests behind
+    window = deque()
+    queue = iter(pages)
+    try:
+        for page in islice(queue, workers):
+            window.append((page, executor.submit(fetch_page, page)))
+        while window:
+            page, future = window.popleft()
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Error fetching page {page}: {str(e)}", file=sys.stderr)
+            else:
+                yield result
+                if enough():
+                    break
+            for next_page in islice(queue, 1):
+                window.append((next_page, executor.submit(fetch_page, next_page)))
+    finally:
+        executor.shutdown(wait=False)
+
+async def fetch_pages_async(fetch_page, pages, enough, concurrency=None):
+    """
+    Async version of fetch_pages for coroutine fetchers (e.g. browser pages).
+
+    Returns:
+        list: Page results, in order, up to the page where enough() was True
+    """
+    semaphore = asyncio.Semaphore(concurrency or PAGE_CONCURRENCY)
+    done = False
+
+    async def bounded(page):
+        async with semaphore:
+            # Checked once a slot frees up, so pages behind the one that
+            # satisfied the search are never requested
+            if done or enough():
+                return None
+            return await fetch_page(page)
+
+    tasks = [asyncio.ensure_future(bounded(page)) for page in pages]
+    results = []
+    try:
+        for page, task in zip(pages, tasks):
+            try:
+                results.append(await task)
+            except Exception as e:
+                print(f"Error fetching page {page}: {str(e)}", file=sys.stderr)
+                continue
+            if enough():
+                break
+    finally:
+        done = True
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return results
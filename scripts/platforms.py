@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Platform and Condition Classifier
+
+Every scraper guesses a listing's platform and condition from its title. The
+keyword table below is compiled once into a single regular expression that
+only matches whole words and prefers the longest keyword at each position,
+so "PlayStation 2" is ps2 rather than ps1 and "ds" no longer matches inside
+words like "cards".
+
+Run with --bench to compare throughput against the old per-keyword loops.
+"""
+
+import re
+import sys
+import time
+import argparse
+
+# Platform -> title keywords
+PLATFORM_KEYWORDS = {
+    "ps1": ["playstation", "ps1", "psx", "psone"],
+    "ps2": ["playstation 2", "ps2"],
+    "ps3": ["playstation 3", "ps3"],
+    "ps4": ["playstation 4", "ps4"],
+    "ps5": ["playstation 5", "ps5"],
+    "psp": ["psp", "playstation portable"],
+    "ps vita": ["ps vita", "playstation vita", "vita"],
+    "snes": ["super nintendo", "snes", "super nes"],
+    "nes": ["nintendo entertainment system", "nes"],
+    "n64": ["nintendo 64", "n64"],
+    "gamecube": ["gamecube", "nintendo gamecube", "gcn"],
+    "wii": ["nintendo wii", "wii"],
+    "wii u": ["nintendo wii u", "wii u"],
+    "switch": ["nintendo switch", "switch"],
+    "game boy": ["game boy", "gameboy", "gba", "gbc"],
+    "ds": ["nintendo ds", "nds", "ds"],
+    "3ds": ["nintendo 3ds", "3ds"],
+    "genesis": ["genesis", "sega genesis", "mega drive"],
+    "dreamcast": ["dreamcast", "sega dreamcast"],
+    "saturn": ["saturn", "sega saturn"],
+    "game gear": ["game gear", "sega game gear"],
+    "xbox": ["xbox"],
+    "xbox 360": ["xbox 360"],
+    "xbox one": ["xbox one"],
+    "xbox series": ["xbox series"]
+}
+
+# Condition -> title keywords, checked in this order of precedence
+CONDITION_KEYWORDS = [
+    ("New", ["new"]),
+    ("Sealed", ["sealed"]),
+    ("Complete", ["complete", "cib"]),
+    ("Loose", ["loose"]),
+]
+
+DEFAULT_CONDITION = "Used"
+
+_WHITESPACE = re.compile(r'\s+')
+
+def _trie_pattern(node):
+    """Turn a character trie into a regex, preferring longer continuations."""
+    branches = [
+        (r'\s+' if char == ' ' else re.escape(char)) + _trie_pattern(child)
+        for char, child in sorted(node.items())
+        if char != ''
+    ]
+    if not branches:
+        return ''
+
+    is_end = '' in node
+    if len(branches) == 1 and not is_end:
+        return branches[0]
+
+    group = '(?:' + '|'.join(branches) + ')'
+    # A greedy optional group tries the longer keyword before stopping here
+    return group + '?' if is_end else group
+
+def _compile(keywords):
+    """
+    Compile keywords into one whole-word regex over lowercased text.
+
+    The keywords are merged into a trie first, so the regex engine walks
+    shared prefixes once instead of retrying every keyword at each position,
+    and takes the longest keyword that matches there.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in _WHITESPACE.sub(' ', keyword.lower().strip()):
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return re.compile(rf'(?<![a-z0-9])(?:{_trie_pattern(trie)})(?![a-z0-9])')
+
+_PLATFORM_BY_KEYWORD = {
+    keyword: platform
+    for platform, keywords in PLATFORM_KEYWORDS.items()
+    for keyword in keywords
+}
+_PLATFORM_PATTERN = _compile(_PLATFORM_BY_KEYWORD)
+
+_CONDITION_PATTERNS = [(condition, _compile(keywords)) for condition, keywords in CONDITION_KEYWORDS]
+
+def _platform_for_match(match):
+    return _PLATFORM_BY_KEYWORD[_WHITESPACE.sub(' ', match.group(0))]
+
+def classify_platform(title):
+    """
+    Detect the platform a listing title refers to.
+
+    Args:
+        title (str): Product title
+
+    Returns:
+        str or None: Platform key (e.g. 'n64'), or None if nothing matched
+    """
+    match = _PLATFORM_PATTERN.search(title.lower())
+    return _platform_for_match(match) if match else None
+
+def classify_platforms(titles):
+    """
+    Detect platforms for many titles in one call.
+
+    Args:
+        titles (list): Product titles
+
+    Returns:
+        list: Platform key or None for each title, in order
+    """
+    search = _PLATFORM_PATTERN.search
+    platform_for_keyword = _PLATFORM_BY_KEYWORD
+
+    results = []
+    for title in titles:
+        match = search(title.lower())
+        if match is None:
+            results.append(None)
+            continue
+        keyword = match.group(0)
+        platform = platform_for_keyword.get(keyword)
+        results.append(platform if platform is not None else _platform_for_match(match))
+    return results
+
+def classify_condition(title):
+    """
+    Detect a listing's condition from its title.
+
+    Args:
+        title (str): Product title
+
+    Returns:
+        str: "New", "Sealed", "Complete", "Loose" or "Used"
+    """
+    title = title.lower()
+    for condition, pattern in _CONDITION_PATTERNS:
+        if pattern.search(title):
+            return condition
+    return DEFAULT_CONDITION
+
+def classify_conditions(titles):
+    """Detect conditions for many titles. See classify_condition."""
+    return [classify_condition(title) for title in titles]
+
+# Words that describe the copy rather than the game
+_FILLER_WORDS = {
+    'video', 'game', 'games', 'disc', 'cartridge', 'cart', 'only', 'box', 'boxed', 'manual',
+    'with', 'and', 'the', 'a', 'of', 'for', 'in', 'edition', 'tested', 'authentic', 'original',
+    'used', 'brand', 'good', 'great', 'excellent', 'condition', 'ntsc', 'pal', 'version',
+}
+_WORD = re.compile(r'[a-z0-9]+')
+_APOSTROPHES = re.compile(r"['\u2019]")
+_ANY_CONDITION_PATTERN = _compile(keyword for _, keywords in CONDITION_KEYWORDS for keyword in keywords)
+
+def canonical_title(title):
+    """
+    Reduce a listing title to the words that name the game.
+
+    Platform and condition keywords, punctuation and filler words ("video
+    game", "disc only", "the") are dropped, so "The Legend of Zelda:
+    Ocarina of Time - Nintendo 64 (Complete)" and "Legend of Zelda Ocarina
+    of Time N64 CIB" both become "legend zelda ocarina time".
+
+    Args:
+        title (str): Product title
+
+    Returns:
+        str: Space-separated words, in title order
+    """
+    # "Majora's" is one word, not "majora" and "s"
+    text = _PLATFORM_PATTERN.sub(' ', _APOSTROPHES.sub('', title.lower()))
+    text = _ANY_CONDITION_PATTERN.sub(' ', text)
+    return ' '.join(word for word in _WORD.findall(text) if word not in _FILLER_WORDS)
+
+# Stands in for a platform name in canonical_words
+_PLATFORM_MARK = '\x00'
+_MARKED_WORD = re.compile(r'[a-z0-9]+|\x00')
+
+def canonical_words(title):
+    """
+    canonical_title()'s words, each with whether a platform name follows it.
+
+    Fillers between the word and the platform don't count, so in "Final
+    Fantasy X for PS2" the "x" comes right before the platform.
+
+    Args:
+        title (str): Product title
+
+    Returns:
+        list: (word, before_platform) tuples, in title order
+    """
+    text = _PLATFORM_PATTERN.sub(f' {_PLATFORM_MARK} ', _APOSTROPHES.sub('', title.lower()))
+    text = _ANY_CONDITION_PATTERN.sub(' ', text)
+    words = []
+    for word in _MARKED_WORD.findall(text):
+        if word == _PLATFORM_MARK:
+            if words:
+                words[-1] = (words[-1][0], True)
+        elif word not in _FILLER_WORDS:
+            words.append((word, False))
+    return words
+
+def _legacy_classify_platform(title):
+    """The per-keyword substring loop the scrapers used before this module."""
+    for platform, keywords in PLATFORM_KEYWORDS.items():
+        if any(keyword in title.lower() for keyword in keywords):
+            return platform
+    return None
+
+SAMPLE_TITLES = [
+    "Legend of Zelda Ocarina of Time - Nintendo 64",
+    "Final Fantasy X PlayStation 2 Greatest Hits",
+    "Pokemon Yellow Game Boy Color Cartridge",
+    "Sonic the Hedgehog 2 Sega Genesis Complete",
+    "Halo 3 Xbox 360 CIB",
+    "Mario Kart 8 Wii U",
+    "Metroid Prime Nintendo GameCube Loose Disc",
+    "Super Mario World SNES Super Nintendo",
+    "Crash Bandicoot PS1 Black Label",
+    "Pokemon Trading Cards Binder",
+]
+
+def run_benchmark(count=100000):
+    """Time the legacy loop, per-title and batch classification on count titles."""
+    titles = (SAMPLE_TITLES * (count // len(SAMPLE_TITLES) + 1))[:count]
+    results = {}
+
+    for name, classify in [
+        ('legacy loop', lambda: [_legacy_classify_platform(t) for t in titles]),
+        ('compiled per-title', lambda: [classify_platform(t) for t in titles]),
+        ('compiled batch', lambda: classify_platforms(titles)),
+    ]:
+        start = time.perf_counter()
+        classify()
+        elapsed = time.perf_counter() - start
+        results[name] = round(count / elapsed)
+        print(f"{name:20} {results[name]:>12,} titles/s", file=sys.stderr)
+
+    return results
+
+def main():
+    """Classify titles from the command line, or run the throughput benchmark."""
+    parser = argparse.ArgumentParser(description='Classify listing titles by platform and condition.')
+    parser.add_argument('titles', nargs='*', help='Titles to classify')
+    parser.add_argument('--bench', action='store_true', help='Run the throughput benchmark')
+    parser.add_argument('--count', type=int, default=100000, help='Titles per benchmark run')
+
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.count)
+        return
+
+    for title, platform in zip(args.titles, classify_platforms(args.titles)):
+        print(f"{title}: platform={platform} condition={classify_condition(title)}")
+
+if __name__ == "__main__":
+    main()
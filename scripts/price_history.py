@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Price History
+
+An append-only record of every price observed for every listing, compact
+enough to keep forever. Each live search appends one chunk of rows:
+
+    product_id   int64    product_key(product), stable across runs
+    timestamp    int64    Seconds since the epoch
+    price_cents  int32    MISSING_CENTS when the store showed no price
+    in_stock     bool
+
+Each column is its own .npy file in the chunk's directory, sorted by
+(product_id, timestamp), so reads memory-map only the columns they need and
+find a product with a binary search instead of a scan. A row takes 21 bytes
+against several hundred for a cached product dict.
+
+Small chunks are merged as they pile up: the newest chunks are combined
+while they are no bigger than what has been gathered so far, so each row is
+rewritten only a logarithmic number of times. Merges run on a background
+thread, so the search whose append crosses COMPACT_CHUNKS doesn't pay for
+one. Which chunks are live is tracked in a small SQLite manifest, so
+appends and merges from several processes never show a reader a row twice.
+
+Settings:
+    LOOTSCOUT_PRICE_HISTORY_DIR      Directory for the chunks (default: ~/.cache/lootscout/price_history)
+    LOOTSCOUT_PRICE_HISTORY_DISABLED Set to 1 to stop recording
+
+Requires NumPy. Run directly to print totals, with --url to print one
+listing's history, or with --compact to merge chunks now.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from prices import MISSING_CENTS
+from product_ids import canonical_url
+
+HISTORY_DIR = Path(os.path.expanduser(os.environ.get('LOOTSCOUT_PRICE_HISTORY_DIR',
+                                                     '~/.cache/lootscout/price_history')))
+DISABLED = os.environ.get('LOOTSCOUT_PRICE_HISTORY_DISABLED', '') == '1'
+
+COLUMNS = {
+    'product_id': 'int64',
+    'timestamp': 'int64',
+    'price_cents': 'int32',
+    'in_stock': 'bool',
+}
+
+# Merge once this many chunks are live
+COMPACT_CHUNKS = 32
+
+# A chunk claimed by a merge that never finished is released after this long
+COMPACT_TIMEOUT = 600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    name TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    min_id INTEGER NOT NULL,
+    max_id INTEGER NOT NULL,
+    min_ts INTEGER NOT NULL,
+    max_ts INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    compacting_at REAL
+);
+"""
+
+_local = threading.local()
+
+# Wakes the background merge thread, started by the first append that asks
+# for a merge
+_compact_wake = threading.Event()
+_compactor = None
+_compactor_lock = threading.Lock()
+
+# Whether record() has reported that NumPy is missing
+_reported_missing_numpy = False
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("price_history requires numpy")
+
+def _connect():
+    """Return this thread's connection to the manifest, creating it on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and getattr(_local, 'path', None) == HISTORY_DIR:
+        return conn
+
+    HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(HISTORY_DIR / 'manifest.db'), timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(_SCHEMA)
+    _local.conn = conn
+    _local.path = HISTORY_DIR
+    return conn
+
+def product_key(product):
+    """
+    Return the id a listing's history is kept under.
+
+    Derived from the listing's canonical URL (see product_ids.canonical_url),
+    so the same listing gets the same id in every process and from every
+    search that finds it, whatever tracking parameters its link carried.
+    """
+    digest = hashlib.blake2b(canonical_url(product['url']).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+def _write_chunk(columns):
+    """Write sorted columns as a new chunk directory; return (name, manifest row)."""
+    name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+    tmp = HISTORY_DIR / f".tmp-{name}"
+    tmp.mkdir(parents=True)
+    for column, dtype in COLUMNS.items():
+        np.save(tmp / f"{column}.npy", np.ascontiguousarray(columns[column], dtype=dtype))
+    os.rename(tmp, HISTORY_DIR / name)
+
+    ids, timestamps = columns['product_id'], columns['timestamp']
+    return name, (name, len(ids), int(ids[0]), int(ids[-1]),
+                  int(timestamps.min()), int(timestamps.max()), time.time())
+
+def _sorted(columns):
+    """Sort columns by (product_id, timestamp)."""
+    order = np.lexsort((columns['timestamp'], columns['product_id']))
+    return {column: np.asarray(values)[order] for column, values in columns.items()}
+
+def append(product_ids, timestamps, price_cents, in_stock):
+    """
+    Append observations as one new chunk.
+
+    Once COMPACT_CHUNKS chunks are live, a merge is started on the
+    background thread; append itself never merges.
+
+    Args:
+        product_ids (array-like): int64 ids from product_key()
+        timestamps (array-like): Seconds since the epoch
+        price_cents (array-like): Prices, MISSING_CENTS for none
+        in_stock (array-like): Whether each listing could be bought
+
+    Returns:
+        int: Rows written
+    """
+    _require_numpy()
+    columns = _sorted({
+        'product_id': np.asarray(product_ids, dtype=np.int64),
+        'timestamp': np.asarray(timestamps, dtype=np.int64),
+        'price_cents': np.asarray(price_cents, dtype=np.int32),
+        'in_stock': np.asarray(in_stock, dtype=bool),
+    })
+    if not len(columns['product_id']):
+        return 0
+
+    _, row = _write_chunk(columns)
+    conn = _connect()
+    conn.execute(
+        "INSERT INTO chunks (name, rows, min_id, max_id, min_ts, max_ts, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", row,
+    )
+    live = conn.execute("SELECT COUNT(*) FROM chunks WHERE compacting_at IS NULL").fetchone()[0]
+    if live >= COMPACT_CHUNKS:
+        _wake_compactor()
+    return len(columns['product_id'])
+
+def _wake_compactor():
+    """Ask the background merge thread for a merge, starting it on first use."""
+    global _compactor
+    with _compactor_lock:
+        if _compactor is None or not _compactor.is_alive():
+            _compactor = threading.Thread(target=_compact_loop, name='price-history-compactor', daemon=True)
+            _compactor.start()
+    _compact_wake.set()
+
+def _compact_loop():
+    """Merge chunks whenever an append asks for it, off the search path."""
+    while True:
+        _compact_wake.wait()
+        _compact_wake.clear()
+        try:
+            compact()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not merge price history chunks: {str(e)}", file=sys.stderr)
+
+def record(products, observed_at=None):
+    """
+    Append one search's products to the history.
+
+    Scrapers call this once per live search. Failures are reported on
+    stderr and never fail the search; without NumPy nothing is recorded,
+    which is reported once per process.
+
+    Args:
+        products (list): Product dictionaries with "url" and "price_cents";
+            "in_stock" defaults to True since the scrapers skip sold-out items
+        observed_at (float, optional): When the prices were seen (defaults to now)
+
+    Returns:
+        int: Rows written
+    """
+    global _reported_missing_numpy
+    if DISABLED or not products:
+        return 0
+    if np is None:
+        if not _reported_missing_numpy:
+            _reported_missing_numpy = True
+            print("Price history is not being recorded: numpy is not installed", file=sys.stderr)
+        return 0
+    observed_at = int(time.time() if observed_at is None else observed_at)
+    try:
+        return append(
+            [product_key(product) for product in products],
+            np.full(len(products), observed_at, dtype=np.int64),
+            [MISSING_CENTS if product.get('price_cents') is None else product['price_cents']
+             for product in products],
+            [product.get('in_stock', True) for product in products],
+        )
+    except (OSError, sqlite3.Error) as e:
+        print(f"Could not record price history: {str(e)}", file=sys.stderr)
+        return 0
+
+def _load_chunk(name, columns):
+    """Memory-map the given columns of one chunk."""
+    return {column: np.load(HISTORY_DIR / name / f"{column}.npy", mmap_mode='r') for column in columns}
+
+def _read(where, params, reader):
+    """
+    Run reader(name) over every live chunk matching the manifest filter.
+
+    A merge can delete a chunk after the manifest was read; the read is
+    then retried against the new manifest.
+    """
+    for attempt in range(3):
+        names = [name for (name,) in _connect().execute(
+            f"SELECT name FROM chunks WHERE {where} ORDER BY name", params
+        )]
+        try:
+            return [part for part in (reader(name) for name in names) if part is not None]
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+    return []
+
+def _concat(parts, columns):
+    """Join per-chunk column slices."""
+    if not parts:
+        return {column: np.empty(0, dtype=COLUMNS[column]) for column in columns}
+    return {column: np.concatenate([part[column] for part in parts]) for column in columns}
+
+def history(product_id, start=None, end=None):
+    """
+    Return one listing's observations, oldest first.
+
+    Args:
+        product_id (int): Id from product_key()
+        start (float, optional): Earliest timestamp to include
+        end (float, optional): Only include timestamps before this
+
+    Returns:
+        dict: "timestamp", "price_cents" and "in_stock" NumPy arrays
+    """
+    _require_numpy()
+    columns = ['timestamp', 'price_cents', 'in_stock']
+    lo = int(start) if start is not None else -2 ** 63
+    hi = int(end) if end is not None else 2 ** 63 - 1
+
+    def reader(name):
+        chunk = _load_chunk(name, ['product_id'] + columns)
+        # Chunks are sorted by product id, so the listing is one slice
+        left = np.searchsorted(chunk['product_id'], product_id, side='left')
+        right = np.searchsorted(chunk['product_id'], product_id, side='right')
+        if left == right:
+            return None
+        timestamps = chunk['timestamp'][left:right]
+        mask = (timestamps >= lo) & (timestamps < hi)
+        return {column: np.asarray(chunk[column][left:right][mask]) for column in columns}
+
+    parts = _read("min_id <= :id AND max_id >= :id AND max_ts >= :lo AND min_ts < :hi",
+                  {'id': product_id, 'lo': lo, 'hi': hi}, reader)
+    result = _concat(parts, columns)
+    order = np.argsort(result['timestamp'], kind='stable')
+    return {column: values[order] for column, values in result.items()}
+
+def query(start=None, end=None, product_ids=None):
+    """
+    Return every observation in a time range, optionally for some listings.
+
+    Args:
+        start (float, optional): Earliest timestamp to include
+        end (float, optional): Only include timestamps before this
+        product_ids (array-like, optional): Ids to include (defaults to all)
+
+    Returns:
+        dict: "product_id", "timestamp", "price_cents" and "in_stock" NumPy
+        arrays, sorted by (product_id, timestamp)
+    """
+    _require_numpy()
+    columns = list(COLUMNS)
+    lo = int(start) if start is not None else -2 ** 63
+    hi = int(end) if end is not None else 2 ** 63 - 1
+    wanted = None if product_ids is None else np.unique(np.asarray(product_ids, dtype=np.int64))
+
+    def reader(name):
+        chunk = _load_chunk(name, columns)
+        timestamps = chunk['timestamp']
+        mask = (timestamps >= lo) & (timestamps < hi)
+        if wanted is not None:
+            mask &= np.isin(chunk['product_id'], wanted, assume_unique=False)
+        if not mask.any():
+            return None
+        return {column: np.asarray(chunk[column][mask]) for column in columns}
+
+    parts = _read("max_ts >= :lo AND min_ts < :hi", {'lo': lo, 'hi': hi}, reader)
+    result = _concat(parts, columns)
+    return _sorted(result) if len(parts) > 1 else result
+
+def compact(force=False):
+    """
+    Merge the newest chunks while they are no bigger than what has been
+    gathered so far (everything with force=True).
+
+    Returns:
+        int: Chunks merged (0 if there was nothing to do or another process
+        is already merging)
+    """
+    _require_numpy()
+    conn = _connect()
+    now = time.time()
+
+    # Claim the chunks to merge, so concurrent merges never overlap
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        claimed = conn.execute(
+            "SELECT 1 FROM chunks WHERE compacting_at > ? LIMIT 1", (now - COMPACT_TIMEOUT,)
+        ).fetchone()
+        chunks = conn.execute("SELECT name, rows FROM chunks ORDER BY name DESC").fetchall()
+        selected, gathered = [], 0
+        if not claimed:
+            for name, rows in chunks:
+                if selected and not force and rows > gathered:
+                    break
+                selected.append(name)
+                gathered += rows
+        if len(selected) < 2:
+            conn.execute('COMMIT')
+            return 0
+        conn.executemany("UPDATE chunks SET compacting_at = ? WHERE name = ?", [(now, name) for name in selected])
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+    try:
+        parts = [{column: np.asarray(values) for column, values in _load_chunk(name, COLUMNS).items()}
+                 for name in selected]
+        _, row = _write_chunk(_sorted(_concat(parts, list(COLUMNS))))
+    except BaseException:
+        conn.execute("UPDATE chunks SET compacting_at = NULL WHERE name IN ({})".format(
+            ','.join('?' * len(selected))), selected)
+        raise
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(
+            "INSERT INTO chunks (name, rows, min_id, max_id, min_ts, max_ts, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", row,
+        )
+        conn.executemany("DELETE FROM chunks WHERE name = ?", [(name,) for name in selected])
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+    for name in selected:
+        shutil.rmtree(HISTORY_DIR / name, ignore_errors=True)
+    return len(selected)
+
+def history_stats():
+    """
+    Report the history's size.
+
+    Returns:
+        dict: {"chunks", "rows", "bytes", "first", "last"}
+    """
+    conn = _connect()
+    chunks, rows, first, last = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(rows), 0), MIN(min_ts), MAX(max_ts) FROM chunks"
+    ).fetchone()
+    size = sum(path.stat().st_size for path in HISTORY_DIR.glob('[0-9]*/*.npy'))
+    return {'chunks': chunks, 'rows': rows, 'bytes': size, 'first': first, 'last': last}
+
+def main():
+    """Print history totals, one listing's history, or merge chunks."""
+    parser = argparse.ArgumentParser(description='Inspect the price history store.')
+    parser.add_argument('--url', type=str, help="Print this listing's observations")
+    parser.add_argument('--compact', action='store_true', help='Merge every chunk into one')
+
+    args = parser.parse_args()
+    _require_numpy()
+
+    if args.compact:
+        print(f"Merged {compact(force=True)} chunks", file=sys.stderr)
+    if args.url:
+        observations = history(product_key({'url': args.url}))
+        print(json.dumps([
+            {'timestamp': int(ts), 'price_cents': None if cents == MISSING_CENTS else int(cents),
+             'in_stock': bool(stock)}
+            for ts, cents, stock in zip(observations['timestamp'], observations['price_cents'],
+                                        observations['in_stock'])
+        ]))
+    else:
+        print(json.dumps(history_stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
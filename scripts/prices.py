@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Price Normalization
+
+Stores return prices as display strings ("$40.97", "On Sale:$40.97",
+"$1,040.97", "Price not available"). This module turns them into integer
+cents plus an ISO currency code once, at scrape time, so consumers can sort
+and filter numerically without re-parsing strings.
+"""
+
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_CURRENCY = 'USD'
+
+CURRENCY_SYMBOLS = {
+    '$': 'USD',
+    '£': 'GBP',
+    '€': 'EUR',
+    '¥': 'JPY',
+}
+
+# Optional currency symbol, then an amount like 1,040.97 / 40 / 40.9 / .99
+_PRICE_PATTERN = re.compile(r'([$£€¥])?\s*(?:(\d{1,3}(?:,\d{3})+|\d+)(?:\.(\d{1,2}))?|\.(\d{1,2}))')
+
+# Value used for "no price" in NumPy arrays
+MISSING_CENTS = -1
+
+def parse_price(text):
+    """
+    Parse a display price into integer cents and a currency code.
+
+    The first amount in the string wins, so "On Sale:$40.97" is 4097 and a
+    range like "$10.00 - $20.00" is its lower bound.
+
+    Args:
+        text (str): Display price
+
+    Returns:
+        tuple: (price_cents, currency); price_cents is None if no amount was found
+    """
+    if not text:
+        return None, DEFAULT_CURRENCY
+
+    match = _PRICE_PATTERN.search(text)
+    if not match:
+        return None, DEFAULT_CURRENCY
+
+    symbol, whole, fraction, bare_fraction = match.groups()
+    fraction = fraction or bare_fraction or '0'
+    cents = int((whole or '0').replace(',', '')) * 100 + int(fraction.ljust(2, '0'))
+    return cents, CURRENCY_SYMBOLS.get(symbol, DEFAULT_CURRENCY)
+
+def parse_prices(texts):
+    """
+    Parse many display prices in one call.
+
+    Args:
+        texts (list): Display prices
+
+    Returns:
+        list: (price_cents, currency) tuples, in order
+    """
+    return [parse_price(text) for text in texts]
+
+def price_cents_array(texts):
+    """
+    Parse many display prices into a NumPy int64 array of cents.
+
+    Prices that can't be parsed are MISSING_CENTS. Requires NumPy.
+    """
+    if np is None:
+        raise ImportError("price_cents_array requires numpy")
+    return np.fromiter(
+        (MISSING_CENTS if cents is None else cents for cents, _ in parse_prices(texts)),
+        dtype=np.int64,
+        count=len(texts),
+    )
+
+def cents_from_amount(amount):
+    """
+    Convert a numeric amount (e.g. 40.97 from a JSON API) to integer cents.
+
+    Goes through Decimal so values like 0.29 don't round down to 28 cents.
+    """
+    if amount is None or isinstance(amount, bool):
+        return None
+    try:
+        return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        return None
+
+def format_price(cents, currency=DEFAULT_CURRENCY):
+    """Format integer cents as a display price, e.g. 4097 -> "$40.97"."""
+    if cents is None:
+        return "Price not available"
+    symbol = next((s for s, code in CURRENCY_SYMBOLS.items() if code == currency), '')
+    return f"{symbol}{cents // 100:,}.{cents % 100:02d}"
+
+def filter_and_sort(products, sort=None, min_cents=None, max_cents=None):
+    """
+    Price-filter and sort products by price_cents in a single pass.
+
+    Args:
+        products (list): Product dictionaries with price_cents
+        sort (str, optional): "price-asc", "price-desc" or "deal" (highest
+            deal_score first, unscored products after scored ones)
+        min_cents (int, optional): Lowest price to keep (inclusive)
+        max_cents (int, optional): Highest price to keep (exclusive)
+
+    Returns:
+        list: Matching products; products without a price are dropped when
+        filtering and sorted last otherwise
+    """
+    filtering = min_cents is not None or max_cents is not None
+    priced = []
+    unpriced = []
+
+    for product in products:
+        cents = product.get('price_cents')
+        if cents is None:
+            if not filtering:
+                unpriced.append(product)
+            continue
+        if min_cents is not None and cents < min_cents:
+            continue
+        if max_cents is not None and cents >= max_cents:
+            continue
+        priced.append(product)
+
+    if sort in ('price-asc', 'price-desc'):
+        priced.sort(key=lambda p: p['price_cents'], reverse=(sort == 'price-desc'))
+    elif sort == 'deal':
+        priced.sort(key=lambda p: (p.get('deal_score') is None, -(p.get('deal_score') or 0)))
+
+    return priced + unpriced
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Product IDs and Snapshot Diffs
+
+Every scraper names its products with stable_id(), so the same listing gets
+the same id in every process and on every run. That keeps favorites and
+caches working, and lets a search be compared with the previous one. The
+id is a digest of the listing's canonical URL:
+- The scheme and host are lowercased.
+- Default ports and tracking parameters are dropped, and the remaining
+  query parameters are sorted.
+- The fragment is dropped, except for hash-bang routes like JJGames'
+  "#!/~/product/123", which name the product.
+
+fingerprint() digests the fields of a listing that change (title, price,
+stock), so a writer can tell a listing it has already stored from one that
+needs rewriting without comparing whole product dicts.
+
+diff_snapshot() compares a search's products with the previous snapshot of
+the same search and returns only what changed (added, removed, repriced or
+otherwise changed listings). Snapshots are kept in the result cache's SQLite
+database, so every worker process sees the same previous snapshot.
+"""
+
+import sys
+import time
+import hashlib
+import sqlite3
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import result_cache
+
+# Query parameters that track the visitor rather than name the page
+TRACKING_PARAMS = {'gclid', 'fbclid', 'msclkid', 'ref', 'sid', 'mc_cid', 'mc_eid'}
+TRACKING_PREFIXES = ('utm_',)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    key TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    price_cents INTEGER,
+    taken_at REAL NOT NULL,
+    PRIMARY KEY (key, product_id)
+) WITHOUT ROWID;
+"""
+
+def _connect():
+    """Return this thread's connection to the shared cache database."""
+    return result_cache.connect(_SCHEMA)
+
+def canonical_url(url):
+    """
+    Normalize a listing URL so every spelling of it compares equal.
+
+    Args:
+        url (str): Absolute URL
+
+    Returns:
+        str: The canonical URL
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    params = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in TRACKING_PARAMS and not name.lower().startswith(TRACKING_PREFIXES)
+    )
+    # Single-page stores route products through "#!/..." fragments
+    fragment = parts.fragment if parts.fragment.startswith('!') else ''
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(params), fragment))
+
+def stable_id(prefix, url):
+    """
+    Build a product id that is the same on every run.
+
+    Args:
+        prefix (str): Id prefix naming the store (e.g. 'lukie')
+        url (str): Listing URL
+
+    Returns:
+        str: "<prefix>-<md5 of the canonical URL>"
+    """
+    return f"{prefix}-{hashlib.md5(canonical_url(url).encode()).hexdigest()}"
+
+def fingerprint(product):
+    """
+    Digest the fields of a listing that change between searches.
+
+    Returns:
+        str: 16 hex characters; equal fingerprints mean nothing a writer
+        stores has changed
+    """
+    content = '\x1f'.join([
+        product.get('title') or '',
+        str(product.get('price_cents')),
+        product.get('currency') or '',
+        str(product.get('in_stock', True)),
+        str(product.get('quantity')),
+        product.get('condition') or '',
+    ])
+    return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+def diff_snapshot(source, query, platform, products, deep=False, scope=''):
+    """
+    Compare a search's products with the previous snapshot of the same
+    search, then make them the new snapshot.
+
+    Args:
+        source (str): Source name
+        query (str): Search term
+        platform (str, optional): Platform filter the search used
+        products (list): The search's products
+        deep (bool, optional): Whether the search read every result page
+        scope (str, optional): Snapshot namespace, so separate consumers of
+            the same search don't use up each other's changes
+
+    Returns:
+        dict: {"added": [products], "removed": [{"id", "price_cents"}],
+        "repriced": [products with "previous_price_cents"], "changed":
+        [products whose title or stock changed], "unchanged": count,
+        "first_snapshot": True if there was nothing to compare with}
+    """
+    key = result_cache.cache_key(source, query, platform, deep)
+    if scope:
+        key = f"{scope}\x1f{key}"
+    current = {}
+    for product in products:
+        product_id = product.get('id') or stable_id(source, product['url'])
+        current[product_id] = (product, fingerprint(product))
+
+    delta = {'added': [], 'removed': [], 'repriced': [], 'changed': [], 'unchanged': 0, 'first_snapshot': False}
+    try:
+        conn = _connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            previous = {
+                product_id: (stored_fingerprint, price_cents)
+                for product_id, stored_fingerprint, price_cents in conn.execute(
+                    "SELECT product_id, fingerprint, price_cents FROM snapshots WHERE key = ?", (key,)
+                )
+            }
+            delta['first_snapshot'] = not previous
+
+            for product_id, (product, product_fingerprint) in current.items():
+                if product_id not in previous:
+                    delta['added'].append(product)
+                elif previous[product_id][0] == product_fingerprint:
+                    delta['unchanged'] += 1
+                elif previous[product_id][1] != product.get('price_cents'):
+                    delta['repriced'].append({**product, 'previous_price_cents': previous[product_id][1]})
+                else:
+                    delta['changed'].append(product)
+            delta['removed'] = [
+                {'id': product_id, 'price_cents': price_cents}
+                for product_id, (_, price_cents) in previous.items() if product_id not in current
+            ]
+
+            # Only rows that changed are written
+            now = time.time()
+            conn.executemany("DELETE FROM snapshots WHERE key = ? AND product_id = ?",
+                             [(key, removed['id']) for removed in delta['removed']])
+            conn.executemany(
+                "INSERT OR REPLACE INTO snapshots (key, product_id, fingerprint, price_cents, taken_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, product_id, product_fingerprint, product.get('price_cents'), now)
+                 for product_id, (product, product_fingerprint) in current.items()
+                 if previous.get(product_id, (None,))[0] != product_fingerprint],
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    except sqlite3.Error as e:
+        print(f"Could not diff snapshot: {str(e)}", file=sys.stderr)
+        delta['added'] = [product for product, _ in current.values()]
+        delta['first_snapshot'] = True
+    return delta
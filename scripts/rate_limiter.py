@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Per-Host Rate Limiter
+
+A token bucket per store host, kept in the result cache's SQLite database so
+every worker process draws from the same buckets. A request that finds a
+token goes straight through; otherwise it reserves the next token and waits
+only as long as it takes to refill. A 429 or 503 with Retry-After blocks the
+host for every process until the store says it's OK to come back.
+
+If the database stays locked for DB_TIMEOUT seconds, the request goes
+through unthrottled instead of waiting. acquire_async() makes its
+reservation on a worker thread, so the event loop never waits on SQLite.
+
+Settings:
+    LOOTSCOUT_RATE_LIMIT  Default requests per second per host (default: 2)
+    LOOTSCOUT_RATE_BURST  Default bucket size (default: 5)
+
+Per-host overrides live in RATE_LIMITS.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import result_cache
+
+DEFAULT_RATE = float(os.environ.get('LOOTSCOUT_RATE_LIMIT', '2'))
+DEFAULT_BURST = float(os.environ.get('LOOTSCOUT_RATE_BURST', '5'))
+
+# Host -> (requests per second, burst). DKOldies searches drive a full
+# browser page load, so they are spaced out more.
+RATE_LIMITS = {
+    'www.dkoldies.com': (1.0, 2.0),
+}
+
+# How long to back off after a 429/503 that doesn't say
+DEFAULT_RETRY_AFTER = 10.0
+
+# Seconds to wait for another process's lock on the buckets. Past that the
+# request goes through unthrottled rather than stalling a search.
+DB_TIMEOUT = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    host TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+class RateLimitedError(requests.RequestException):
+    """Raised when a request would have to wait longer than allowed."""
+
+_stats_lock = threading.Lock()
+
+# host -> {"requests", "delayed", "wait_ms_total", "wait_ms_max", "rejected", "retry_after"}
+_wait_stats = {}
+
+def _connect():
+    """Return this thread's connection to the shared cache database."""
+    return result_cache.connect(_SCHEMA, DB_TIMEOUT)
+
+def _limits(host, limits=None):
+    return limits or RATE_LIMITS.get(host, (DEFAULT_RATE, DEFAULT_BURST))
+
+def _record_wait(host, wait, rejected=False):
+    with _stats_lock:
+        stats = _wait_stats.setdefault(host, {
+            'requests': 0, 'delayed': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0,
+            'rejected': 0, 'retry_after': 0,
+        })
+        if rejected:
+            stats['rejected'] += 1
+            return
+        stats['requests'] += 1
+        if wait > 0:
+            stats['delayed'] += 1
+            stats['wait_ms_total'] += wait * 1000
+            stats['wait_ms_max'] = max(stats['wait_ms_max'], wait * 1000)
+
+def reserve(host, max_wait=None, limits=None):
+    """
+    Take a token for host, reserving the next one if the bucket is empty.
+
+    Args:
+        host (str): Host name
+        max_wait (float, optional): Longest acceptable wait in seconds; a
+            longer wait reserves nothing and raises RateLimitedError
+        limits (tuple, optional): (requests per second, burst) for this
+            bucket, instead of RATE_LIMITS or the defaults
+
+    Returns:
+        float: Seconds the caller must wait before sending its request
+    """
+    rate, burst = _limits(host, limits)
+    try:
+        conn = _connect()
+        now = time.time()
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at, blocked_until FROM rate_buckets WHERE host = ?", (host,)
+            ).fetchone()
+            tokens, updated_at, blocked_until = row if row else (burst, now, 0.0)
+
+            # Refill for the time since the last request, up to the burst size.
+            # Tokens below zero are requests already queued for the future.
+            start = max(now, blocked_until)
+            tokens = min(burst, tokens + max(0.0, start - updated_at) * rate)
+            wait = (start - now) + (max(0.0, 1 - tokens) / rate)
+
+            if max_wait is not None and wait > max_wait:
+                conn.execute('COMMIT')
+                _record_wait(host, wait, rejected=True)
+                raise RateLimitedError(f"Rate limit for {host} needs a {wait:.1f}s wait")
+
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (host, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)",
+                (host, tokens - 1, max(start, updated_at), blocked_until),
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+    except sqlite3.Error as e:
+        # Never let the limiter take a scraper down; just go unthrottled
+        print(f"Rate limiter unavailable: {str(e)}", file=sys.stderr)
+        wait = 0.0
+
+    _record_wait(host, wait)
+    return wait
+
+def acquire(host, max_wait=None, limits=None):
+    """Block the calling thread until a request to host may be sent."""
+    wait = reserve(host, max_wait, limits)
+    if wait > 0:
+        time.sleep(wait)
+    return wait
+
+async def acquire_async(host, max_wait=None, limits=None):
+    """Wait on the event loop until a request to host may be sent."""
+    # The reservation is a SQLite write, so it runs off the event loop
+    wait = await asyncio.to_thread(reserve, host, max_wait, limits)
+    if wait > 0:
+        await asyncio.sleep(wait)
+    return wait
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or an HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+def block(host, seconds):
+    """Stop every process sending requests to host for the next `seconds`."""
+    with _stats_lock:
+        if host in _wait_stats:
+            _wait_stats[host]['retry_after'] += 1
+
+    print(f"Backing off {host} for {seconds:.1f}s", file=sys.stderr)
+    try:
+        conn = _connect()
+        until = time.time() + seconds
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(
+            # Buckets don't refill while blocked, so the host doesn't get a
+            # full burst the moment the block ends
+            "INSERT INTO rate_buckets (host, tokens, updated_at, blocked_until) VALUES (?, 0, ?, ?) "
+            "ON CONFLICT (host) DO UPDATE SET tokens = MIN(tokens, 0), "
+            "updated_at = MAX(updated_at, excluded.updated_at), "
+            "blocked_until = MAX(blocked_until, excluded.blocked_until)",
+            (host, until, until),
+        )
+        conn.execute('COMMIT')
+    except sqlite3.Error as e:
+        print(f"Rate limiter unavailable: {str(e)}", file=sys.stderr)
+
+def note_response(host, status_code, headers):
+    """Back off a host that answered 429, or 503 with a Retry-After header."""
+    retry_after = parse_retry_after(headers.get('Retry-After'))
+    if status_code == 429:
+        block(host, DEFAULT_RETRY_AFTER if retry_after is None else retry_after)
+    elif status_code == 503 and retry_after is not None:
+        block(host, retry_after)
+
+def limiter_stats():
+    """
+    Return per-host queue wait metrics for this process.
+
+    Returns:
+        dict: host -> {"requests", "delayed", "wait_ms_avg", "wait_ms_max",
+                       "rejected", "retry_after"}
+    """
+    report = {}
+    with _stats_lock:
+        for host, stats in _wait_stats.items():
+            report[host] = {
+                'requests': stats['requests'],
+                'delayed': stats['delayed'],
+                'wait_ms_avg': round(stats['wait_ms_total'] / stats['requests'], 1) if stats['requests'] else 0.0,
+                'wait_ms_max': round(stats['wait_ms_max'], 1),
+                'rejected': stats['rejected'],
+                'retry_after': stats['retry_after'],
+            }
+    return report
+
+if __name__ == "__main__":
+    print(json.dumps({
+        'rate': DEFAULT_RATE,
+        'burst': DEFAULT_BURST,
+        'overrides': {host: {'rate': r, 'burst': b} for host, (r, b) in RATE_LIMITS.items()},
+    }, indent=2))
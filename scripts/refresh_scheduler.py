@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+"""
+Catalog Refresh Scheduler
+
+Keeps the catalog index (catalog_index.py) current between full crawls by
+re-checking only the listings most likely to have changed.
+
+Each cycle:
+1. Reads change signals from the stores. VGNY, LukieGames and DKOldies
+   publish sitemaps with a lastmod per product page; a listing whose lastmod
+   is newer than our last check is flagged as changed. Child sitemaps whose
+   own lastmod hasn't moved since the previous cycle are skipped. JJGames is
+   asked for items updated since the last sync (Ecwid's updatedFrom), and
+   those come back complete, so they are written straight to the index.
+2. Ranks every listing by how overdue it is. A listing's refresh interval is
+   REFRESH_INTERVAL divided by its volatility: recent repricing, low stock
+   and frequent views in index search results each make it more volatile,
+   down to MIN_INTERVAL. Flagged listings jump the queue.
+3. Re-searches the most overdue listings by title, at most `budget`
+   searches per cycle, through the usual rate limits and circuit breakers.
+   Each search reads every result page with the crawler's fetchers, so a
+   generic title listed across many pages is searched in full. Listings
+   found again are updated; a listing missing from a complete title search
+   MAX_MISSES times in a row is dropped. A search that came back empty, hit
+   a page with no product cards or stopped at REFRESH_MAX_PAGES proves
+   nothing about the listings it didn't find, so they aren't counted as
+   missing.
+
+Every cycle prints a report: listings refreshed, signals read, bytes
+fetched and staleness percentiles per source.
+
+Settings:
+    LOOTSCOUT_REFRESH_INTERVAL      Seconds between checks of a stable listing (default: 86400)
+    LOOTSCOUT_REFRESH_MIN_INTERVAL  Shortest interval for a volatile listing (default: 3600)
+    LOOTSCOUT_REFRESH_BUDGET        Most title searches per cycle (default: 50)
+    LOOTSCOUT_REFRESH_MAX_PAGES     Most result pages read per title search (default: 20)
+
+Run with no arguments for one cycle, or with --every SECONDS to keep going.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+
+import requests
+
+import http_client
+import catalog_index
+import price_history
+import scheduler
+from circuit_breaker import CircuitOpenError
+from sources import shutdown
+
+REFRESH_INTERVAL = float(os.environ.get('LOOTSCOUT_REFRESH_INTERVAL', str(24 * 3600)))
+MIN_INTERVAL = float(os.environ.get('LOOTSCOUT_REFRESH_MIN_INTERVAL', '3600'))
+REFRESH_BUDGET = int(os.environ.get('LOOTSCOUT_REFRESH_BUDGET', '50'))
+REFRESH_MAX_PAGES = int(os.environ.get('LOOTSCOUT_REFRESH_MAX_PAGES', '20'))
+
+# A listing missing from this many title searches in a row is dropped
+MAX_MISSES = 3
+
+# Volatility signals: repriced within REPRICE_WINDOW, at most LOW_STOCK
+# left, and index search hits (each VIEWS_PER_POINT views add one point,
+# up to MAX_VIEW_POINTS)
+REPRICE_WINDOW = 7 * 24 * 3600
+LOW_STOCK = 3
+VIEWS_PER_POINT = 10
+MAX_VIEW_POINTS = 3
+
+# Priority added to a listing its store says has changed
+CHANGED_BOOST = 10
+
+# Title searches run at once (each host is still held to its rate limit)
+REFRESH_CONCURRENCY = 4
+
+SITEMAP_URLS = {
+    'vgny': "https://videogamesnewyork.com/xmlsitemap.php",
+    'lukie-games': "https://www.lukiegames.com/sitemap.xml",
+    'dkoldies': "https://www.dkoldies.com/sitemap.xml",
+}
+
+SITEMAP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36',
+    'Accept': 'application/xml,text/xml;q=0.9,*/*;q=0.8',
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sitemaps (
+    url TEXT PRIMARY KEY,
+    lastmod TEXT,
+    checked_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refresh_sync (
+    source TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+"""
+
+_local = threading.local()
+
+def _connect():
+    """Return this thread's connection to the catalog database."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and getattr(_local, 'path', None) == catalog_index.CATALOG_DB:
+        return conn
+
+    # Opening the index first creates (or migrates) the products table
+    catalog_index.catalog_stats()
+    conn = sqlite3.connect(str(catalog_index.CATALOG_DB), timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(_SCHEMA)
+    _local.conn = conn
+    _local.path = catalog_index.CATALOG_DB
+    return conn
+
+def _write(sql, rows):
+    """Run one statement over many rows in a single transaction; return rows changed."""
+    conn = _connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        changed = conn.executemany(sql, rows).rowcount
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return max(changed, 0)
+
+def parse_lastmod(value):
+    """
+    Parse a sitemap lastmod (W3C datetime, or just a date) to a timestamp.
+
+    Returns:
+        float: Seconds since the epoch, or None if the value is missing or malformed
+    """
+    if not value:
+        return None
+    value = value.strip().replace('Z', '+00:00')
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def parse_sitemap(content):
+    """
+    Read a sitemap or sitemap index without building the whole tree.
+
+    Args:
+        content (bytes): Sitemap XML
+
+    Returns:
+        tuple: ([(child sitemap URL, lastmod)], [(page URL, lastmod)]),
+        lastmods as the raw strings
+    """
+    children, pages = [], []
+    for _, elem in ET.iterparse(io.BytesIO(content), events=('end',)):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag in ('sitemap', 'url'):
+            loc = lastmod = None
+            for child in elem:
+                name = child.tag.rsplit('}', 1)[-1]
+                if name == 'loc':
+                    loc = (child.text or '').strip()
+                elif name == 'lastmod':
+                    lastmod = (child.text or '').strip()
+            if loc:
+                (children if tag == 'sitemap' else pages).append((loc, lastmod))
+            elem.clear()
+    return children, pages
+
+def _fetch_sitemap(url):
+    """Fetch and parse one sitemap."""
+    response = http_client.get(url, headers=SITEMAP_HEADERS, timeout=30)
+    response.raise_for_status()
+    return parse_sitemap(response.content)
+
+def _flag_changed(pages):
+    """Mark indexed listings whose sitemap lastmod is newer than our last check."""
+    rows = []
+    for url, lastmod in pages:
+        modified = parse_lastmod(lastmod)
+        if modified is None:
+            continue
+        # Sitemaps and search results don't always agree on a trailing slash
+        for variant in {url, url.rstrip('/'), url.rstrip('/') + '/'}:
+            rows.append((modified, variant, modified))
+    if not rows:
+        return 0
+    return _write(
+        "UPDATE products SET changed_at = ? WHERE url = ? AND COALESCE(last_checked, last_seen) < ? "
+        "AND changed_at IS NULL",
+        rows,
+    )
+
+def read_sitemap_signals(source):
+    """
+    Flag a store's changed listings from its sitemap.
+
+    Only child sitemaps that are new or whose lastmod moved are read, and
+    product sitemaps are preferred when the index names them.
+
+    Args:
+        source (str): Source name (a key of SITEMAP_URLS)
+
+    Returns:
+        dict: {"sitemaps": fetched, "skipped": unchanged, "urls": listed, "flagged": listings}
+    """
+    report = {'sitemaps': 0, 'skipped': 0, 'urls': 0, 'flagged': 0}
+    children, pages = _fetch_sitemap(SITEMAP_URLS[source])
+    report['sitemaps'] += 1
+
+    product_maps = [child for child in children if 'product' in child[0].lower()]
+    conn = _connect()
+    known = dict(conn.execute("SELECT url, lastmod FROM sitemaps").fetchall())
+    seen = []
+    for url, lastmod in product_maps or children:
+        if lastmod and known.get(url) == lastmod:
+            report['skipped'] += 1
+            continue
+        try:
+            _, child_pages = _fetch_sitemap(url)
+        except (requests.RequestException, ET.ParseError) as e:
+            print(f"Could not read sitemap {url}: {str(e)}", file=sys.stderr)
+            continue
+        report['sitemaps'] += 1
+        report['urls'] += len(child_pages)
+        report['flagged'] += _flag_changed(child_pages)
+        seen.append((url, lastmod, time.time()))
+
+    report['urls'] += len(pages)
+    report['flagged'] += _flag_changed(pages)
+    if seen:
+        _write("INSERT OR REPLACE INTO sitemaps (url, lastmod, checked_at) VALUES (?, ?, ?)", seen)
+    return report
+
+def read_ecwid_signals():
+    """
+    Write JJGames items updated since the last sync straight to the index.
+
+    Items Ecwid now reports out of stock are dropped from the index. The
+    first sync starts from the newest JJGames listing already indexed.
+
+    Returns:
+        dict: {"requests", "updated", "removed"}
+    """
+    from scrape_jjgames import API_HEADERS, ECWID_PAGE_LIMIT, JJGAMES_STORE_ID, iter_jjgames_products
+
+    report = {'requests': 0, 'updated': 0, 'removed': 0}
+    conn = _connect()
+    row = conn.execute("SELECT synced_at FROM refresh_sync WHERE source = 'jjgames'").fetchone()
+    since = row[0] if row else conn.execute(
+        "SELECT MAX(last_seen) FROM products WHERE source = 'jjgames'"
+    ).fetchone()[0]
+    if since is None:
+        # Nothing indexed yet; the crawler fills JJGames in one pass
+        return report
+
+    started = time.time()
+    offset, total = 0, None
+    while total is None or offset < min(total, ECWID_PAGE_LIMIT * catalog_index.CRAWL_MAX_PAGES):
+        url = (f"https://app.ecwid.com/api/v3/{JJGAMES_STORE_ID}/search?keyword="
+               f"&updatedFrom={int(since)}&limit={ECWID_PAGE_LIMIT}&offset={offset}")
+        response = http_client.get(url, headers=API_HEADERS, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        report['requests'] += 1
+        total = int(data.get('total', 0))
+
+        report['updated'] += catalog_index.upsert(
+            'jjgames', catalog_index.with_ecwid_quantities(data, iter_jjgames_products(data))
+        )
+        sold_out = [(f"https://www.jjgames.com/#!/~/product/{item.get('id')}",)
+                    for item in data.get('items', []) if not item.get('inStock', True)]
+        if sold_out:
+            price_history.record([{'url': url, 'price_cents': None, 'in_stock': False} for (url,) in sold_out])
+            report['removed'] += _write("DELETE FROM products WHERE url = ?", sold_out)
+
+        if not data.get('items'):
+            break
+        offset += ECWID_PAGE_LIMIT
+
+    _write("INSERT OR REPLACE INTO refresh_sync (source, synced_at) VALUES (?, ?)", [('jjgames', started)])
+    return report
+
+# Volatility and priority of every listing, computed in SQL so only the
+# due ones ever leave the database, most overdue first
+_VOLATILITY = (
+    "(1 + (COALESCE(price_changed_at, 0) > :repriced_since) "
+    "+ MIN(views / :views_per_point, :max_view_points) "
+    "+ (quantity IS NOT NULL AND quantity <= :low_stock))"
+)
+_DUE = f"""
+SELECT url, source, title, misses FROM (
+    SELECT url, source, title, misses,
+        :now - COALESCE(last_checked, last_seen) AS age,
+        MAX(:base / {_VOLATILITY}, :min_interval) AS interval,
+        changed_at IS NOT NULL AS changed
+    FROM products
+    WHERE source IN ({{sources}})
+)
+WHERE changed OR age >= interval
+ORDER BY age / interval + changed * :boost DESC
+"""
+
+def due_listings(sources, budget, now=None):
+    """
+    Pick the listings to refresh this cycle.
+
+    Listings sharing a title are refreshed by the same search, so the
+    selection stops once `budget` distinct (source, title) searches are
+    needed.
+
+    Args:
+        sources (list): Source names
+        budget (int): Most searches to plan
+        now (float, optional): Current time (defaults to time.time())
+
+    Returns:
+        tuple: (dict of (source, title) -> [(url, misses)], number of due listings)
+    """
+    now = time.time() if now is None else now
+    params = {
+        'now': now,
+        'base': REFRESH_INTERVAL,
+        'min_interval': MIN_INTERVAL,
+        'repriced_since': now - REPRICE_WINDOW,
+        'views_per_point': float(VIEWS_PER_POINT),
+        'max_view_points': MAX_VIEW_POINTS,
+        'low_stock': LOW_STOCK,
+        'boost': CHANGED_BOOST,
+    }
+    placeholders = ','.join(f':source{i}' for i in range(len(sources)))
+    params.update({f'source{i}': source for i, source in enumerate(sources)})
+
+    groups = {}
+    due = 0
+    for url, source, title, misses in _connect().execute(_DUE.format(sources=placeholders), params):
+        due += 1
+        key = (source, title)
+        if key not in groups:
+            if len(groups) >= budget:
+                continue
+            groups[key] = []
+        groups[key].append((url, misses))
+    return groups, due
+
+async def _search_title(source, title):
+    """
+    Read every result page of a title search with the crawler's fetchers.
+
+    Args:
+        source (str): Source name (a key of catalog_index.CRAWL_FETCHERS)
+        title (str): Listing title to search for
+
+    Returns:
+        tuple: (products, complete), where complete is False if the search
+        stopped at REFRESH_MAX_PAGES or at a page with no product cards and
+        no pagination (a bot challenge or error page)
+    """
+    fetch = catalog_index.CRAWL_FETCHERS[source]
+    products = []
+    page = pages = 1
+    while page <= pages:
+        if page > REFRESH_MAX_PAGES:
+            return products, False
+        async with scheduler.slot(source, 'refresh', 'refresh'):
+            if asyncio.iscoroutinefunction(fetch):
+                page_products, pages, stats = await fetch(title, page)
+            else:
+                page_products, pages, stats = await asyncio.to_thread(fetch, title, page)
+        page_products = await asyncio.to_thread(list, page_products)
+        if not stats.get('cards') and pages == 1:
+            return products, False
+        products.extend(product for product in page_products if product.get('url'))
+        page += 1
+    return products, True
+
+async def _refresh_group(source, title, listings, semaphore):
+    """Search one title live and record which of its listings were found."""
+    async with semaphore:
+        try:
+            products, complete = await _search_title(source, title)
+        except CircuitOpenError as e:
+            return {'status': 'unavailable', 'error': str(e)}
+        except Exception as e:
+            return {'status': 'error', 'error': str(e)}
+
+    if not products:
+        # Nothing found proves nothing: the store may be blocking us
+        return {'status': 'empty'}
+
+    await asyncio.to_thread(price_history.record, products)
+    await asyncio.to_thread(catalog_index.upsert, source, products)
+    found = {product['url'] for product in products}
+    missing = [(url, misses) for url, misses in listings if url not in found]
+    now = time.time()
+    if not complete:
+        # The listings may be on the pages not read; check them again later
+        # without counting a miss
+        await asyncio.to_thread(
+            _write, "UPDATE products SET last_checked = ? WHERE url = ?", [(now, url) for url, _ in missing]
+        )
+        return {'status': 'ok', 'refreshed': len(listings) - len(missing), 'missing': 0, 'removed': 0,
+                'unverified': len(missing)}
+
+    removed = await asyncio.to_thread(
+        _write, "DELETE FROM products WHERE url = ?",
+        [(url,) for url, misses in missing if misses + 1 >= MAX_MISSES],
+    )
+    # Listings found again were reset by the upsert
+    await asyncio.to_thread(
+        _write, "UPDATE products SET misses = misses + 1, last_checked = ?, changed_at = NULL WHERE url = ?",
+        [(now, url) for url, misses in missing if misses + 1 < MAX_MISSES],
+    )
+    return {'status': 'ok', 'refreshed': len(listings) - len(missing),
+            'missing': len(missing), 'removed': removed, 'unverified': 0}
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+def staleness(sources, now=None):
+    """
+    Report how long ago each source's listings were last checked.
+
+    Returns:
+        dict: source -> {"listings", "p50", "p90", "p99", "max"} in seconds
+    """
+    now = time.time() if now is None else now
+    ages = {source: [] for source in sources}
+    for source, checked in _connect().execute(
+        "SELECT source, COALESCE(last_checked, last_seen) FROM products ORDER BY 2 DESC"
+    ):
+        if source in ages:
+            ages[source].append(round(now - checked, 1))
+    return {
+        source: {
+            'listings': len(values),
+            'p50': _percentile(values, 0.5),
+            'p90': _percentile(values, 0.9),
+            'p99': _percentile(values, 0.99),
+            'max': values[-1] if values else None,
+        }
+        for source, values in ages.items()
+    }
+
+def _bytes_fetched():
+    return sum(stats['bytes'] for stats in http_client.connection_stats().values())
+
+async def refresh_cycle(sources=None, budget=None):
+    """
+    Run one refresh cycle: read change signals, then re-check the most
+    overdue listings.
+
+    Args:
+        sources (list, optional): Source names (defaults to every crawled source)
+        budget (int, optional): Most title searches (default: REFRESH_BUDGET)
+
+    Returns:
+        dict: The cycle report
+    """
+    start = time.perf_counter()
+    sources = list(sources or catalog_index.CRAWL_FETCHERS.keys())
+    budget = REFRESH_BUDGET if budget is None else budget
+    bytes_before = _bytes_fetched()
+    report = {'signals': {}, 'due': 0, 'searches': 0, 'refreshed': 0, 'missing': 0, 'removed': 0,
+              'unverified': 0, 'failed_searches': 0}
+
+    for source in sources:
+        try:
+            if source == 'jjgames':
+                async with scheduler.slot(source, 'refresh', 'refresh'):
+                    report['signals'][source] = await asyncio.to_thread(read_ecwid_signals)
+            elif source in SITEMAP_URLS:
+                async with scheduler.slot(source, 'refresh', 'refresh'):
+                    report['signals'][source] = await asyncio.to_thread(read_sitemap_signals, source)
+        except (requests.RequestException, ET.ParseError, ValueError) as e:
+            print(f"Could not read change signals for {source}: {str(e)}", file=sys.stderr)
+            report['signals'][source] = {'error': str(e)}
+
+    groups, report['due'] = await asyncio.to_thread(due_listings, sources, budget)
+    semaphore = asyncio.Semaphore(REFRESH_CONCURRENCY)
+    results = await asyncio.gather(*[
+        _refresh_group(source, title, listings, semaphore) for (source, title), listings in groups.items()
+    ])
+    for result in results:
+        report['searches'] += 1
+        if result['status'] != 'ok':
+            report['failed_searches'] += 1
+            continue
+        for field in ('refreshed', 'missing', 'removed', 'unverified'):
+            report[field] += result[field]
+
+    # DKOldies pages load in a browser, so their bytes aren't counted here
+    report['bytes_fetched'] = _bytes_fetched() - bytes_before
+    report['staleness'] = await asyncio.to_thread(staleness, sources)
+    report['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return report
+
+async def run(sources=None, budget=None, every=None):
+    """Run refresh cycles, one every `every` seconds, or just one."""
+    try:
+        while True:
+            cycle_start = time.monotonic()
+            print(json.dumps(await refresh_cycle(sources, budget), indent=2), flush=True)
+            if not every:
+                return
+            await asyncio.sleep(max(0.0, every - (time.monotonic() - cycle_start)))
+    finally:
+        await shutdown()
+
+def main():
+    """Run catalog refresh cycles."""
+    parser = argparse.ArgumentParser(description='Refresh the catalog index where it has most likely changed.')
+    parser.add_argument('--sources', type=str, default='all',
+                        help='Comma-separated sources to refresh, or "all"')
+    parser.add_argument('--budget', type=int, help='Most title searches per cycle')
+    parser.add_argument('--every', type=float, help='Run a cycle every this many seconds instead of once')
+
+    args = parser.parse_args()
+    sources = None if args.sources == 'all' else [s.strip() for s in args.sources.split(',') if s.strip()]
+    try:
+        asyncio.run(run(sources, args.budget, args.every))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
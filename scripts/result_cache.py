@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+Search Result Cache
+
+One on-disk cache shared by every scraper and every worker process. Results
+live in a single SQLite database in WAL mode, so a lookup is a plain read
+that doesn't wait for writers, and each write is an atomic transaction even
+when several processes write at once.
+
+- Each source has its own TTL (DEFAULT_TTLS, overridable per call)
+- Empty results and failed searches are cached briefly (NEGATIVE_TTL), so a
+  store that is down or a query with no matches isn't re-scraped on every
+  request
+- Payloads are zlib-compressed JSON
+- The database is capped at LOOTSCOUT_CACHE_MAX_BYTES of payload; expired
+  entries go first, then the least recently used ones
+- HTTP validators (ETag / Last-Modified) are stored with each entry, so an
+  expired entry can be revalidated with a conditional request; a 304 just
+  extends the entry without re-parsing anything
+- Hit, miss, eviction and 304 counters are kept per source in the database.
+  Lookups batch their counters and last-access times in memory and write
+  them at most every READ_FLUSH_INTERVAL seconds, giving up (and keeping
+  them for the next try) if the write lock isn't free within
+  READ_FLUSH_TIMEOUT
+
+Settings:
+    LOOTSCOUT_CACHE_DB         Database path (default: ~/.cache/lootscout/results.db)
+    LOOTSCOUT_CACHE_MAX_BYTES  Payload size cap in bytes (default: 64 MB)
+    LOOTSCOUT_CACHE_DISABLED   Set to 1 to bypass the cache entirely
+    LOOTSCOUT_CACHE_NEGATIVE_TTL  Seconds to cache empty or failed searches (default: 60)
+
+Run directly to print the counters, or with --clear to empty the cache.
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import atexit
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+
+CACHE_DB = Path(os.path.expanduser(os.environ.get('LOOTSCOUT_CACHE_DB', '~/.cache/lootscout/results.db')))
+MAX_BYTES = int(os.environ.get('LOOTSCOUT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+DISABLED = os.environ.get('LOOTSCOUT_CACHE_DISABLED', '') == '1'
+
+# Seconds a source's results stay fresh. DKOldies needs a headless browser,
+# so its results are kept the longest.
+DEFAULT_TTLS = {
+    'vgny': 3600,
+    'jjgames': 900,
+    'lukie-games': 1800,
+    'dkoldies': 3600,
+}
+DEFAULT_TTL = 900
+
+NEGATIVE_TTL = float(os.environ.get('LOOTSCOUT_CACHE_NEGATIVE_TTL', '60'))
+
+# Expired entries are kept this long past their TTL before they are purged
+STALE_RETENTION = 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    max_results INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    size INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS counters (
+    source TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, name)
+);
+"""
+
+# Seconds a connection waits for another process's write lock, unless its
+# caller asks for less
+BUSY_TIMEOUT = 10.0
+
+# Lookups write their counters and last-access times in batches, at most this
+# often, and only wait this long for the write lock
+READ_FLUSH_INTERVAL = 5.0
+READ_FLUSH_TIMEOUT = 0.05
+
+# last_access is only rewritten when older than this, so cache hits don't all write
+TOUCH_INTERVAL = 60.0
+
+_local = threading.local()
+
+# Counter increments ((source, name) -> amount) and last-access times
+# (key -> time) recorded by lookups and not yet written
+_pending_lock = threading.Lock()
+_pending_counts = {}
+_pending_touches = {}
+_last_read_flush = 0.0
+
+def connect(schema=None, timeout=None):
+    """
+    Return this thread's connection to the cache database, creating it on
+    first use. Every module that keeps tables in the database (the rate
+    limiter, the scheduler, search snapshots) shares it.
+
+    Args:
+        schema (str or callable, optional): The caller's CREATE ... IF NOT
+            EXISTS statements, or a function given the connection to set up
+            its tables; run once per thread
+        timeout (float, optional): Seconds to wait for a lock (default: BUSY_TIMEOUT)
+
+    Returns:
+        sqlite3.Connection: In autocommit mode; transactions are opened
+        explicitly with BEGIN IMMEDIATE
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != CACHE_DB:
+        CACHE_DB.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(CACHE_DB), timeout=BUSY_TIMEOUT, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+        _local.path = CACHE_DB
+        _local.schemas = set()
+        _local.timeout = BUSY_TIMEOUT
+
+    if schema is not None and schema not in _local.schemas:
+        if callable(schema):
+            schema(conn)
+        else:
+            conn.executescript(schema)
+        _local.schemas.add(schema)
+
+    timeout = BUSY_TIMEOUT if timeout is None else timeout
+    if timeout != _local.timeout:
+        conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+        _local.timeout = timeout
+    return conn
+
+def _setup(conn):
+    """Create the cache's own tables."""
+    conn.executescript(_SCHEMA)
+
+    # Databases created before validators were stored lack their columns
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+    for column in ('etag', 'last_modified'):
+        if column not in columns:
+            try:
+                conn.execute(f"ALTER TABLE entries ADD COLUMN {column} TEXT")
+            except sqlite3.OperationalError:
+                pass  # Another process added it first
+
+def _connect():
+    return connect(_setup)
+
+def cache_key(source, query, platform=None, deep=False):
+    """Build the cache key for a search; queries are case- and space-insensitive."""
+    key = f"{source}\x1f{' '.join(query.lower().split())}\x1f{(platform or '').lower()}"
+    # Deep (multi-page) results are kept apart: a short single-page result
+    # doesn't mean the store has nothing more
+    return key + "\x1fdeep" if deep else key
+
+def _bump(conn, source, name, amount=1):
+    conn.execute(
+        "INSERT INTO counters (source, name, value) VALUES (?, ?, ?) "
+        "ON CONFLICT (source, name) DO UPDATE SET value = value + excluded.value",
+        (source, name, amount),
+    )
+
+def _record_read(source, name, key, now):
+    """Queue a lookup's counter (and last-access time if key is given) for the next flush."""
+    global _last_read_flush
+    with _pending_lock:
+        _pending_counts[(source, name)] = _pending_counts.get((source, name), 0) + 1
+        if key is not None:
+            _pending_touches[key] = now
+        due = now - _last_read_flush >= READ_FLUSH_INTERVAL
+        if due:
+            _last_read_flush = now
+    if due:
+        flush_reads()
+
+def flush_reads(timeout=READ_FLUSH_TIMEOUT):
+    """
+    Write the counters and last-access times queued by lookups.
+
+    Args:
+        timeout (float, optional): Seconds to wait for the write lock
+
+    Returns:
+        bool: True if everything queued was written; on failure it stays
+        queued for the next flush
+    """
+    with _pending_lock:
+        counts = dict(_pending_counts)
+        touches = dict(_pending_touches)
+        _pending_counts.clear()
+        _pending_touches.clear()
+    if not counts and not touches:
+        return True
+
+    try:
+        conn = connect(_setup, timeout)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                "UPDATE entries SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(when, key) for key, when in touches.items()],
+            )
+            for (source, name), amount in counts.items():
+                _bump(conn, source, name, amount)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return True
+    except sqlite3.Error:
+        with _pending_lock:
+            for counter, amount in counts.items():
+                _pending_counts[counter] = _pending_counts.get(counter, 0) + amount
+            for key, when in touches.items():
+                _pending_touches[key] = max(when, _pending_touches.get(key, 0))
+        return False
+
+atexit.register(flush_reads)
+
+def lookup(source, query, platform=None, max_results=16, allow_stale=False, deep=False):
+    """
+    Look up cached results for a search, optionally accepting expired ones.
+
+    An entry only answers requests for at most as many results as it was
+    stored with: one stored for max_results=16 can serve a request for 8 but
+    not one for 50.
+
+    The read takes no write lock; the hit or miss is counted through
+    flush_reads.
+
+    Args:
+        source (str): Source name
+        query (str): Search term
+        platform (str, optional): Game platform
+        max_results (int, optional): Maximum number of results wanted
+        allow_stale (bool, optional): Also return non-empty entries past
+            their TTL (kept for up to STALE_RETENTION), for stale-while-revalidate
+        deep (bool, optional): Look up a multi-page search
+
+    Returns:
+        tuple: (products, fresh); products is None on a miss
+    """
+    if DISABLED:
+        return None, False
+
+    try:
+        now = time.time()
+        key = cache_key(source, query, platform, deep)
+        row = _connect().execute(
+            "SELECT max_results, expires_at, payload, count, last_access FROM entries WHERE key = ?",
+            (key,),
+        ).fetchone()
+
+        usable = row is not None and row[0] >= max_results
+        fresh = usable and row[1] > now
+        stale = (usable and not fresh and allow_stale and row[3] > 0
+                 and row[1] > now - STALE_RETENTION)
+        touch = (fresh or stale) and now - row[4] > TOUCH_INTERVAL
+        _record_read(source, 'hits' if fresh else 'stale_hits' if stale else 'misses', key if touch else None, now)
+
+        if not (fresh or stale):
+            return None, False
+        return json.loads(zlib.decompress(row[2]))[:max_results], fresh
+    except (sqlite3.Error, zlib.error, ValueError) as e:
+        print(f"Result cache read failed: {str(e)}", file=sys.stderr)
+        return None, False
+
+def get(source, query, platform=None, max_results=16, deep=False):
+    """
+    Look up fresh cached results for a search.
+
+    Returns:
+        list or None: Cached products, or None on a miss (see lookup)
+    """
+    products, _ = lookup(source, query, platform, max_results, deep=deep)
+    return products
+
+def put(source, query, platform, max_results, products, ttl=None, keep_results=False, response=None,
+        deep=False):
+    """
+    Store the results of a successful search.
+
+    Args:
+        source (str): Source name
+        query (str): Search term
+        platform (str or None): Game platform
+        max_results (int): The max_results the search ran with
+        products (list): Product dictionaries
+        ttl (float, optional): Seconds to keep the entry fresh (defaults to
+            the source's entry in DEFAULT_TTLS, or NEGATIVE_TTL if empty)
+        keep_results (bool, optional): Leave an existing non-empty entry in
+            place instead of overwriting it
+        response (optional): HTTP response the products came from; its
+            ETag and Last-Modified headers are kept for revalidation
+        deep (bool, optional): The products come from a multi-page search
+    """
+    if DISABLED:
+        return
+
+    try:
+        conn = _connect()
+        now = time.time()
+        if ttl is None:
+            ttl = DEFAULT_TTLS.get(source, DEFAULT_TTL) if products else NEGATIVE_TTL
+        payload = zlib.compress(json.dumps(products, separators=(',', ':')).encode('utf-8'))
+        headers = response.headers if response is not None else {}
+
+        key = cache_key(source, query, platform, deep)
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if keep_results and conn.execute(
+                "SELECT 1 FROM entries WHERE key = ? AND count > 0", (key,)
+            ).fetchone():
+                conn.execute('COMMIT')
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, source, max_results, count, created_at, expires_at, last_access, size, payload, "
+                "etag, last_modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, source, max_results, len(products), now, now + ttl, now, len(payload), payload,
+                 headers.get('ETag'), headers.get('Last-Modified')),
+            )
+            _evict(conn, now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    except sqlite3.Error as e:
+        print(f"Result cache write failed: {str(e)}", file=sys.stderr)
+
+def conditional_headers(source, query, platform=None, max_results=16):
+    """
+    Return If-None-Match / If-Modified-Since headers for revalidating a search.
+
+    Uses the validators of any non-empty entry that could answer the search,
+    fresh or expired, so a refresh can be sent as a conditional request.
+
+    Returns:
+        dict: Request headers; empty if there is nothing to revalidate
+    """
+    if DISABLED:
+        return {}
+
+    try:
+        row = _connect().execute(
+            "SELECT etag, last_modified FROM entries WHERE key = ? AND max_results >= ? AND count > 0",
+            (cache_key(source, query, platform), max_results),
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Result cache read failed: {str(e)}", file=sys.stderr)
+        return {}
+
+    headers = {}
+    if row and row[0]:
+        headers['If-None-Match'] = row[0]
+    if row and row[1]:
+        headers['If-Modified-Since'] = row[1]
+    return headers
+
+def revalidated(source, query, platform=None, max_results=16, ttl=None):
+    """
+    Handle a 304 Not Modified: extend the cached entry and return its products.
+
+    Returns:
+        list or None: Cached products, or None if the entry has gone since
+        the conditional request was sent
+    """
+    if DISABLED:
+        return None
+
+    try:
+        conn = _connect()
+        now = time.time()
+        ttl = DEFAULT_TTLS.get(source, DEFAULT_TTL) if ttl is None else ttl
+        key = cache_key(source, query, platform)
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT payload FROM entries WHERE key = ? AND max_results >= ?", (key, max_results)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE entries SET expires_at = ?, last_access = ? WHERE key = ?", (now + ttl, now, key)
+                )
+                _bump(conn, source, 'not_modified')
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    except sqlite3.Error as e:
+        print(f"Result cache write failed: {str(e)}", file=sys.stderr)
+        return None
+
+    if row is None:
+        return None
+    return json.loads(zlib.decompress(row[0]))[:max_results]
+
+def put_failure(source, query, platform, max_results, deep=False):
+    """
+    Cache a failed search as empty for NEGATIVE_TTL seconds.
+
+    Earlier non-empty results for the same search are kept, so a failed
+    background refresh never replaces good (if stale) data.
+    """
+    put(source, query, platform, max_results, [], ttl=NEGATIVE_TTL, keep_results=True, deep=deep)
+
+def _evict(conn, now):
+    """Drop long-expired entries, then expired and LRU entries until under MAX_BYTES."""
+    evicted = conn.execute(
+        "SELECT source, COUNT(*) FROM entries WHERE expires_at < ? GROUP BY source",
+        (now - STALE_RETENTION,),
+    ).fetchall()
+    conn.execute("DELETE FROM entries WHERE expires_at < ?", (now - STALE_RETENTION,))
+
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    if total > MAX_BYTES:
+        victims = []
+        rows = conn.execute(
+            "SELECT key, source, size FROM entries ORDER BY expires_at >= ?, last_access", (now,)
+        ).fetchall()
+        for key, source, size in rows:
+            if total <= MAX_BYTES:
+                break
+            victims.append((key, source))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+        for _, source in victims:
+            evicted.append((source, 1))
+
+    for source, count in evicted:
+        _bump(conn, source, 'evictions', count)
+
+def invalidate(source, query, platform=None, deep=False):
+    """Remove one search from the cache."""
+    if DISABLED:
+        return
+    conn = _connect()
+    conn.execute("DELETE FROM entries WHERE key = ?", (cache_key(source, query, platform, deep),))
+
+def clear():
+    """Remove every entry and reset the counters."""
+    with _pending_lock:
+        _pending_counts.clear()
+        _pending_touches.clear()
+    conn = _connect()
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute("DELETE FROM entries")
+    conn.execute("DELETE FROM counters")
+    conn.execute('COMMIT')
+    conn.execute('VACUUM')
+
+def cache_stats():
+    """
+    Return cache counters and size.
+
+    Returns:
+        dict: {"entries": int, "bytes": int, "max_bytes": int,
+               "sources": {source: {"hits", "stale_hits", "misses", "evictions",
+                                    "not_modified"}}}
+    """
+    if DISABLED:
+        return {'disabled': True}
+
+    flush_reads(BUSY_TIMEOUT)
+    conn = _connect()
+    entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+    sources = {}
+    for source, name, value in conn.execute("SELECT source, name, value FROM counters"):
+        sources.setdefault(source, {
+            'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'not_modified': 0,
+        })[name] = value
+
+    return {'entries': entries, 'bytes': total, 'max_bytes': MAX_BYTES, 'sources': sources}
+
+def main():
+    """Print cache statistics or clear the cache."""
+    parser = argparse.ArgumentParser(description='Inspect the LootScout search result cache.')
+    parser.add_argument('--clear', action='store_true', help='Remove every cached result')
+
+    args = parser.parse_args()
+
+    if args.clear:
+        clear()
+        print(f"Cleared {CACHE_DB}", file=sys.stderr)
+
+    print(json.dumps(cache_stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Scrape Scheduler
+
+Decides which scrape runs next, so background work never starves users
+waiting on the search page.
+
+Every scrape holds a slot for its source while it runs. Each source has a
+concurrency cap (SOURCE_CONCURRENCY), and waiting scrapes are admitted in
+priority order:
+1. "interactive": searches a user is waiting on
+2. "refresh": refresh scheduler re-checks, watchlist runs and
+   stale-while-revalidate cache refreshes
+3. "crawl": catalog crawl pages
+
+Within a class, tenants (users, or jobs like "watchlist") take turns, so one
+tenant with many queued scrapes can't hold everyone else up.
+
+Background classes give way to interactive work:
+- They never take the last RESERVED_INTERACTIVE slots of a source.
+- They are deferred while BUSY_THRESHOLD or more interactive scrapes of the
+  same source are running or queued, in this process or any other. Each
+  process publishes its interactive load per source to the result cache
+  database, so a crawl in its own process backs off while the worker is
+  busy. Jobs like the crawler take a slot per page, so they are preempted
+  between pages. The database is only touched from a background flusher
+  thread, so queueing and releasing never wait on SQLite. While other
+  processes' load hasn't been read for 2 * DEFER_POLL seconds, background
+  scrapes are deferred until the flusher catches up.
+- A background scrape deferred for MAX_DEFER seconds stops waiting on other
+  processes, so it can't be put off forever.
+
+A queued scrape that an interactive search joins (see sources.py request
+coalescing) is promoted to the interactive class.
+
+Settings:
+    LOOTSCOUT_SOURCE_CONCURRENCY      Scrapes of one source at once (default: 4)
+    LOOTSCOUT_SCHEDULER_RESERVED      Slots per source only interactive scrapes may use (default: 1)
+    LOOTSCOUT_SCHEDULER_BUSY          Interactive scrapes of a source that defer background work (default: 1)
+    LOOTSCOUT_SCHEDULER_MAX_DEFER     Longest a background scrape waits on other processes (default: 60)
+
+Per-source overrides of the cap live in SOURCE_CONCURRENCY.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import sqlite3
+import asyncio
+import threading
+import contextlib
+from collections import OrderedDict, deque
+
+import result_cache
+
+PRIORITIES = ['interactive', 'refresh', 'crawl']
+_RANK = {priority: rank for rank, priority in enumerate(PRIORITIES)}
+
+DEFAULT_CONCURRENCY = int(os.environ.get('LOOTSCOUT_SOURCE_CONCURRENCY', '4'))
+RESERVED_INTERACTIVE = int(os.environ.get('LOOTSCOUT_SCHEDULER_RESERVED', '1'))
+BUSY_THRESHOLD = int(os.environ.get('LOOTSCOUT_SCHEDULER_BUSY', '1'))
+MAX_DEFER = float(os.environ.get('LOOTSCOUT_SCHEDULER_MAX_DEFER', '60'))
+
+# Source -> scrapes at once. DKOldies scrapes each hold a browser page from
+# a pool of 2.
+SOURCE_CONCURRENCY = {
+    'dkoldies': 2,
+}
+
+# How often a deferred scrape re-reads other processes' interactive load
+DEFER_POLL = 0.5
+
+# Seconds the flusher waits for a locked cache database before giving up
+# until its next pass
+DB_TIMEOUT = 0.5
+
+# Published load older than this is from a process that died without
+# clearing it
+LOAD_MAX_AGE = 600.0
+
+# Recent waits kept per class for the percentiles in scheduler_stats()
+WAIT_SAMPLES = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduler_load (
+    pid INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    interactive INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (pid, source)
+);
+"""
+
+# source -> {"running": {priority: count}, "waiting": {priority: OrderedDict(tenant -> deque of tickets)}}
+_sources = {}
+
+# source -> interactive load last published by this process
+_published = {}
+
+# (read at, {source: interactive load of other processes}), as read by the
+# flusher; read at is None until its first read
+_remote = (None, {})
+
+# Work for the flusher thread: source -> load to publish, and whether
+# _remote should be re-read
+_pending = {}
+_remote_wanted = False
+_flush_lock = threading.Lock()
+_write_lock = threading.Lock()
+_flush_wake = threading.Event()
+_flusher = None
+
+_stats = {
+    priority: {'started': 0, 'deferred': 0, 'promoted': 0, 'waits_ms': deque(maxlen=WAIT_SAMPLES),
+               'wait_ms_max': 0.0}
+    for priority in PRIORITIES
+}
+
+def _connect():
+    """Return this thread's connection to the shared cache database."""
+    return result_cache.connect(_SCHEMA, DB_TIMEOUT)
+
+def concurrency(source):
+    """Return how many scrapes of a source may run at once."""
+    return max(1, SOURCE_CONCURRENCY.get(source, DEFAULT_CONCURRENCY))
+
+def _state(source):
+    state = _sources.get(source)
+    if state is None:
+        state = _sources[source] = {
+            'running': dict.fromkeys(PRIORITIES, 0),
+            'waiting': {priority: OrderedDict() for priority in PRIORITIES},
+        }
+    return state
+
+def _queued(state, priority):
+    return sum(len(tickets) for tickets in state['waiting'][priority].values())
+
+def _local_load(source):
+    """Interactive scrapes of a source running or queued in this process."""
+    state = _state(source)
+    return state['running']['interactive'] + _queued(state, 'interactive')
+
+def _wake_flusher():
+    """Hand the flusher thread work, starting it on first use."""
+    global _flusher
+    if _flusher is None or not _flusher.is_alive():
+        _flusher = threading.Thread(target=_flush_loop, name='scheduler-flusher', daemon=True)
+        _flusher.start()
+    _flush_wake.set()
+
+def _publish(source):
+    """Share this process's interactive load on a source with other processes."""
+    load = _local_load(source)
+    if _published.get(source, 0) == load:
+        return
+    _published[source] = load
+    with _flush_lock:
+        _pending[source] = load
+    _wake_flusher()
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _remote_load(source):
+    """
+    Interactive scrapes of a source in other processes, as last read by the
+    flusher, which is asked to re-read them every DEFER_POLL seconds.
+
+    Returns:
+        int: The load, or None if it hasn't been read for 2 * DEFER_POLL seconds
+    """
+    global _remote_wanted
+    read_at, loads = _remote
+    age = None if read_at is None else time.monotonic() - read_at
+    if age is None or age >= DEFER_POLL:
+        _remote_wanted = True
+        _wake_flusher()
+    return None if age is None or age >= 2 * DEFER_POLL else loads.get(source, 0)
+
+def _write_loads(loads):
+    """Write published loads in one transaction."""
+    conn = _connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for source, load in loads.items():
+            if load:
+                conn.execute(
+                    "INSERT OR REPLACE INTO scheduler_load (pid, source, interactive, updated_at) VALUES (?, ?, ?, ?)",
+                    (os.getpid(), source, load, time.time()),
+                )
+            else:
+                conn.execute("DELETE FROM scheduler_load WHERE pid = ? AND source = ?", (os.getpid(), source))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+def _read_loads():
+    """Read other processes' interactive load per source."""
+    loads = {}
+    rows = _connect().execute(
+        "SELECT pid, source, interactive FROM scheduler_load WHERE pid != ? AND updated_at > ?",
+        (os.getpid(), time.time() - LOAD_MAX_AGE),
+    ).fetchall()
+    for pid, row_source, interactive in rows:
+        if _alive(pid):
+            loads[row_source] = loads.get(row_source, 0) + interactive
+    return loads
+
+def flush():
+    """
+    Write the loads waiting to be published.
+
+    Runs at exit; a process that leaves through os._exit must call it first.
+
+    Returns:
+        bool: False if the database couldn't be written; the loads stay pending
+    """
+    with _write_lock:
+        with _flush_lock:
+            loads = dict(_pending)
+            _pending.clear()
+        if not loads:
+            return True
+        try:
+            _write_loads(loads)
+        except sqlite3.Error as e:
+            print(f"Could not publish scheduler load: {str(e)}", file=sys.stderr)
+            # Retry later, unless a newer load replaced it
+            with _flush_lock:
+                for source, load in loads.items():
+                    _pending.setdefault(source, load)
+            return False
+    return True
+
+def _flush_loop():
+    """Publish this process's load and read other processes', off the event loop."""
+    global _remote, _remote_wanted
+    while True:
+        _flush_wake.wait()
+        _flush_wake.clear()
+        if not flush():
+            time.sleep(DEFER_POLL)
+            _flush_wake.set()
+        if _remote_wanted:
+            _remote_wanted = False
+            try:
+                loads = _read_loads()
+            except sqlite3.Error as e:
+                print(f"Could not read scheduler load: {str(e)}", file=sys.stderr)
+                loads = {}
+            _remote = (time.monotonic(), loads)
+
+# Clear this process's load on exit, so other processes don't wait on it
+atexit.register(flush)
+
+class Ticket:
+    """A scrape's place in its source's queue, and then its slot."""
+
+    def __init__(self, source, priority, tenant):
+        if priority not in _RANK:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.source = source
+        self.priority = priority
+        self.tenant = tenant or ''
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.released = False
+        self.deferred = False
+        self._event = asyncio.Event()
+
+    async def wait(self):
+        """Wait until the scrape may start."""
+        try:
+            while not self.granted:
+                if self.priority == 'interactive':
+                    await self._event.wait()
+                else:
+                    # Other processes' load can drop without anything here
+                    # noticing, so deferred scrapes look again now and then
+                    try:
+                        await asyncio.wait_for(self._event.wait(), DEFER_POLL)
+                    except asyncio.TimeoutError:
+                        _dispatch(self.source)
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        """Give the slot (or the place in the queue) back."""
+        if self.released:
+            return
+        self.released = True
+        state = _state(self.source)
+        if self.granted:
+            state['running'][self.priority] -= 1
+        else:
+            _dequeue(state, self)
+        _dispatch(self.source)
+        _publish(self.source)
+
+def _enqueue(state, ticket):
+    state['waiting'][ticket.priority].setdefault(ticket.tenant, deque()).append(ticket)
+
+def _dequeue(state, ticket):
+    tenants = state['waiting'][ticket.priority]
+    tickets = tenants.get(ticket.tenant)
+    if tickets and ticket in tickets:
+        tickets.remove(ticket)
+        if not tickets:
+            del tenants[ticket.tenant]
+
+def _next(source, state):
+    """Pick the next ticket to admit, or None if nothing may start."""
+    cap = concurrency(source)
+    background_running = sum(count for priority, count in state['running'].items() if priority != 'interactive')
+    busy = None
+    for priority in PRIORITIES:
+        tenants = state['waiting'][priority]
+        if not tenants:
+            continue
+        if priority != 'interactive':
+            if background_running >= max(1, cap - RESERVED_INTERACTIVE):
+                return None
+            if busy is None:
+                remote = _remote_load(source)
+                busy = remote is None or _local_load(source) + remote >= BUSY_THRESHOLD
+
+        # Tenants take turns: the first tenant with an admissible ticket
+        # goes, then moves to the back of the line
+        now = time.monotonic()
+        for tenant, tickets in tenants.items():
+            ticket = tickets[0]
+            if priority != 'interactive' and busy and now - ticket.enqueued_at < MAX_DEFER:
+                if not ticket.deferred:
+                    ticket.deferred = True
+                    _stats[priority]['deferred'] += 1
+                continue
+            tickets.popleft()
+            del tenants[tenant]
+            if tickets:
+                tenants[tenant] = tickets
+            return ticket
+    return None
+
+def _dispatch(source):
+    """Admit queued tickets while the source has free slots."""
+    state = _state(source)
+    while sum(state['running'].values()) < concurrency(source):
+        ticket = _next(source, state)
+        if ticket is None:
+            break
+        ticket.granted = True
+        state['running'][ticket.priority] += 1
+        stats = _stats[ticket.priority]
+        wait_ms = (time.monotonic() - ticket.enqueued_at) * 1000
+        stats['started'] += 1
+        stats['waits_ms'].append(wait_ms)
+        stats['wait_ms_max'] = max(stats['wait_ms_max'], wait_ms)
+        ticket._event.set()
+
+def request(source, priority='interactive', tenant=None):
+    """
+    Queue a scrape of a source. It may be admitted straight away.
+
+    Args:
+        source (str): Source name
+        priority (str, optional): One of PRIORITIES
+        tenant (str, optional): Who the scrape is for; tenants in the same
+            class take turns
+
+    Returns:
+        Ticket: Await ticket.wait() before scraping and call
+        ticket.release() afterwards
+    """
+    ticket = Ticket(source, priority, tenant)
+    _enqueue(_state(source), ticket)
+    _dispatch(source)
+    _publish(source)
+    return ticket
+
+def promote(ticket, priority):
+    """Move a queued ticket up to a higher priority class."""
+    if ticket.granted or ticket.released or _RANK[priority] >= _RANK[ticket.priority]:
+        return
+    state = _state(ticket.source)
+    _dequeue(state, ticket)
+    ticket.priority = priority
+    _enqueue(state, ticket)
+    _stats[priority]['promoted'] += 1
+    _dispatch(ticket.source)
+    _publish(ticket.source)
+
+@contextlib.asynccontextmanager
+async def slot(source, priority='interactive', tenant=None):
+    """Hold a slot for a source for the duration of the block."""
+    ticket = request(source, priority, tenant)
+    await ticket.wait()
+    try:
+        yield ticket
+    finally:
+        ticket.release()
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 1)
+
+def scheduler_stats():
+    """
+    Return queue depth and wait times per priority class for this process.
+
+    Returns:
+        dict: {"classes": {priority: {"queued", "running", "started",
+        "deferred", "promoted", "wait_ms_p50", "wait_ms_p95", "wait_ms_max"}},
+        "sources": {source: {"concurrency", "running", "queued"}}}
+    """
+    classes = {}
+    for priority in PRIORITIES:
+        stats = _stats[priority]
+        classes[priority] = {
+            'queued': sum(_queued(state, priority) for state in _sources.values()),
+            'running': sum(state['running'][priority] for state in _sources.values()),
+            'started': stats['started'],
+            'deferred': stats['deferred'],
+            'promoted': stats['promoted'],
+            'wait_ms_p50': _percentile(stats['waits_ms'], 0.5),
+            'wait_ms_p95': _percentile(stats['waits_ms'], 0.95),
+            'wait_ms_max': round(stats['wait_ms_max'], 1),
+        }
+    sources = {
+        source: {
+            'concurrency': concurrency(source),
+            'running': dict(state['running']),
+            'queued': {priority: _queued(state, priority) for priority in PRIORITIES},
+        }
+        for source, state in _sources.items()
+    }
+    return {'classes': classes, 'sources': sources}
+
+if __name__ == "__main__":
+    print(json.dumps({
+        'concurrency': DEFAULT_CONCURRENCY,
+        'overrides': SOURCE_CONCURRENCY,
+        'reserved_interactive': RESERVED_INTERACTIVE,
+        'busy_threshold': BUSY_THRESHOLD,
+        'max_defer': MAX_DEFER,
+    }, indent=2))
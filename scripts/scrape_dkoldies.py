@@ -6,17 +6,304 @@ This script scrapes product information from DKOldies.com based on search parame
 It returns the data in JSON format for use in the LootScout application.
 """
 
+import os
 import sys
 import json
-import time
 import argparse
-from datetime import datetime
 from urllib.parse import quote_plus
 import asyncio
-from playwright.async_api import async_playwright
-from bs4 import BeautifulSoup
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 
-async def search_dkoldies(query, platform=None, max_results=16):
+import result_cache
+import price_history
+from circuit_breaker import CircuitOpenError, get_breaker
+from rate_limiter import RateLimitedError, acquire_async
+from extractor import extract_products, load_spec
+from pagination import MAX_PAGES, fetch_pages_async, merge_products, page_count
+from streaming import NDJSONWriter, collect_products, emit_products
+
+DKOLDIES_HOST = 'www.dkoldies.com'
+
+# Longest a search will queue behind the DKOldies rate limit, in seconds
+MAX_RATE_LIMIT_WAIT = 30
+
+# Browser identity used for every DKOldies page
+VIEWPORT = {'width': 1920, 'height': 1080}
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Requests we never need to render the product grid
+BLOCKED_RESOURCE_TYPES = {'image', 'font', 'stylesheet', 'media'}
+BLOCKED_URL_PATTERNS = (
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'facebook.net',
+    'connect.facebook',
+    'hotjar.com',
+    'bing.com/bat',
+    'clarity.ms',
+)
+
+# Pool settings, overridable from the environment
+DEFAULT_POOL_SIZE = int(os.environ.get('LOOTSCOUT_DKOLDIES_POOL_SIZE', '2'))
+DEFAULT_MAX_PAGES_PER_BROWSER = int(os.environ.get('LOOTSCOUT_DKOLDIES_MAX_PAGES', '200'))
+
+async def _block_unneeded_requests(route):
+    """Abort images, fonts, CSS and analytics; let everything else through."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(
+        pattern in request.url for pattern in BLOCKED_URL_PATTERNS
+    ):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def _new_context(browser):
+    """Create a browser context with request interception enabled."""
+    context = await browser.new_context(viewport=VIEWPORT, user_agent=USER_AGENT)
+    await context.route('**/*', _block_unneeded_requests)
+    return context
+
+async def _load_search_page(page, search_url):
+    """Navigate to a search URL and return the HTML once products are present."""
+    await page.goto(search_url, wait_until='domcontentloaded')
+
+    # Stop waiting as soon as the grid has products instead of waiting for
+    # the network to go idle. A page that loaded but never shows a product
+    # is a search with no results, not a site failure.
+    try:
+        await page.wait_for_selector('.productGrid .product', timeout=10000)
+    except PlaywrightTimeoutError:
+        print("No products appeared on the search page", file=sys.stderr)
+
+    return await page.content()
+
+class DKOldiesBrowserPool:
+    """
+    A persistent Chromium with a fixed set of reusable pages.
+
+    Pages are handed out one search at a time. After max_pages_per_browser
+    searches the pool stops handing out pages, waits for the in-flight ones to
+    come back and relaunches the browser, which keeps Chromium's memory in check.
+    A page whose search failed or was cancelled is replaced; if the browser
+    can't make a new page (it crashed), it is relaunched the same way.
+    """
+
+    def __init__(self, pool_size=None, max_pages_per_browser=None):
+        self.pool_size = pool_size or DEFAULT_POOL_SIZE
+        self.max_pages_per_browser = max_pages_per_browser or DEFAULT_MAX_PAGES_PER_BROWSER
+        self._playwright = None
+        self._browser = None
+        self._idle = []
+        self._in_use = 0
+        self._served = 0
+        self._recycling = False
+        self._condition = None
+
+    async def _launch(self):
+        """Launch the browser and open pool_size pages."""
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True)
+        self._idle = []
+        try:
+            for _ in range(self.pool_size):
+                context = await _new_context(self._browser)
+                self._idle.append(await context.new_page())
+        except BaseException:
+            # Leave no half-built pool behind; the next search launches again
+            await self._close_browser()
+            raise
+        self._served = 0
+
+    async def _close_browser(self):
+        """Close the current browser and every page it owns."""
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                print(f"Error closing browser: {str(e)}", file=sys.stderr)
+        self._browser = None
+        self._idle = []
+
+    async def _relaunch(self):
+        """Replace the browser. If Chromium won't start, the next search tries again."""
+        await self._close_browser()
+        self._recycling = False
+        try:
+            await self._launch()
+        except Exception as e:
+            print(f"Could not relaunch DKOldies browser: {str(e)}", file=sys.stderr)
+
+    async def _acquire(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+
+        async with self._condition:
+            while True:
+                if self._browser is None and not self._recycling:
+                    await self._launch()
+                if not self._recycling and self._idle:
+                    break
+                await self._condition.wait()
+
+            page = self._idle.pop()
+            self._in_use += 1
+            self._served += 1
+            if self._served >= self.max_pages_per_browser:
+                self._recycling = True
+            return page
+
+    async def _release(self, page, broken):
+        async with self._condition:
+            self._in_use -= 1
+            try:
+                if broken and not self._recycling:
+                    # Replace a page that failed mid-navigation with a fresh context
+                    try:
+                        await page.context.close()
+                    except Exception:
+                        pass
+                    try:
+                        context = await _new_context(self._browser)
+                        self._idle.append(await context.new_page())
+                    except Exception as e:
+                        # The browser itself is gone (e.g. Chromium crashed):
+                        # replace it once the other pages are back
+                        print(f"Could not replace DKOldies page: {str(e)}", file=sys.stderr)
+                        self._recycling = True
+                elif not self._recycling:
+                    self._idle.append(page)
+
+                # Drop the page; the whole browser is replaced once every page is back
+                if self._recycling and self._in_use == 0:
+                    print("Recycling DKOldies browser", file=sys.stderr)
+                    await self._relaunch()
+            finally:
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def page(self):
+        """Borrow a page for the duration of one search."""
+        page = await self._acquire()
+        broken = False
+        try:
+            yield page
+        except PlaywrightTimeoutError:
+            # No products showed up (e.g. an empty search); the page is fine
+            raise
+        except BaseException:
+            # Including a search cancelled mid-navigation by its deadline
+            broken = True
+            raise
+        finally:
+            await self._release(page, broken)
+
+    async def close(self):
+        """Shut down the browser and the Playwright driver."""
+        await self._close_browser()
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+_browser_pool = None
+
+def get_browser_pool():
+    """Return the process-wide DKOldies browser pool, creating it on first use."""
+    global _browser_pool
+    if _browser_pool is None:
+        _browser_pool = DKOldiesBrowserPool()
+    return _browser_pool
+
+async def close_browser_pool():
+    """Close the process-wide browser pool if one was started."""
+    global _browser_pool
+    if _browser_pool is not None:
+        await _browser_pool.close()
+        _browser_pool = None
+
+def iter_dkoldies_products(content, platform=None, max_results=16, backend=None, stats=None):
+    """
+    Extract products from a rendered DKOldies.com search results page,
+    yielding each one as soon as it is built.
+    
+    Args:
+        content (str): Page HTML
+        platform (str, optional): Game platform (e.g., 'ps1', 'snes')
+        max_results (int, optional): Maximum number of results to return
+            (None for every product on the page)
+        backend (str, optional): HTML parser backend (see html_parser.py)
+        stats (dict, optional): Given the page's product card count as
+            "cards", before any filtering (see extractor.py)
+        
+    Yields:
+        dict: Product dictionaries
+    """
+    yield from extract_products(load_spec('dkoldies'), content, platform, max_results, backend=backend, stats=stats)
+
+def parse_dkoldies_products(content, platform=None, max_results=16, backend=None):
+    """
+    Extract products from a rendered DKOldies.com search results page.
+    
+    Takes the same arguments as iter_dkoldies_products.
+    
+    Returns:
+        list: List of product dictionaries
+    """
+    return list(iter_dkoldies_products(content, platform, max_results, backend))
+
+async def _search_dkoldies_pages(first_content, search_url, load_page, platform, max_results, concurrency=None,
+                                 on_product=None, on_status=None):
+    """
+    Collect products across DKOldies result pages.
+    
+    Args:
+        first_content (str): HTML of the first results page
+        search_url (str): URL of the first results page
+        load_page (callable): Coroutine function taking a page URL and
+            returning its rendered HTML
+        platform (str, optional): Game platform (e.g., 'ps1', 'snes')
+        max_results (int): Stop once this many products have been found
+        concurrency (int, optional): Pages loaded at once
+        on_product (callable, optional): Called with each product as soon as it is built
+        on_status (callable, optional): Called as on_status(status, **fields) on progress
+        
+    Returns:
+        list: List of product dictionaries
+    """
+    products = []
+    seen_urls = set()
+    merge_products(products, iter_dkoldies_products(first_content, platform, None), seen_urls,
+                   max_results, on_product)
+    
+    pages = min(page_count(first_content), MAX_PAGES)
+    print(f"DKOldies search has {pages} page(s)", file=sys.stderr)
+    
+    def enough():
+        return len(products) >= max_results
+    
+    async def fetch_page(number):
+        # Every extra page load counts against the DKOldies rate limit
+        await acquire_async(DKOLDIES_HOST, max_wait=MAX_RATE_LIMIT_WAIT)
+        return number, await load_page(f"{search_url}&page={number}")
+    
+    remaining = [] if enough() else range(2, pages + 1)
+    for number, content in await fetch_pages_async(fetch_page, remaining, enough, concurrency):
+        if on_status:
+            on_status('page', page=number, pages=pages)
+        merge_products(products, iter_dkoldies_products(content, platform, None), seen_urls,
+                       max_results, on_product)
+    
+    return products
+
+async def _load_pooled_page(url):
+    """Load a search page on its own page from the shared browser pool."""
+    async with get_browser_pool().page() as page:
+        return await _load_search_page(page, url)
+
+async def search_dkoldies(query, platform=None, max_results=16, pooled=False, debug=False, use_cache=True,
+                          refresh=False, deep=False, on_product=None, on_status=None, raise_errors=False):
     """
     Search DKOldies.com for products matching the query and platform.
     
@@ -24,190 +311,123 @@ async def search_dkoldies(query, platform=None, max_results=16):
         query (str): Search term
         platform (str, optional): Game platform (e.g., 'ps1', 'snes')
         max_results (int, optional): Maximum number of results to return
+        pooled (bool, optional): Use the shared warm browser pool instead of
+            launching a browser for this search
+        debug (bool, optional): Enable debug mode
+        use_cache (bool, optional): Serve and store results in the shared result cache
+        refresh (bool, optional): Skip the cache lookup but still store the new results
+        deep (bool, optional): Read every result page (up to MAX_PAGES) instead
+            of just the first
+        on_product (callable, optional): Called with each product as soon as it is built
+        on_status (callable, optional): Called as on_status(status, **fields) on progress
+        raise_errors (bool, optional): Re-raise a failed search instead of returning an empty list
         
     Returns:
         list: List of product dictionaries
     """
+    if use_cache and not refresh:
+        cached_products = result_cache.get('dkoldies', query, platform, max_results, deep=deep)
+        if cached_products is not None:
+            if debug:
+                print("Using cached response", file=sys.stderr)
+            if on_status:
+                on_status('cached')
+            return emit_products(cached_products, on_product)
+    
     # Construct the search URL with proper encoding
     base_url = "https://www.dkoldies.com/searchresults.html"
     encoded_query = quote_plus(query)
     search_url = f"{base_url}?search_query={encoded_query}"
     
-    print(f"Searching URL: {search_url}", file=sys.stderr)
+    if debug:
+        print(f"Searching URL: {search_url}", file=sys.stderr)
+    
+    # Pace page loads across every worker sharing the cache database
+    try:
+        await acquire_async(DKOLDIES_HOST, max_wait=MAX_RATE_LIMIT_WAIT)
+    except RateLimitedError as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        if on_status:
+            on_status('error', error=str(e))
+        if raise_errors:
+            raise
+        return []
+    
+    # Skip the browser entirely while DKOldies keeps failing
+    breaker = get_breaker(DKOLDIES_HOST)
+    if not breaker.allow():
+        print("DKOldies circuit open; skipping search", file=sys.stderr)
+        if on_status:
+            on_status('error', error="DKOldies circuit open")
+        if raise_errors:
+            raise CircuitOpenError("DKOldies circuit open")
+        return []
+    
+    if on_status:
+        on_status('fetching', url=search_url)
+    
+    if pooled:
+        try:
+            content = await _load_pooled_page(search_url)
+            breaker.record_success()
+            if deep:
+                # Each extra page gets its own pooled page, loaded concurrently
+                products = await _search_dkoldies_pages(content, search_url, _load_pooled_page,
+                                                        platform, max_results,
+                                                        on_product=on_product, on_status=on_status)
+            else:
+                products = collect_products(iter_dkoldies_products(content, platform, max_results), on_product)
+            price_history.record(products)
+            if use_cache:
+                result_cache.put('dkoldies', query, platform, max_results, products, deep=deep)
+            return products
+        except Exception as e:
+            print(f"Error: {str(e)}", file=sys.stderr)
+            breaker.record_failure()
+            if on_status:
+                on_status('error', error=str(e))
+            if use_cache:
+                result_cache.put_failure('dkoldies', query, platform, max_results, deep=deep)
+            if raise_errors:
+                raise
+            return []
     
     async with async_playwright() as p:
+        browser = None
         try:
             # Launch browser
             browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            )
+            context = await _new_context(browser)
             page = await context.new_page()
             
-            # Go to search URL
-            await page.goto(search_url, wait_until='networkidle')
-            
-            # Wait for the product grid to load
-            await page.wait_for_selector('.productGrid', timeout=10000)
-            
-            # Give extra time for all products to load
-            await asyncio.sleep(2)
-            
-            # Get the page content
-            content = await page.content()
-            soup = BeautifulSoup(content, 'html.parser')
-            
-            # Find all product listings
-            products = []
-            
-            # Find the product grid
-            product_grid = soup.select_one('.productGrid')
-            if not product_grid:
-                print("Could not find product grid", file=sys.stderr)
-                return []
-            
-            # Find all product elements
-            product_elements = product_grid.select('.product')
-            print(f"Found {len(product_elements)} products on DKOldies.com", file=sys.stderr)
-            
-            for product_elem in product_elements[:max_results]:
-                try:
-                    # Extract product details
-                    # Title
-                    title_elem = product_elem.select_one('.card-title a')
-                    if not title_elem:
-                        print("Could not find product title element", file=sys.stderr)
-                        continue
-                    
-                    product_name = title_elem.text.strip()
-                    
-                    # Skip if platform filter is provided and doesn't match
-                    if platform and platform.lower() not in product_name.lower():
-                        continue
-                    
-                    # Check if product is out of stock
-                    is_out_of_stock = False
-                    out_of_stock_elem = product_elem.select_one('.productCard-outOfStockBadge, .out-of-stock, .sold-out')
-                    if out_of_stock_elem:
-                        is_out_of_stock = True
-                    
-                    # Also check if "Out of Stock" text appears in the product card
-                    if "out of stock" in product_elem.text.lower() or "sold out" in product_elem.text.lower():
-                        is_out_of_stock = True
-                    
-                    # Skip out-of-stock products
-                    if is_out_of_stock:
-                        print(f"Skipping out of stock product: {product_name}", file=sys.stderr)
-                        continue
-                    
-                    # URL
-                    product_url = title_elem['href'] if 'href' in title_elem.attrs else ""
-                    if product_url and not product_url.startswith('http'):
-                        product_url = f"https://www.dkoldies.com{product_url}"
-                    
-                    # Image
-                    img_url = ""
-                    img_elem = product_elem.select_one('.card-image')
-                    if img_elem and 'src' in img_elem.attrs:
-                        img_url = img_elem['src']
-                    else:
-                        img_elem = product_elem.select_one('.card-img-container img')
-                        if img_elem and 'src' in img_elem.attrs:
-                            img_url = img_elem['src']
-                    
-                    if img_url and not img_url.startswith('http'):
-                        img_url = f"https://www.dkoldies.com{img_url}"
-                    
-                    # Price
-                    price = "Price not available"
-                    price_elem = product_elem.select_one('.price:not(.price--rrp)')
-                    if price_elem:
-                        price = price_elem.text.strip()
-                    
-                    # Extract description/summary
-                    description = f"From DKOldies.com"
-                    
-                    # Reviews
-                    review_count_elem = product_elem.select_one('.yotpo-bottomline p.text-m')
-                    review_count = "0 Reviews"
-                    if review_count_elem:
-                        review_count = review_count_elem.text.strip()
-                        description += f" • {review_count}"
-                    
-                    # Determine condition from title (approximate)
-                    condition = "Used"
-                    if "new" in product_name.lower():
-                        condition = "New"
-                    elif "sealed" in product_name.lower():
-                        condition = "Sealed"
-                    elif "complete" in product_name.lower() or "cib" in product_name.lower():
-                        condition = "Complete"
-                    elif "loose" in product_name.lower():
-                        condition = "Loose"
-                    
-                    # Extract platform from title (approximate)
-                    detected_platform = None
-                    platform_keywords = {
-                        "ps1": ["playstation", "ps1", "psx", "psone"],
-                        "ps2": ["playstation 2", "ps2"],
-                        "ps3": ["playstation 3", "ps3"],
-                        "ps4": ["playstation 4", "ps4"],
-                        "ps5": ["playstation 5", "ps5"],
-                        "psp": ["psp", "playstation portable"],
-                        "ps vita": ["ps vita", "playstation vita", "vita"],
-                        "snes": ["super nintendo", "snes", "super nes"],
-                        "nes": ["nintendo entertainment system", "nes"],
-                        "n64": ["nintendo 64", "n64"],
-                        "gamecube": ["gamecube", "nintendo gamecube", "gcn"],
-                        "wii": ["nintendo wii", "wii"],
-                        "wii u": ["nintendo wii u", "wii u"],
-                        "switch": ["nintendo switch", "switch"],
-                        "game boy": ["game boy", "gameboy", "gba", "gbc"],
-                        "ds": ["nintendo ds", "nds", "ds"],
-                        "3ds": ["nintendo 3ds", "3ds"],
-                        "genesis": ["genesis", "sega genesis", "mega drive"],
-                        "dreamcast": ["dreamcast", "sega dreamcast"],
-                        "saturn": ["saturn", "sega saturn"],
-                        "game gear": ["game gear", "sega game gear"],
-                        "xbox": ["xbox"],
-                        "xbox 360": ["xbox 360"],
-                        "xbox one": ["xbox one"],
-                        "xbox series": ["xbox series"]
-                    }
-                    
-                    for p, keywords in platform_keywords.items():
-                        if any(keyword in product_name.lower() for keyword in keywords):
-                            detected_platform = p
-                            break
-                    
-                    # Create product object
-                    product = {
-                        "id": f"dkoldies-{hash(product_url)}",
-                        "title": product_name,
-                        "description": description,
-                        "price": price,
-                        "source": "DKOldies",
-                        "time": "Just now",  # We don't have actual listing time
-                        "image": img_url,
-                        "condition": condition,
-                        "url": product_url,
-                        "platform": detected_platform
-                    }
-                    
-                    products.append(product)
-                    
-                except Exception as e:
-                    print(f"Error parsing product: {str(e)}", file=sys.stderr)
-                    continue
-            
+            content = await _load_search_page(page, search_url)
+            breaker.record_success()
+            if deep:
+                # One browser page, so the extra pages load one after another
+                products = await _search_dkoldies_pages(content, search_url,
+                                                        lambda url: _load_search_page(page, url),
+                                                        platform, max_results, concurrency=1,
+                                                        on_product=on_product, on_status=on_status)
+            else:
+                products = collect_products(iter_dkoldies_products(content, platform, max_results), on_product)
+            price_history.record(products)
+            if use_cache:
+                result_cache.put('dkoldies', query, platform, max_results, products, deep=deep)
             return products
             
         except Exception as e:
             print(f"Error: {str(e)}", file=sys.stderr)
+            breaker.record_failure()
+            if on_status:
+                on_status('error', error=str(e))
+            if use_cache:
+                result_cache.put_failure('dkoldies', query, platform, max_results, deep=deep)
+            if raise_errors:
+                raise
             return []
         finally:
-            await browser.close()
+            if browser:
+                await browser.close()
 
 async def main():
     """Main function to handle command line arguments and execute the search."""
@@ -215,6 +435,8 @@ async def main():
     parser.add_argument('--query', type=str, required=True, help='Search term')
     parser.add_argument('--platform', type=str, help='Game platform (e.g., ps1, snes)')
     parser.add_argument('--max_results', type=int, default=16, help='Maximum number of results')
+    parser.add_argument('--deep', action='store_true', help='Read every result page, not just the first')
+    parser.add_argument('--stream', action='store_true', help='Write NDJSON records as products are found')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
     
     args = parser.parse_args()
@@ -222,9 +444,17 @@ async def main():
     if args.debug:
         print(f"Searching for '{args.query}' on DKOldies.com...", file=sys.stderr)
     
+    if args.stream:
+        with NDJSONWriter('dkoldies') as stream:
+            stream.status('searching', query=args.query, platform=args.platform)
+            await search_dkoldies(args.query, args.platform, args.max_results, debug=args.debug, deep=args.deep,
+                                  on_product=stream.product, on_status=stream.status)
+        return
+    
     try:
         # Execute search
-        products = await search_dkoldies(args.query, args.platform, args.max_results)
+        products = await search_dkoldies(args.query, args.platform, args.max_results, debug=args.debug,
+                                         deep=args.deep)
         
         if args.debug:
             print(f"Found {len(products)} products", file=sys.stderr)
@@ -9,16 +9,174 @@ Uses Ecwid's API for reliable data extraction.
 
 import sys
 import json
-import time
 import argparse
 import requests
-from datetime import datetime
 from urllib.parse import quote_plus
 
+import http_client
+import result_cache
+import price_history
+from platforms import classify_condition, classify_platform
+from prices import cents_from_amount, format_price, DEFAULT_CURRENCY
+from pagination import MAX_PAGES, fetch_pages, merge_products
+from streaming import NDJSONWriter, collect_products, emit_products
+
 # JJGames Ecwid Store ID (obtained from their website)
 JJGAMES_STORE_ID = "1003"
 
-def search_jjgames(query, platform=None, max_results=16, debug=False):
+# Most items Ecwid returns per search request
+ECWID_PAGE_LIMIT = 100
+
+API_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36',
+    'Accept': 'application/json',
+    'Referer': 'https://www.jjgames.com/'
+}
+
+def iter_jjgames_products(data, platform=None, debug=False):
+    """
+    Extract products from a JJGames.com (Ecwid) search API response,
+    yielding each one as soon as it is built.
+    
+    Args:
+        data (dict): Decoded JSON response
+        platform (str, optional): Game platform (e.g., 'ps1', 'snes')
+        debug (bool, optional): Enable debug mode
+        
+    Yields:
+        dict: Product dictionaries
+    """
+    if 'items' not in data:
+        if debug:
+            print("No items found in API response", file=sys.stderr)
+        return
+    
+    count = 0
+    for item in data['items']:
+        try:
+            product_name = item.get('name', '')
+            
+            # Skip if platform filter is provided and doesn't match
+            if platform and platform.lower() not in product_name.lower():
+                continue
+            
+            # Get the product URL
+            product_url = f"https://www.jjgames.com/#!/~/product/{item.get('id')}"
+            
+            # Get the price from the raw numeric value rather than the
+            # formatted string; depending on the endpoint Ecwid sends either
+            # a number or {"value": ..., "formatted": ...}
+            raw_price = item.get('price')
+            if isinstance(raw_price, dict):
+                price_cents = cents_from_amount(raw_price.get('value'))
+                price = raw_price.get('formatted') or format_price(price_cents)
+            else:
+                price_cents = cents_from_amount(raw_price)
+                price = item.get('defaultDisplayedPriceFormatted') or format_price(price_cents)
+            currency = DEFAULT_CURRENCY
+            
+            # Get the image
+            img_url = item.get('thumbnailUrl', '')
+            
+            # Check if product is out of stock
+            is_out_of_stock = not item.get('inStock', True)
+            
+            # Skip out-of-stock products
+            if is_out_of_stock:
+                if debug:
+                    print(f"Skipping out of stock product: {product_name}", file=sys.stderr)
+                continue
+            
+            # Get the description
+            description = item.get('description', 'From JJGames.com')
+            if description:
+                description = description[:200] + "..." if len(description) > 200 else description
+            
+            # Add availability info to description
+            if not is_out_of_stock:
+                description += " • In Stock"
+            
+            # Determine condition and platform from title (approximate)
+            condition = classify_condition(product_name)
+            detected_platform = classify_platform(product_name)
+            
+            # Create product object
+            product = {
+                "id": f"jjgames-{item.get('id')}",
+                "title": product_name,
+                "description": description,
+                "price": price,
+                "price_cents": price_cents,
+                "currency": currency,
+                "source": "JJGames",
+                "time": "Just now",  # We don't have actual listing time
+                "image": img_url,
+                "condition": condition,
+                "url": product_url,
+                "platform": detected_platform
+            }
+            
+        except Exception as e:
+            if debug:
+                print(f"Error parsing product: {str(e)}", file=sys.stderr)
+            continue
+        
+        count += 1
+        yield product
+    
+    if debug:
+        print(f"Found {count} products on JJGames.com", file=sys.stderr)
+
+def parse_jjgames_products(data, platform=None, debug=False):
+    """
+    Extract products from a JJGames.com (Ecwid) search API response.
+    
+    Takes the same arguments as iter_jjgames_products.
+    
+    Returns:
+        list: List of product dictionaries
+    """
+    return list(iter_jjgames_products(data, platform, debug))
+
+def _fetch_jjgames_page(api_url, offset):
+    """Fetch one page of Ecwid search results starting at offset, returning (offset, data)."""
+    response = http_client.get(f"{api_url}&offset={offset}", headers=API_HEADERS, timeout=30)
+    response.raise_for_status()
+    return offset, response.json()
+
+def _search_jjgames_pages(first_data, api_url, platform, max_results, debug=False,
+                          on_product=None, on_status=None):
+    """
+    Collect products across Ecwid result pages.
+
+    Ecwid reports the total match count, so every remaining offset is known
+    up front; pages are fetched concurrently and read in order until
+    max_results matches have been found.
+    """
+    products = []
+    seen_urls = set()
+    merge_products(products, iter_jjgames_products(first_data, platform, debug), seen_urls,
+                   max_results, on_product)
+    
+    total = min(int(first_data.get('total', 0)), ECWID_PAGE_LIMIT * MAX_PAGES)
+    if debug:
+        print(f"{first_data.get('total', 0)} matching items; {len(products)} on the first page", file=sys.stderr)
+    
+    def enough():
+        return len(products) >= max_results
+    
+    pages = (total + ECWID_PAGE_LIMIT - 1) // ECWID_PAGE_LIMIT
+    offsets = [] if enough() else range(ECWID_PAGE_LIMIT, total, ECWID_PAGE_LIMIT)
+    for offset, data in fetch_pages(lambda offset: _fetch_jjgames_page(api_url, offset), offsets, enough):
+        if on_status:
+            on_status('page', page=offset // ECWID_PAGE_LIMIT + 1, pages=pages)
+        merge_products(products, iter_jjgames_products(data, platform, debug), seen_urls,
+                       max_results, on_product)
+    
+    return products
+
+def search_jjgames(query, platform=None, max_results=16, debug=False, use_cache=True, refresh=False, deep=False,
+                   on_product=None, on_status=None, raise_errors=False):
     """
     Search JJGames.com for products matching the query and platform.
     
@@ -27,152 +185,74 @@ def search_jjgames(query, platform=None, max_results=16, debug=False):
         platform (str, optional): Game platform (e.g., 'ps1', 'snes')
         max_results (int, optional): Maximum number of results to return
         debug (bool, optional): Enable debug mode
+        use_cache (bool, optional): Serve and store results in the shared result cache
+        refresh (bool, optional): Skip the cache lookup but still store the new results
+        deep (bool, optional): Page through every match (up to MAX_PAGES requests)
+            instead of a single request
+        on_product (callable, optional): Called with each product as soon as it is built
+        on_status (callable, optional): Called as on_status(status, **fields) on progress
+        raise_errors (bool, optional): Re-raise a failed search instead of returning an empty list
         
     Returns:
         list: List of product dictionaries
     """
+    if use_cache and not refresh:
+        cached_products = result_cache.get('jjgames', query, platform, max_results, deep=deep)
+        if cached_products is not None:
+            if debug:
+                print("Using cached response", file=sys.stderr)
+            if on_status:
+                on_status('cached')
+            return emit_products(cached_products, on_product)
+    
     # Construct the API URL with proper encoding
     encoded_query = quote_plus(query)
-    api_url = f"https://app.ecwid.com/api/v3/{JJGAMES_STORE_ID}/search?keyword={encoded_query}&limit={max_results}"
+    limit = ECWID_PAGE_LIMIT if deep else min(max_results, ECWID_PAGE_LIMIT)
+    api_url = f"https://app.ecwid.com/api/v3/{JJGAMES_STORE_ID}/search?keyword={encoded_query}&limit={limit}"
     
     if debug:
         print(f"Making API request to: {api_url}", file=sys.stderr)
     
     try:
-        # Set up headers to mimic a browser
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36',
-            'Accept': 'application/json',
-            'Referer': 'https://www.jjgames.com/'
-        }
-        
         # Make the API request
-        response = requests.get(api_url, headers=headers, timeout=30)
+        if on_status:
+            on_status('fetching', url=api_url)
+        response = http_client.get(api_url, headers=API_HEADERS, timeout=30)
         response.raise_for_status()
         
         # Parse the JSON response
         data = response.json()
         
-        if 'items' not in data:
-            if debug:
-                print("No items found in API response", file=sys.stderr)
-            return []
+        if deep:
+            products = _search_jjgames_pages(data, api_url, platform, max_results, debug,
+                                             on_product, on_status)
+        else:
+            products = collect_products(iter_jjgames_products(data, platform, debug), on_product)
         
-        products = []
-        for item in data['items']:
-            try:
-                product_name = item.get('name', '')
-                
-                # Skip if platform filter is provided and doesn't match
-                if platform and platform.lower() not in product_name.lower():
-                    continue
-                
-                # Get the product URL
-                product_url = f"https://www.jjgames.com/#!/~/product/{item.get('id')}"
-                
-                # Get the price
-                price = item.get('price', {}).get('formatted', 'Price not available')
-                
-                # Get the image
-                img_url = item.get('thumbnailUrl', '')
-                
-                # Check if product is out of stock
-                is_out_of_stock = not item.get('inStock', True)
-                
-                # Skip out-of-stock products
-                if is_out_of_stock:
-                    if debug:
-                        print(f"Skipping out of stock product: {product_name}", file=sys.stderr)
-                    continue
-                
-                # Get the description
-                description = item.get('description', 'From JJGames.com')
-                if description:
-                    description = description[:200] + "..." if len(description) > 200 else description
-                
-                # Add availability info to description
-                if not is_out_of_stock:
-                    description += " • In Stock"
-                
-                # Determine condition from title (approximate)
-                condition = "Used"
-                if "new" in product_name.lower():
-                    condition = "New"
-                elif "sealed" in product_name.lower():
-                    condition = "Sealed"
-                elif "complete" in product_name.lower() or "cib" in product_name.lower():
-                    condition = "Complete"
-                elif "loose" in product_name.lower():
-                    condition = "Loose"
-                
-                # Extract platform from title (approximate)
-                detected_platform = None
-                platform_keywords = {
-                    "ps1": ["playstation", "ps1", "psx", "psone"],
-                    "ps2": ["playstation 2", "ps2"],
-                    "ps3": ["playstation 3", "ps3"],
-                    "ps4": ["playstation 4", "ps4"],
-                    "ps5": ["playstation 5", "ps5"],
-                    "psp": ["psp", "playstation portable"],
-                    "ps vita": ["ps vita", "playstation vita", "vita"],
-                    "snes": ["super nintendo", "snes", "super nes"],
-                    "nes": ["nintendo entertainment system", "nes"],
-                    "n64": ["nintendo 64", "n64"],
-                    "gamecube": ["gamecube", "nintendo gamecube", "gcn"],
-                    "wii": ["nintendo wii", "wii"],
-                    "wii u": ["nintendo wii u", "wii u"],
-                    "switch": ["nintendo switch", "switch"],
-                    "game boy": ["game boy", "gameboy", "gba", "gbc"],
-                    "ds": ["nintendo ds", "nds", "ds"],
-                    "3ds": ["nintendo 3ds", "3ds"],
-                    "genesis": ["genesis", "sega genesis", "mega drive"],
-                    "dreamcast": ["dreamcast", "sega dreamcast"],
-                    "saturn": ["saturn", "sega saturn"],
-                    "game gear": ["game gear", "sega game gear"],
-                    "xbox": ["xbox"],
-                    "xbox 360": ["xbox 360"],
-                    "xbox one": ["xbox one"],
-                    "xbox series": ["xbox series"]
-                }
-                
-                for p, keywords in platform_keywords.items():
-                    if any(keyword in product_name.lower() for keyword in keywords):
-                        detected_platform = p
-                        break
-                
-                # Create product object
-                product = {
-                    "id": f"jjgames-{item.get('id')}",
-                    "title": product_name,
-                    "description": description,
-                    "price": price,
-                    "source": "JJGames",
-                    "time": "Just now",  # We don't have actual listing time
-                    "image": img_url,
-                    "condition": condition,
-                    "url": product_url,
-                    "platform": detected_platform
-                }
-                
-                products.append(product)
-                
-            except Exception as e:
-                if debug:
-                    print(f"Error parsing product: {str(e)}", file=sys.stderr)
-                continue
+        price_history.record(products)
         
-        if debug:
-            print(f"Found {len(products)} products on JJGames.com", file=sys.stderr)
+        if use_cache:
+            result_cache.put('jjgames', query, platform, max_results, products, deep=deep)
         
         return products
         
     except requests.RequestException as e:
         if debug:
             print(f"Request error: {str(e)}", file=sys.stderr)
+        if on_status:
+            on_status('error', error=str(e))
+        if use_cache:
+            result_cache.put_failure('jjgames', query, platform, max_results, deep=deep)
+        if raise_errors:
+            raise
         return []
     except Exception as e:
         if debug:
             print(f"Unexpected error: {str(e)}", file=sys.stderr)
+        if on_status:
+            on_status('error', error=str(e))
+        if raise_errors:
+            raise
         return []
 
 def main():
@@ -181,6 +261,8 @@ def main():
     parser.add_argument('--query', type=str, required=True, help='Search term')
     parser.add_argument('--platform', type=str, help='Game platform (e.g., ps1, snes)')
     parser.add_argument('--max_results', type=int, default=16, help='Maximum number of results')
+    parser.add_argument('--deep', action='store_true', help='Page through every match, not just the first request')
+    parser.add_argument('--stream', action='store_true', help='Write NDJSON records as products are found')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
     
     args = parser.parse_args()
@@ -188,9 +270,16 @@ def main():
     if args.debug:
         print(f"Searching for '{args.query}' on JJGames.com...", file=sys.stderr)
     
+    if args.stream:
+        with NDJSONWriter('jjgames') as stream:
+            stream.status('searching', query=args.query, platform=args.platform)
+            search_jjgames(args.query, args.platform, args.max_results, args.debug, deep=args.deep,
+                           on_product=stream.product, on_status=stream.status)
+        return
+    
     try:
         # Execute search
-        products = search_jjgames(args.query, args.platform, args.max_results, args.debug)
+        products = search_jjgames(args.query, args.platform, args.max_results, args.debug, deep=args.deep)
         
         if args.debug:
             print(f"Found {len(products)} products", file=sys.stderr)
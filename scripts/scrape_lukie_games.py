@@ -8,11 +8,15 @@ It returns the data in JSON format for use in the LootScout application.
 
 import sys
 import json
-import time
 import argparse
-from datetime import datetime
 import requests
-from bs4 import BeautifulSoup
+
+import http_client
+import result_cache
+import price_history
+from extractor import extract_products, load_spec
+from html_parser import response_charset
+from streaming import NDJSONWriter, collect_products, emit_products
 
 # Set up headers to mimic a browser
 HEADERS = {
@@ -24,7 +28,39 @@ HEADERS = {
     'Cache-Control': 'max-age=0',
 }
 
-def search_lukie_games(query, platform=None, max_results=16):
+def iter_lukie_games_products(content, platform=None, max_results=16, backend=None, encoding=None, stats=None):
+    """
+    Extract products from a LukieGames.com search results page, yielding
+    each one as soon as it is built.
+    
+    Args:
+        content (bytes or str): Raw page HTML
+        platform (str, optional): Game platform (e.g., 'ps1', 'snes')
+        max_results (int, optional): Maximum number of results to return
+        backend (str, optional): HTML parser backend (see html_parser.py)
+        encoding (str, optional): Charset from the response headers, if any
+        stats (dict, optional): Given the page's product card count as
+            "cards", before any filtering (see extractor.py)
+        
+    Yields:
+        dict: Product dictionaries
+    """
+    yield from extract_products(load_spec('lukie-games'), content, platform, max_results, backend=backend,
+                                encoding=encoding, stats=stats)
+
+def parse_lukie_games_products(content, platform=None, max_results=16, backend=None, encoding=None):
+    """
+    Extract products from a LukieGames.com search results page.
+    
+    Takes the same arguments as iter_lukie_games_products.
+    
+    Returns:
+        list: List of product dictionaries
+    """
+    return list(iter_lukie_games_products(content, platform, max_results, backend, encoding))
+
+def search_lukie_games(query, platform=None, max_results=16, use_cache=True, refresh=False,
+                       on_product=None, on_status=None, raise_errors=False):
     """
     Search LukieGames.com for products matching the query and platform.
     
@@ -32,128 +68,71 @@ def search_lukie_games(query, platform=None, max_results=16):
         query (str): Search term
         platform (str, optional): Game platform (e.g., 'ps1', 'snes')
         max_results (int, optional): Maximum number of results to return
+        use_cache (bool, optional): Serve and store results in the shared result cache
+        refresh (bool, optional): Skip the cache lookup but still store the new results
+        on_product (callable, optional): Called with each product as soon as it is built
+        on_status (callable, optional): Called as on_status(status, **fields) on progress
+        raise_errors (bool, optional): Re-raise a failed search instead of returning an empty list
         
     Returns:
         list: List of product dictionaries
     """
+    if use_cache and not refresh:
+        cached_products = result_cache.get('lukie-games', query, platform, max_results)
+        if cached_products is not None:
+            if on_status:
+                on_status('cached')
+            return emit_products(cached_products, on_product)
+    
     # Construct the search URL
     base_url = "https://www.lukiegames.com/search.asp"
     search_url = f"{base_url}?q={query}"
     
     try:
+        # Revalidate an expired entry instead of downloading the page again
+        conditional = result_cache.conditional_headers('lukie-games', query, platform, max_results) if use_cache else {}
+        
         # Make the request
-        response = requests.get(search_url, headers=HEADERS, timeout=10)
+        if on_status:
+            on_status('fetching', url=search_url)
+        response = http_client.get(search_url, headers={**HEADERS, **conditional}, timeout=10)
+        if response.status_code == 304:
+            cached_products = result_cache.revalidated('lukie-games', query, platform, max_results)
+            if cached_products is not None:
+                if on_status:
+                    on_status('not_modified')
+                return emit_products(cached_products, on_product)
+            # The entry was evicted since the request went out
+            response = http_client.get(search_url, headers=HEADERS, timeout=10)
         response.raise_for_status()
         
-        # Parse the HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
+        # Parse the raw bytes directly, skipping response.text charset sniffing
+        products = collect_products(iter_lukie_games_products(response.content, platform, max_results,
+                                                              encoding=response_charset(response)),
+                                    on_product)
         
-        # Find all product listings
-        products = []
-        product_elements = soup.select('.ss__result.ss__result--item')
+        price_history.record(products)
         
-        print(f"Found {len(product_elements)} products on LukieGames.com", file=sys.stderr)
-        
-        for product_elem in product_elements[:max_results]:
-            try:
-                try:
-                    # Extract product details from the correct HTML structure
-                    product_name_elem = product_elem.select_one('.ss__result__name a')
-                    if not product_name_elem:
-                        print("Could not find product name element", file=sys.stderr)
-                        continue
-                    
-                    product_name = product_name_elem.text.strip()
-                    product_url = product_name_elem['href']
-                    if not product_url.startswith('http'):
-                        product_url = f"https://www.lukiegames.com{product_url}"
-                    
-                    # Skip if platform filter is provided and doesn't match
-                    if platform and platform.lower() not in product_name.lower():
-                        continue
-                    
-                    # Extract price - first try sale price, then regular price
-                    price_elem = product_elem.select_one('.ss__result__price.ss__result__price--on-sale')
-                    if not price_elem:
-                        price_elem = product_elem.select_one('.ss__result__price')
-                    
-                    # Extract the actual price text (removing labels)
-                    if price_elem:
-                        # Get the text content directly from the element, not its children
-                        price_text = price_elem.get_text(strip=True)
-                        # Extract just the price part (e.g., "$40.97" from "On Sale:$40.97")
-                        price = price_text.split(":")[-1] if ":" in price_text else price_text
-                    else:
-                        price = "Price not available"
-                    
-                    # Extract image
-                    img_link = product_elem.select_one('.ss__result__image a')
-                    if img_link:
-                        img_elem = img_link.select_one('img')
-                        img_url = img_elem['src'] if img_elem and 'src' in img_elem.attrs else ""
-                        if img_url and not img_url.startswith('http'):
-                            img_url = f"https://www.lukiegames.com{img_url}"
-                    else:
-                        img_url = ""
-                    
-                    # Extract stock status
-                    stock_elem = product_elem.select_one('.ss__result__shipping__label')
-                    in_stock = stock_elem and "In Stock" in stock_elem.text if stock_elem else False
-                except Exception as e:
-                    print(f"Error extracting product details: {str(e)}", file=sys.stderr)
-                    continue
-                
-                # Determine condition from title (approximate)
-                condition = "Used"
-                if "new" in product_name.lower():
-                    condition = "New"
-                elif "sealed" in product_name.lower():
-                    condition = "Sealed"
-                elif "complete" in product_name.lower():
-                    condition = "Complete"
-                
-                # Extract platform from title (approximate)
-                detected_platform = None
-                platform_keywords = {
-                    "ps1": ["playstation", "ps1", "psx", "psone"],
-                    "snes": ["super nintendo", "snes", "super nes"],
-                    "n64": ["nintendo 64", "n64"],
-                    "game boy": ["game boy", "gameboy", "gba", "gbc"],
-                    "genesis": ["genesis", "sega genesis", "mega drive"]
-                }
-                
-                for p, keywords in platform_keywords.items():
-                    if any(keyword in product_name.lower() for keyword in keywords):
-                        detected_platform = p
-                        break
-                
-                # Create product object
-                product = {
-                    "id": f"lukie-{hash(product_url)}",
-                    "title": product_name,
-                    "description": f"From LukieGames.com",
-                    "price": price,
-                    "source": "LukieGames",
-                    "time": "Just now",  # We don't have actual listing time
-                    "image": img_url,
-                    "condition": condition,
-                    "url": product_url,
-                    "platform": detected_platform
-                }
-                
-                products.append(product)
-                
-            except Exception as e:
-                print(f"Error parsing product: {str(e)}", file=sys.stderr)
-                continue
+        if use_cache:
+            result_cache.put('lukie-games', query, platform, max_results, products, response=response)
         
         return products
         
     except requests.RequestException as e:
         print(f"Request error: {str(e)}", file=sys.stderr)
+        if on_status:
+            on_status('error', error=str(e))
+        if use_cache:
+            result_cache.put_failure('lukie-games', query, platform, max_results)
+        if raise_errors:
+            raise
         return []
     except Exception as e:
         print(f"Unexpected error: {str(e)}", file=sys.stderr)
+        if on_status:
+            on_status('error', error=str(e))
+        if raise_errors:
+            raise
         return []
 
 def main():
@@ -162,6 +141,7 @@ def main():
     parser.add_argument('--query', type=str, required=True, help='Search term')
     parser.add_argument('--platform', type=str, help='Game platform (e.g., ps1, snes)')
     parser.add_argument('--max_results', type=int, default=16, help='Maximum number of results')
+    parser.add_argument('--stream', action='store_true', help='Write NDJSON records as products are found')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
     
     args = parser.parse_args()
@@ -169,6 +149,13 @@ def main():
     if args.debug:
         print(f"Searching for '{args.query}' on LukieGames.com...", file=sys.stderr)
     
+    if args.stream:
+        with NDJSONWriter('lukie-games') as stream:
+            stream.status('searching', query=args.query, platform=args.platform)
+            search_lukie_games(args.query, args.platform, args.max_results,
+                               on_product=stream.product, on_status=stream.status)
+        return
+    
     try:
         # Execute search
         products = search_lukie_games(args.query, args.platform, args.max_results)
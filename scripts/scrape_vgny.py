@@ -8,16 +8,16 @@ It returns the data in JSON format for use in the LootScout application.
 
 import sys
 import json
-import time
 import argparse
-from datetime import datetime
 import requests
-from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-import os
-import hashlib
-from pathlib import Path
+
+import http_client
+import result_cache
+import price_history
+from extractor import extract_products, load_spec
+from html_parser import response_charset
+from pagination import MAX_PAGES, fetch_pages, merge_products, page_count
+from streaming import NDJSONWriter, collect_products, emit_products
 
 # Set up headers to mimic a browser
 HEADERS = {
@@ -29,65 +29,79 @@ HEADERS = {
     'Cache-Control': 'max-age=0',
 }
 
-# Cache configuration
-CACHE_DIR = Path(os.path.expanduser("~/.cache/lootscout"))
-CACHE_DURATION = 3600  # Cache for 1 hour
-
-def setup_cache_dir():
-    """Create cache directory if it doesn't exist."""
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-
-def get_cached_response(query, platform):
-    """Get cached response if it exists and is not expired."""
-    if not CACHE_DIR.exists():
-        return None
+def iter_vgny_products(content, platform=None, max_results=16, debug=False, backend=None, encoding=None,
+                       stats=None):
+    """
+    Extract products from a VideoGamesNewYork.com search results page,
+    yielding each one as soon as it is built.
+    
+    Args:
+        content (bytes or str): Raw page HTML
+        platform (str, optional): Game platform (e.g., 'ps1', 'snes')
+        max_results (int, optional): Maximum number of results to return
+            (None for every product on the page)
+        debug (bool, optional): Enable debug mode
+        backend (str, optional): HTML parser backend (see html_parser.py)
+        encoding (str, optional): Charset from the response headers, if any
+        stats (dict, optional): Given the page's product card count as
+            "cards", before any filtering (see extractor.py)
         
-    cache_key = hashlib.md5(f"{query}-{platform}".encode()).hexdigest()
-    cache_file = CACHE_DIR / f"vgny-{cache_key}.json"
+    Yields:
+        dict: Product dictionaries
+    """
+    yield from extract_products(load_spec('vgny'), content, platform, max_results, debug, backend, encoding, stats)
+
+def parse_vgny_products(content, platform=None, max_results=16, debug=False, backend=None, encoding=None):
+    """
+    Extract products from a VideoGamesNewYork.com search results page.
+    
+    Takes the same arguments as iter_vgny_products.
     
-    if cache_file.exists():
-        try:
-            data = json.loads(cache_file.read_text())
-            if time.time() - data['timestamp'] < CACHE_DURATION:
-                return data['products']
-        except Exception:
-            pass
-    return None
+    Returns:
+        list: List of product dictionaries
+    """
+    return list(iter_vgny_products(content, platform, max_results, debug, backend, encoding))
 
-def cache_response(query, platform, products):
-    """Cache the response for future use."""
-    try:
-        setup_cache_dir()
-        cache_key = hashlib.md5(f"{query}-{platform}".encode()).hexdigest()
-        cache_file = CACHE_DIR / f"vgny-{cache_key}.json"
-        
-        data = {
-            'timestamp': time.time(),
-            'products': products
-        }
-        cache_file.write_text(json.dumps(data))
-    except Exception as e:
-        print(f"Error caching response: {str(e)}", file=sys.stderr)
+def _fetch_vgny_page(base_url, params, page):
+    """Fetch one page of VGNY search results, returning (page, response)."""
+    response = http_client.get(base_url, params={**params, 'page': page}, headers=HEADERS, timeout=15)
+    response.raise_for_status()
+    return page, response
 
-def create_session():
-    """Create a requests session with retries and timeouts."""
-    session = requests.Session()
+def _search_vgny_pages(first_response, base_url, params, platform, max_results, debug=False,
+                       on_product=None, on_status=None):
+    """
+    Collect products across every results page.
+
+    The page count comes from the first page's pagination links; the rest
+    are fetched concurrently and read in order until max_results in-stock
+    matches have been found.
+    """
+    encoding = response_charset(first_response)
+    products = []
+    seen_urls = set()
+    merge_products(products, iter_vgny_products(first_response.content, platform, None, debug,
+                                                encoding=encoding), seen_urls, max_results, on_product)
     
-    # Configure retries
-    retries = Retry(
-        total=3,  # number of retries
-        backoff_factor=0.5,  # wait 0.5s * (2 ** retry) between retries
-        status_forcelist=[500, 502, 503, 504],  # retry on these status codes
-    )
+    pages = min(page_count(first_response.content, encoding=encoding), MAX_PAGES)
+    if debug:
+        print(f"{pages} result page(s); {len(products)} products on page 1", file=sys.stderr)
     
-    # Add retry adapter to session
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
+    def enough():
+        return len(products) >= max_results
     
-    return session
+    remaining = [] if enough() else range(2, pages + 1)
+    for page, response in fetch_pages(lambda page: _fetch_vgny_page(base_url, params, page), remaining, enough):
+        if on_status:
+            on_status('page', page=page, pages=pages)
+        merge_products(products, iter_vgny_products(response.content, platform, None, debug,
+                                                    encoding=response_charset(response)),
+                       seen_urls, max_results, on_product)
+    
+    return products
 
-def search_vgny(query, platform=None, max_results=16, debug=False):
+def search_vgny(query, platform=None, max_results=16, debug=False, use_cache=True, refresh=False, deep=False,
+                on_product=None, on_status=None, raise_errors=False):
     """
     Search VideoGamesNewYork.com for products matching the query and platform.
     
@@ -96,16 +110,25 @@ def search_vgny(query, platform=None, max_results=16, debug=False):
         platform (str, optional): Game platform (e.g., 'ps1', 'snes')
         max_results (int, optional): Maximum number of results to return
         debug (bool, optional): Enable debug mode
+        use_cache (bool, optional): Serve and store results in the shared result cache
+        refresh (bool, optional): Skip the cache lookup but still store the new results
+        deep (bool, optional): Read every results page (up to MAX_PAGES), not just the first
+        on_product (callable, optional): Called with each product as soon as it is built
+        on_status (callable, optional): Called as on_status(status, **fields) on progress
+        raise_errors (bool, optional): Re-raise a failed search instead of returning an empty list
         
     Returns:
         list: List of product dictionaries
     """
     # Check cache first
-    cached_products = get_cached_response(query, platform)
-    if cached_products is not None:
-        if debug:
-            print("Using cached response", file=sys.stderr)
-        return cached_products[:max_results]
+    if use_cache and not refresh:
+        cached_products = result_cache.get('vgny', query, platform, max_results, deep=deep)
+        if cached_products is not None:
+            if debug:
+                print("Using cached response", file=sys.stderr)
+            if on_status:
+                on_status('cached')
+            return emit_products(cached_products, on_product)
     
     # Construct the search URL
     base_url = "https://videogamesnewyork.com/search.php"
@@ -115,214 +138,65 @@ def search_vgny(query, platform=None, max_results=16, debug=False):
     }
     
     try:
-        # Create session with retries
-        session = create_session()
-        
-        # Rate limiting - sleep briefly before request
-        time.sleep(0.5)
+        # Revalidate an expired entry instead of downloading the page again.
+        # A deep search spans pages the validators don't cover.
+        use_validators = use_cache and not deep
+        conditional = result_cache.conditional_headers('vgny', query, platform, max_results) if use_validators else {}
         
         # Make the request
-        response = session.get(base_url, params=params, headers=HEADERS, timeout=15)
+        if on_status:
+            on_status('fetching', url=base_url)
+        response = http_client.get(base_url, params=params, headers={**HEADERS, **conditional}, timeout=15)
+        if response.status_code == 304:
+            cached_products = result_cache.revalidated('vgny', query, platform, max_results)
+            if cached_products is not None:
+                if debug:
+                    print("Not modified; reusing cached products", file=sys.stderr)
+                if on_status:
+                    on_status('not_modified')
+                return emit_products(cached_products, on_product)
+            # The entry was evicted since the request went out
+            response = http_client.get(base_url, params=params, headers=HEADERS, timeout=15)
         response.raise_for_status()
         
-        # Parse the HTML
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
         if debug:
-            print(f"Response encoding: {response.encoding}", file=sys.stderr)
             print(f"Content type: {response.headers.get('content-type', 'unknown')}", file=sys.stderr)
-            print(f"HTML snippet: {response.text[:1000]}", file=sys.stderr)
-        
-        # Find all product listings
-        products = []
-        product_elements = soup.select('.productGrid li.product')
-        
-        if debug:
-            print(f"Found {len(product_elements)} products on VideoGamesNewYork.com", file=sys.stderr)
+            print(f"HTML snippet: {response.content[:1000]!r}", file=sys.stderr)
         
-        if not product_elements:
-            # Try alternative selectors
-            product_elements = soup.select('li.product')
-            if debug:
-                print(f"Trying alternative selector 'li.product', found {len(product_elements)} products", file=sys.stderr)
+        if deep:
+            products = _search_vgny_pages(response, base_url, params, platform, max_results, debug,
+                                          on_product, on_status)
+        else:
+            # Parse the raw bytes directly, skipping response.text charset sniffing
+            products = collect_products(iter_vgny_products(response.content, platform, max_results, debug,
+                                                           encoding=response_charset(response)), on_product)
         
-        for product_elem in product_elements[:max_results]:
-            try:
-                # Check if product is out of stock
-                is_out_of_stock = False
-                
-                # Check for out-of-stock flag
-                out_of_stock_elem = product_elem.select_one('.sale-flag-side--outstock, .out-of-stock, .sold-out')
-                if out_of_stock_elem:
-                    is_out_of_stock = True
-                
-                # Check for text indicators in the product element
-                product_text = product_elem.text.lower()
-                if "out of stock" in product_text or "sold out" in product_text or "unavailable" in product_text:
-                    is_out_of_stock = True
-                
-                # Check for disabled add-to-cart button
-                add_to_cart_btn = product_elem.select_one('button[disabled], .button--disabled')
-                if add_to_cart_btn:
-                    is_out_of_stock = True
-                
-                if is_out_of_stock:
-                    if debug:
-                        product_name_elem = product_elem.select_one('.card-title a')
-                        product_name = product_name_elem.text.strip() if product_name_elem else "Unknown product"
-                        print(f"Skipping out of stock product: {product_name}", file=sys.stderr)
-                    continue
-                
-                # Extract product details
-                article_elem = product_elem.select_one('article.card')
-                if not article_elem:
-                    if debug:
-                        print("Could not find article.card element", file=sys.stderr)
-                    article_elem = product_elem  # Fall back to the li element
-                
-                # Extract product name and URL
-                product_name_elem = article_elem.select_one('.card-title a')
-                if not product_name_elem:
-                    if debug:
-                        print("Could not find product name element", file=sys.stderr)
-                    continue
-                
-                product_name = product_name_elem.text.strip()
-                product_url = product_name_elem['href']
-                if not product_url.startswith('http'):
-                    product_url = f"https://videogamesnewyork.com{product_url}"
-                
-                # Skip if platform filter is provided and doesn't match
-                if platform and platform.lower() not in product_name.lower():
-                    continue
-                
-                # Extract price - use the main price element
-                price = "Price not available"
-                price_elem = article_elem.select_one('.price--withoutTax.price--main')
-                if price_elem:
-                    price = price_elem.text.strip()
-                else:
-                    # Try alternative price selectors if main one not found
-                    price_elem = article_elem.select_one('.price--withoutTax')
-                    if price_elem:
-                        price = price_elem.text.strip()
-                    else:
-                        price_elem = article_elem.select_one('.price')
-                        if price_elem:
-                            price = price_elem.text.strip()
-                
-                # Clean up price format
-                price = price.replace('$', '').strip()
-                try:
-                    price_float = float(price.replace(',', ''))
-                    price = f"${price_float:.2f}"
-                except ValueError:
-                    price = f"${price}"  # Keep original format if parsing fails
-                
-                # Extract image - get the first image in the container
-                img_elem = article_elem.select_one('.card-img-container img')
-                if not img_elem:
-                    img_elem = article_elem.select_one('img')
-                
-                img_url = img_elem['src'] if img_elem and 'src' in img_elem.attrs else ""
-                if img_url and not img_url.startswith('http'):
-                    img_url = f"https://videogamesnewyork.com{img_url}"
-                
-                # Extract product summary/description if available
-                description = "From VideoGamesNewYork.com"
-                summary_elem = article_elem.select_one('.card-text--summary')
-                if summary_elem:
-                    summary_text = summary_elem.text.strip()
-                    if summary_text:
-                        description = summary_text[:100] + "..." if len(summary_text) > 100 else summary_text
-                
-                # Extract brand if available
-                brand = "VGNY"
-                brand_elem = article_elem.select_one('.card-text--brand')
-                if brand_elem:
-                    brand_text = brand_elem.text.strip()
-                    if brand_text:
-                        brand = brand_text
-                
-                # Determine condition from title (approximate)
-                condition = "Used"
-                if "new" in product_name.lower():
-                    condition = "New"
-                elif "sealed" in product_name.lower():
-                    condition = "Sealed"
-                elif "complete" in product_name.lower() or "cib" in product_name.lower():
-                    condition = "Complete"
-                elif "loose" in product_name.lower():
-                    condition = "Loose"
-                
-                # Extract platform from title (approximate)
-                detected_platform = None
-                platform_keywords = {
-                    "ps1": ["playstation", "ps1", "psx", "psone"],
-                    "ps2": ["playstation 2", "ps2"],
-                    "ps3": ["playstation 3", "ps3"],
-                    "ps4": ["playstation 4", "ps4"],
-                    "ps5": ["playstation 5", "ps5"],
-                    "psp": ["psp", "playstation portable"],
-                    "ps vita": ["ps vita", "playstation vita", "vita"],
-                    "snes": ["super nintendo", "snes", "super nes"],
-                    "nes": ["nintendo entertainment system", "nes"],
-                    "n64": ["nintendo 64", "n64"],
-                    "gamecube": ["gamecube", "nintendo gamecube", "gcn"],
-                    "wii": ["nintendo wii", "wii"],
-                    "wii u": ["nintendo wii u", "wii u"],
-                    "switch": ["nintendo switch", "switch"],
-                    "game boy": ["game boy", "gameboy", "gba", "gbc"],
-                    "ds": ["nintendo ds", "nds", "ds"],
-                    "3ds": ["nintendo 3ds", "3ds"],
-                    "genesis": ["genesis", "sega genesis", "mega drive"],
-                    "dreamcast": ["dreamcast", "sega dreamcast"],
-                    "saturn": ["saturn", "sega saturn"],
-                    "game gear": ["game gear", "sega game gear"],
-                    "xbox": ["xbox"],
-                    "xbox 360": ["xbox 360"],
-                    "xbox one": ["xbox one"],
-                    "xbox series": ["xbox series"]
-                }
-                
-                for p, keywords in platform_keywords.items():
-                    if any(keyword in product_name.lower() for keyword in keywords):
-                        detected_platform = p
-                        break
-                
-                # Create product object
-                product = {
-                    "id": f"vgny-{hashlib.md5(product_url.encode()).hexdigest()}",
-                    "title": product_name,
-                    "description": description,
-                    "price": price,
-                    "source": "VGNY",
-                    "time": "Just now",  # We don't have actual listing time
-                    "image": img_url,
-                    "condition": condition,
-                    "url": product_url,
-                    "platform": detected_platform
-                }
-                
-                products.append(product)
-                
-            except Exception as e:
-                if debug:
-                    print(f"Error parsing product: {str(e)}", file=sys.stderr)
-                continue
+        price_history.record(products)
         
         # Cache the results
-        cache_response(query, platform, products)
+        if use_cache:
+            result_cache.put('vgny', query, platform, max_results, products,
+                             response=None if deep else response, deep=deep)
         
         return products
         
     except requests.RequestException as e:
         if debug:
             print(f"Request error: {str(e)}", file=sys.stderr)
+        if on_status:
+            on_status('error', error=str(e))
+        if use_cache:
+            result_cache.put_failure('vgny', query, platform, max_results, deep=deep)
+        if raise_errors:
+            raise
         return []
     except Exception as e:
         if debug:
             print(f"Unexpected error: {str(e)}", file=sys.stderr)
+        if on_status:
+            on_status('error', error=str(e))
+        if raise_errors:
+            raise
         return []
 
 def main():
@@ -331,6 +205,8 @@ def main():
     parser.add_argument('--query', type=str, required=True, help='Search term')
     parser.add_argument('--platform', type=str, help='Game platform (e.g., ps1, snes)')
     parser.add_argument('--max_results', type=int, default=16, help='Maximum number of results')
+    parser.add_argument('--deep', action='store_true', help='Read every results page, not just the first')
+    parser.add_argument('--stream', action='store_true', help='Write NDJSON records as products are found')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
     
     args = parser.parse_args()
@@ -338,9 +214,16 @@ def main():
     if args.debug:
         print(f"Searching for '{args.query}' on VideoGamesNewYork.com...", file=sys.stderr)
     
+    if args.stream:
+        with NDJSONWriter('vgny') as stream:
+            stream.status('searching', query=args.query, platform=args.platform)
+            search_vgny(args.query, args.platform, args.max_results, args.debug, deep=args.deep,
+                        on_product=stream.product, on_status=stream.status)
+        return
+    
     try:
         # Execute search
-        products = search_vgny(args.query, args.platform, args.max_results, args.debug)
+        products = search_vgny(args.query, args.platform, args.max_results, args.debug, deep=args.deep)
         
         if args.debug:
             print(f"Found {len(products)} products", file=sys.stderr)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Scraper source registry
+
+This module imports every store scraper once and exposes them behind a single
+coroutine, so long-lived processes (the worker, the aggregator) can dispatch a
+search by source name without caring whether the scraper is sync or async.
+Every scrape waits for a slot from scheduler.py, which runs interactive
+searches ahead of background work.
+"""
+
+import sys
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import result_cache
+import circuit_breaker
+import scheduler
+from circuit_breaker import CircuitOpenError
+
+# Scrapers that fail to import (e.g. playwright not installed) are recorded
+# here instead of taking the whole process down.
+IMPORT_ERRORS = {}
+
+try:
+    from scrape_vgny import search_vgny
+except ImportError as e:
+    search_vgny = None
+    IMPORT_ERRORS['vgny'] = str(e)
+
+try:
+    from scrape_jjgames import search_jjgames
+except ImportError as e:
+    search_jjgames = None
+    IMPORT_ERRORS['jjgames'] = str(e)
+
+try:
+    from scrape_lukie_games import search_lukie_games
+except ImportError as e:
+    search_lukie_games = None
+    IMPORT_ERRORS['lukie-games'] = str(e)
+
+try:
+    from scrape_dkoldies import search_dkoldies, close_browser_pool
+except ImportError as e:
+    search_dkoldies = None
+    close_browser_pool = None
+    IMPORT_ERRORS['dkoldies'] = str(e)
+
+async def search_dkoldies_pooled(query, platform=None, max_results=16, **kwargs):
+    """Search DKOldies on the shared warm browser pool."""
+    return await search_dkoldies(query, platform, max_results, pooled=True, **kwargs)
+
+# Source name -> search function. Names match the /api/scrape/<source> routes.
+SOURCES = {
+    'vgny': search_vgny,
+    'jjgames': search_jjgames,
+    'lukie-games': search_lukie_games,
+    'dkoldies': search_dkoldies_pooled if search_dkoldies else None,
+}
+
+# Host each source scrapes; its circuit breaker decides whether the source
+# is currently available
+SOURCE_HOSTS = {
+    'vgny': 'videogamesnewyork.com',
+    'jjgames': 'app.ecwid.com',
+    'lukie-games': 'www.lukiegames.com',
+    'dkoldies': 'www.dkoldies.com',
+}
+
+# Sources whose expired cache entries are returned straight away while a
+# background scrape refreshes them (stale-while-revalidate)
+SWR_SOURCES = {'vgny', 'dkoldies'}
+
+# Sources that can page through every result page (see pagination.py).
+# LukieGames returns all of its matches on one page.
+DEEP_SOURCES = {'vgny', 'jjgames', 'dkoldies'}
+
+# Blocking scrapers run on this pool so they don't stall the event loop
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='scraper')
+
+# (source, cache key) -> (max_results, task, scheduler ticket) for every
+# scrape in flight, so identical concurrent searches share one scrape
+_in_flight = {}
+
+COALESCING_STATS = {
+    'scrapes': 0,
+    'coalesced': 0,
+    'stale_served': 0,
+    'refreshes': 0,
+}
+
+class SourceUnavailableError(Exception):
+    """Raised when a source is unknown or its scraper could not be imported."""
+
+async def _call(search, query, platform, max_results, **kwargs):
+    """Call a search function, running blocking ones on the executor."""
+    if asyncio.iscoroutinefunction(search):
+        return await search(query, platform, max_results, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(search, query, platform, max_results, **kwargs)
+    )
+
+async def _scheduled_call(ticket, search, query, platform, max_results, **kwargs):
+    """Call a search function once the scheduler admits it."""
+    await ticket.wait()
+    try:
+        return await _call(search, query, platform, max_results, **kwargs)
+    finally:
+        ticket.release()
+
+def _shared_scrape(source, search, query, platform, max_results, refresh=False, deep=False,
+                   priority='interactive', tenant=None):
+    """
+    Return the in-flight scrape for a search, starting one if there is none.
+
+    A scrape already running for at least max_results results is joined
+    rather than duplicated; if it is still queued at a lower priority, it
+    is promoted to the joining search's.
+    """
+    key = (source, result_cache.cache_key(source, query, platform, deep))
+    in_flight = _in_flight.get(key)
+    if in_flight is not None and in_flight[0] >= max_results:
+        COALESCING_STATS['coalesced'] += 1
+        scheduler.promote(in_flight[2], priority)
+        return in_flight[1]
+
+    COALESCING_STATS['scrapes'] += 1
+    kwargs = {'deep': True} if deep else {}
+    ticket = scheduler.request(source, priority, tenant)
+    task = asyncio.ensure_future(
+        # Failures raise, so callers report an error rather than an empty result
+        _scheduled_call(ticket, search, query, platform, max_results, refresh=refresh, raise_errors=True,
+                        **kwargs)
+    )
+    _in_flight[key] = (max_results, task, ticket)
+
+    def _finished(task):
+        if _in_flight.get(key, (None, None, None))[1] is task:
+            del _in_flight[key]
+        # A task cancelled before it started never reached its own release
+        ticket.release()
+        # Mark the error as retrieved in case every caller gave up waiting
+        if not task.cancelled():
+            task.exception()
+
+    task.add_done_callback(_finished)
+    return task
+
+async def run_source(source, query, platform=None, max_results=16, deep=False, refresh=False,
+                     priority='interactive', tenant=None):
+    """
+    Run a single source's search function on the current event loop.
+
+    Identical concurrent searches share one scrape. For SWR_SOURCES an
+    expired cache entry is returned immediately and refreshed in the
+    background. While a source's circuit breaker is open, only cached
+    results (fresh or stale) are returned.
+
+    Args:
+        source (str): Source name (a key of SOURCES)
+        query (str): Search term
+        platform (str, optional): Game platform (e.g., 'ps1', 'snes')
+        max_results (int, optional): Maximum number of results to return
+        deep (bool, optional): Read every result page; ignored by sources
+            not in DEEP_SOURCES
+        refresh (bool, optional): Skip cached results and scrape now (the new
+            results are still cached)
+        priority (str, optional): Scheduler class of the scrape (see
+            scheduler.PRIORITIES)
+        tenant (str, optional): Who the scrape is for, so tenants share
+            their class fairly
+
+    Returns:
+        list: List of product dictionaries
+
+    Raises:
+        SourceUnavailableError: If the source is unknown or failed to import
+        CircuitOpenError: If the source's breaker is open and nothing is cached
+        Exception: Whatever the scraper's search failed with (e.g. a
+            requests.RequestException)
+    """
+    if source not in SOURCES:
+        raise SourceUnavailableError(f"Unknown source: {source}")
+
+    search = SOURCES[source]
+    if search is None:
+        raise SourceUnavailableError(f"Source {source} unavailable: {IMPORT_ERRORS.get(source)}")
+
+    deep = deep and source in DEEP_SOURCES
+    breaker_open = circuit_breaker.is_open(SOURCE_HOSTS.get(source))
+
+    if refresh and breaker_open:
+        raise CircuitOpenError(f"Source {source} unavailable: circuit open")
+    if not refresh and (source in SWR_SOURCES or breaker_open):
+        products, fresh = await asyncio.to_thread(result_cache.lookup, source, query, platform, max_results,
+                                                  allow_stale=True, deep=deep)
+        if products is not None:
+            if not fresh:
+                COALESCING_STATS['stale_served'] += 1
+                if not breaker_open and (source, result_cache.cache_key(source, query, platform, deep)) not in _in_flight:
+                    COALESCING_STATS['refreshes'] += 1
+                    _shared_scrape(source, search, query, platform, max_results, refresh=True, deep=deep,
+                                   priority='refresh', tenant=tenant)
+            return products
+        if breaker_open:
+            raise CircuitOpenError(f"Source {source} unavailable: circuit open")
+        # Already checked the cache, so the scraper doesn't need to
+        refresh = True
+
+    # Shielded so a caller hitting its deadline doesn't cancel the scrape
+    # for everyone else sharing it; it still finishes and fills the cache
+    products = await asyncio.shield(_shared_scrape(source, search, query, platform, max_results, refresh, deep,
+                                                   priority, tenant))
+    return products[:max_results]
+
+def coalescing_stats():
+    """Return request coalescing and stale-while-revalidate counters."""
+    return {**COALESCING_STATS, 'in_flight': len(_in_flight)}
+
+async def shutdown():
+    """Release long-lived scraper resources such as the DKOldies browser pool."""
+    if close_browser_pool is not None:
+        await close_browser_pool()
+
+def available_sources():
+    """Return the names of sources whose scrapers imported successfully."""
+    return [name for name, search in SOURCES.items() if search is not None]
+
+if __name__ == "__main__":
+    for name in SOURCES:
+        status = "ok" if name not in IMPORT_ERRORS else f"unavailable ({IMPORT_ERRORS[name]})"
+        print(f"{name}: {status}", file=sys.stderr)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+NDJSON Streaming Output
+
+With --stream, the scrapers and the multi-source search write one JSON record
+per line as results are built, instead of a single JSON array once the whole
+search is done. Every line is flushed straight away, so a consumer can render
+the first product as soon as it has been parsed.
+
+Record types (every record has "type" and "source"):
+    {"type": "status", "source": "vgny", "status": "fetching", ...}
+        Progress: "searching", "cached", "fetching", "page", "not_modified",
+        "error" (plus per-source results from the multi-source search)
+    {"type": "product", "source": "vgny", "product": {...}}
+        One product, as returned by the search functions
+    {"type": "summary", "source": "vgny", "status": "ok", "count": 12,
+     "first_product_ms": 85.2, "elapsed_ms": 640.1}
+        Always the last record; status is "error" if the search failed
+"""
+
+import sys
+import json
+import time
+import threading
+
+class NDJSONWriter:
+    """Write newline-delimited JSON records for one search."""
+
+    def __init__(self, source=None, out=None):
+        self.source = source
+        self.out = out or sys.stdout
+        self.count = 0
+        self.error = None
+        self._start = time.perf_counter()
+        self._first_product_ms = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _elapsed_ms(self):
+        return round((time.perf_counter() - self._start) * 1000, 1)
+
+    def write(self, record):
+        """Write one record as a single flushed line."""
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self.out.write(line)
+            self.out.flush()
+
+    def status(self, status, **fields):
+        """Write a progress record."""
+        if status == 'error':
+            self.error = fields.get('error')
+        self.write({'type': 'status', 'source': fields.pop('source', self.source), 'status': status, **fields})
+
+    def product(self, product, source=None):
+        """Write one product record."""
+        if self._first_product_ms is None:
+            self._first_product_ms = self._elapsed_ms()
+        self.count += 1
+        self.write({'type': 'product', 'source': source or self.source, 'product': product})
+
+    def summary(self, **fields):
+        """Write the closing record (once; later calls are ignored)."""
+        if self._closed:
+            return
+        self._closed = True
+        record = {
+            'type': 'summary',
+            'source': self.source,
+            'status': 'error' if self.error else 'ok',
+            'count': self.count,
+            'first_product_ms': self._first_product_ms,
+            'elapsed_ms': self._elapsed_ms(),
+        }
+        if self.error:
+            record['error'] = self.error
+        record.update(fields)
+        self.write(record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A search that raises still ends the stream with a summary
+        if exc is not None and not isinstance(exc, KeyboardInterrupt):
+            self.error = str(exc)
+        self.summary()
+        return exc_type is not None and not issubclass(exc_type, KeyboardInterrupt)
+
+def emit_products(products, on_product=None):
+    """Report already-built products (e.g. from the cache) and return them."""
+    if on_product:
+        for product in products:
+            on_product(product)
+    return products
+
+def collect_products(product_iter, on_product=None):
+    """
+    Drain a product generator into a list, reporting each product as soon
+    as it is built.
+
+    Args:
+        product_iter (iterable): Products, e.g. from an iter_*_products generator
+        on_product (callable, optional): Called with each product
+
+    Returns:
+        list: The products
+    """
+    products = []
+    for product in product_iter:
+        products.append(product)
+        if on_product:
+            on_product(product)
+    return products
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Watchlist Runner
+
+Re-runs users' saved searches in one batch and reports new deals for each.
+
+Running every watch as its own search would cost one scrape per watch per
+source. Many users watch the same game, though, and the scrapers apply the
+platform filter locally (a title substring match) after fetching the store's
+results. So the runner:
+1. Normalizes each watch's query (case and whitespace) and collapses the
+   watches into distinct queries. Each distinct query is scraped once per
+   source, without a platform filter, in this process. All the searches
+   share one HTTP session, the rate limits and circuit breakers, and the
+   DKOldies browser pool.
+2. Diffs each source's results against the runner's previous snapshot of
+   the same query (product_ids.diff_snapshot) and deal-scores them.
+3. Fans the results out to every watch on that query. The watch's platform
+   filter is applied the same way the scrapers apply it, along with its
+   price limit and minimum deal score.
+
+A watch alerts on listings that are new since the previous run or whose
+price dropped. The first run of a query only records a snapshot.
+
+Watches are read as a JSON list or one JSON object per line:
+    {"user": "u1", "query": "zelda", "platform": "n64", "max_price": 40,
+     "min_deal_score": 1}
+Only "query" is required. "max_price" is in dollars.
+
+Settings:
+    LOOTSCOUT_WATCH_MAX_RESULTS   Results kept per source and query (default: 100)
+    LOOTSCOUT_WATCH_CONCURRENCY   Source searches run at once (default: 8)
+
+Run with --watches FILE (or watches on stdin) for one batch, or with --every
+SECONDS to keep going.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import defaultdict
+
+from circuit_breaker import CircuitOpenError
+from deal_scoring import score_products
+from prices import cents_from_amount
+from product_ids import diff_snapshot
+from sources import SOURCES, SourceUnavailableError, run_source, shutdown
+
+WATCH_MAX_RESULTS = int(os.environ.get('LOOTSCOUT_WATCH_MAX_RESULTS', '100'))
+WATCH_CONCURRENCY = int(os.environ.get('LOOTSCOUT_WATCH_CONCURRENCY', '8'))
+
+# Snapshot namespace, so the runner's alerts are independent of
+# lootscout_search.py --delta
+SNAPSHOT_SCOPE = 'watchlist'
+
+def normalize_query(query):
+    """Return the form of a query the stores treat the same way."""
+    return ' '.join(query.lower().split())
+
+def matches_platform(product, platform):
+    """Apply a platform filter the way the scrapers do."""
+    return not platform or platform.lower() in product.get('title', '').lower()
+
+def load_watches(stream):
+    """
+    Read watches from a JSON list or one JSON object per line.
+
+    Args:
+        stream (file): Text stream to read
+
+    Returns:
+        list: Watch dictionaries, each with a non-empty "query"
+    """
+    text = stream.read().strip()
+    if text.startswith('['):
+        watches = json.loads(text)
+    else:
+        watches = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    valid = []
+    for watch in watches:
+        if not isinstance(watch, dict) or not str(watch.get('query') or '').strip():
+            print(f"Skipping watch without a query: {json.dumps(watch)}", file=sys.stderr)
+            continue
+        valid.append(watch)
+    return valid
+
+def plan(watches, sources):
+    """
+    Collapse watches into the distinct searches that cover them.
+
+    Args:
+        watches (list): Watch dictionaries
+        sources (list): Source names to search
+
+    Returns:
+        tuple: ({normalized query: {platform: [watch indexes]}}, report),
+        where the report counts the searches saved by collapsing
+    """
+    queries = defaultdict(lambda: defaultdict(list))
+    for i, watch in enumerate(watches):
+        platform = (watch.get('platform') or '').strip().lower() or None
+        queries[normalize_query(watch['query'])][platform].append(i)
+
+    distinct_searches = len({
+        (normalize_query(watch['query']), (watch.get('platform') or '').strip().lower())
+        for watch in watches
+    })
+    searches = len(queries) * len(sources)
+    naive = len(watches) * len(sources)
+    report = {
+        'watches': len(watches),
+        'distinct_queries': len(queries),
+        'searches': searches,
+        # One search per watch, and one per distinct (query, platform) pair
+        'searches_without_dedupe': naive,
+        'searches_per_query_and_platform': distinct_searches * len(sources),
+        'searches_saved': naive - searches,
+        'saved_fraction': round(1 - searches / naive, 3) if naive else 0.0,
+    }
+    return queries, report
+
+def _is_alert(product, delta_kind, watch):
+    """Whether a new or repriced product is worth alerting this watch about."""
+    if delta_kind == 'repriced':
+        previous = product.get('previous_price_cents')
+        if previous is None or product.get('price_cents') is None or product['price_cents'] >= previous:
+            return False
+    max_cents = cents_from_amount(watch.get('max_price'))
+    if max_cents is not None and (product.get('price_cents') is None or product['price_cents'] > max_cents):
+        return False
+    min_score = watch.get('min_deal_score')
+    if min_score is not None and (product.get('deal_score') is None or product['deal_score'] < min_score):
+        return False
+    return True
+
+async def _search(source, query, max_results, semaphore):
+    """Run one source search and diff it against the runner's last snapshot."""
+    async with semaphore:
+        try:
+            products = await run_source(source, query, None, max_results, priority='refresh', tenant='watchlist')
+        except (CircuitOpenError, SourceUnavailableError) as e:
+            return {'status': 'unavailable', 'error': str(e)}
+        except Exception as e:
+            return {'status': 'error', 'error': str(e)}
+
+    if not products:
+        # A failed search is cached as empty for a while (result_cache.put_failure),
+        # so nothing counts as removed
+        return {'status': 'empty', 'products': []}
+    delta = await asyncio.to_thread(diff_snapshot, source, query, None, products, False, SNAPSHOT_SCOPE)
+    return {'status': 'ok', 'products': products, 'delta': delta}
+
+async def run_batch(watches, sources=None, max_results=None):
+    """
+    Run every watch, searching each distinct query once per source.
+
+    Args:
+        watches (list): Watch dictionaries
+        sources (list, optional): Source names to search (defaults to all)
+        max_results (int, optional): Results per source and query
+            (default: WATCH_MAX_RESULTS)
+
+    Returns:
+        dict: {"alerts": [{"user", "watch", "matches", "products"}] for
+        watches with something new, "report": {...}}
+    """
+    start = time.perf_counter()
+    sources = list(sources or SOURCES.keys())
+    max_results = WATCH_MAX_RESULTS if max_results is None else max_results
+    queries, report = plan(watches, sources)
+
+    semaphore = asyncio.Semaphore(WATCH_CONCURRENCY)
+    searches = [(query, source) for query in queries for source in sources]
+    results = await asyncio.gather(*[_search(source, query, max_results, semaphore) for query, source in searches])
+
+    by_query = defaultdict(list)
+    report['failed_searches'] = 0
+    report['first_snapshots'] = 0
+    for (query, source), result in zip(searches, results):
+        if result['status'] not in ('ok', 'empty'):
+            report['failed_searches'] += 1
+            print(f"Watch search of {source} for '{query}' failed: {result.get('error', result['status'])}",
+                  file=sys.stderr)
+            continue
+        delta = result.get('delta')
+        if delta is None:
+            continue
+        if delta['first_snapshot']:
+            report['first_snapshots'] += 1
+            continue
+        by_query[query].extend(('added', product) for product in delta['added'])
+        by_query[query].extend(('repriced', product) for product in delta['repriced'])
+
+    # Each watch's count of current matches, filtered once per platform
+    matches = defaultdict(int)
+    for (query, source), result in zip(searches, results):
+        for platform, members in queries[query].items():
+            count = sum(1 for product in result.get('products', []) if matches_platform(product, platform))
+            for i in members:
+                matches[i] += count
+
+    # Score each query's candidates once, then share them between its watches
+    alerts = []
+    for query, candidates in by_query.items():
+        scored = await asyncio.to_thread(score_products, [product for _, product in candidates])
+        candidates = [(kind, product) for (kind, _), product in zip(candidates, scored)]
+        for platform, members in queries[query].items():
+            on_platform = [(kind, product) for kind, product in candidates if matches_platform(product, platform)]
+            if not on_platform:
+                continue
+            for i in members:
+                products = [product for kind, product in on_platform if _is_alert(product, kind, watches[i])]
+                if products:
+                    alerts.append({'user': watches[i].get('user'), 'watch': watches[i],
+                                   'matches': matches[i], 'products': products})
+
+    report['alerts'] = len(alerts)
+    report['alerted_products'] = sum(len(alert['products']) for alert in alerts)
+    report['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return {'alerts': alerts, 'report': report}
+
+async def run(load, sources=None, max_results=None, every=None):
+    """Run a batch every `every` seconds, or just one, reloading the watches each time."""
+    try:
+        while True:
+            batch_start = time.monotonic()
+            result = await run_batch(load(), sources, max_results)
+            print(json.dumps(result), flush=True)
+            if not every:
+                return
+            await asyncio.sleep(max(0.0, every - (time.monotonic() - batch_start)))
+    finally:
+        await shutdown()
+
+def main():
+    """Run saved searches in one batch."""
+    parser = argparse.ArgumentParser(description="Re-run saved searches in one batch and report new deals.")
+    parser.add_argument('--watches', type=str, default='-',
+                        help='JSON or NDJSON file of watches, or "-" for stdin')
+    parser.add_argument('--sources', type=str, default='all', help='Comma-separated sources, or "all"')
+    parser.add_argument('--max_results', type=int, help='Results kept per source and query')
+    parser.add_argument('--every', type=float, help='Run a batch every this many seconds instead of once')
+
+    args = parser.parse_args()
+    sources = None if args.sources == 'all' else [s.strip() for s in args.sources.split(',') if s.strip()]
+    if args.every and args.watches == '-':
+        parser.error('--every needs a --watches file to re-read')
+
+    def load():
+        if args.watches == '-':
+            return load_watches(sys.stdin)
+        with open(args.watches, encoding='utf-8') as stream:
+            return load_watches(stream)
+
+    try:
+        asyncio.run(run(load, sources, args.max_results, args.every))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
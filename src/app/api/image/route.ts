@@ -0,0 +1,40 @@
+import { promises as fs } from 'fs';
+import { NextRequest, NextResponse } from 'next/server';
+import { getScraperWorker, ThumbnailFormat, ThumbnailSize } from '@/lib/scraper-worker';
+
+const SIZES: ThumbnailSize[] = ['small', 'medium'];
+
+// Browsers keep thumbnails for a day; the worker revalidates the source image weekly
+const CACHE_CONTROL = 'public, max-age=86400, stale-while-revalidate=604800';
+
+/**
+ * Serves a product image thumbnail from the worker's disk cache, making it on
+ * first use. Failures return 404 so the page can fall back to the original image.
+ */
+export async function GET(request: NextRequest) {
+  const searchParams = request.nextUrl.searchParams;
+  const url = searchParams.get('url') || '';
+  const size = (searchParams.get('size') || 'small') as ThumbnailSize;
+
+  if (!/^https?:\/\//.test(url) || !SIZES.includes(size)) {
+    return NextResponse.json({ error: 'Invalid image request' }, { status: 400 });
+  }
+
+  // WebP where the browser takes it, JPEG otherwise
+  const format: ThumbnailFormat = (request.headers.get('accept') || '').includes('image/webp') ? 'webp' : 'jpeg';
+
+  try {
+    const thumbnail = await getScraperWorker().thumbnail(url, size, format);
+    const body = await fs.readFile(thumbnail.path);
+    return new NextResponse(body, {
+      headers: {
+        'Content-Type': thumbnail.content_type,
+        'Cache-Control': CACHE_CONTROL,
+        'Vary': 'Accept',
+      },
+    });
+  } catch (error) {
+    console.error('Thumbnail error:', error);
+    return NextResponse.json({ error: 'Thumbnail unavailable' }, { status: 404 });
+  }
+}
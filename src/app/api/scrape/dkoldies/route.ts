@@ -1,9 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { exec } from 'child_process';
-import { promisify } from 'util';
-import path from 'path';
-
-const execPromise = promisify(exec);
+import { runScraper } from '@/lib/scraper-worker';
 
 export async function GET(request: NextRequest) {
   try {
@@ -19,29 +15,8 @@ export async function GET(request: NextRequest) {
       );
     }
     
-    // Activate virtual environment and run the Python script
-    const scriptPath = path.join(process.cwd(), 'scripts', 'scrape_dkoldies.py');
-    const venvPath = path.join(process.cwd(), 'venv', 'bin', 'activate');
-    
-    let command = `source ${venvPath} && python3 "${scriptPath}" --query "${query}"`;
-    
-    // Add platform filter if provided
-    if (platform) {
-      command += ` --platform "${platform}"`;
-    }
-    
-    // Add max results limit
-    command += ' --max_results 16';
-    
-    // Execute the Python script
-    const { stdout, stderr } = await execPromise(command, { shell: '/bin/zsh' });
-    
-    if (stderr) {
-      console.error('DKOldies scraper stderr:', stderr);
-    }
-    
-    // Parse the JSON output from the script
-    const products = JSON.parse(stdout);
+    // Run the search on the shared scraper worker
+    const products = await runScraper('dkoldies', query, platform || undefined, 60000);
     
     // Return the products as JSON
     return NextResponse.json(products);
@@ -1,7 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { PythonShell, Options } from 'python-shell';
-import path from 'path';
 import { Product } from '@/lib/mock-data';
+import { runScraper } from '@/lib/scraper-worker';
 
 // Cache for storing search results to reduce scraping frequency
 const CACHE_DURATION = 1000 * 60 * 15; // 15 minutes
@@ -24,51 +23,10 @@ export async function GET(request: NextRequest) {
       return NextResponse.json(cache[cacheKey].data);
     }
     
-    // Set up Python script options
-    const scriptPath = path.join(process.cwd(), 'scripts', 'scrape_jjgames.py');
-    const options: Options = {
-      mode: 'text' as const,
-      pythonOptions: ['-u'], // unbuffered output
-      args: [
-        '--query', query,
-        ...(platform ? ['--platform', platform] : []),
-        '--max_results', '16',
-        '--debug'
-      ]
-    };
-    
     console.log('Scraping JJGames.com for:', query, platform ? `(platform: ${platform})` : '');
     
-    // Run the Python script with a timeout
-    const results = await Promise.race([
-      new Promise<Product[]>((resolve, reject) => {
-        PythonShell.run(scriptPath, options)
-          .then((results: string[]) => {
-            if (!results || results.length === 0) {
-              console.log('No results returned from Python script');
-              return resolve([]);
-            }
-            
-            try {
-              // Parse the JSON output from the Python script
-              const products = JSON.parse(results[0]) as Product[];
-              console.log(`Successfully parsed ${products.length} products from JJGames`);
-              resolve(products);
-            } catch (e) {
-              console.error('Error parsing Python script output:', e);
-              reject(e);
-            }
-          })
-          .catch((err: Error) => {
-            console.error('Error running Python script:', err);
-            reject(err);
-          });
-      }),
-      // Add a timeout of 30 seconds (reduced from 120 seconds)
-      new Promise<never>((_, reject) => 
-        setTimeout(() => reject(new Error('Scraping timeout')), 30000)
-      )
-    ]);
+    // Run the search on the shared scraper worker
+    const results = await runScraper('jjgames', query, platform || undefined, 30000);
     
     // Update cache
     cache[cacheKey] = {
@@ -1,7 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { PythonShell, Options } from 'python-shell';
-import path from 'path';
 import { Product } from '@/lib/mock-data';
+import { runScraper } from '@/lib/scraper-worker';
 
 // Cache for storing search results to reduce scraping frequency
 const CACHE_DURATION = 1000 * 60 * 15; // 15 minutes
@@ -24,42 +23,10 @@ export async function GET(request: NextRequest) {
       return NextResponse.json(cache[cacheKey].data);
     }
     
-    // Set up Python script options
-    const scriptPath = path.join(process.cwd(), 'scripts', 'scrape_lukie_games.py');
-    const options: Options = {
-      mode: 'text' as const,
-      pythonOptions: ['-u'], // unbuffered output
-      args: [
-        '--query', query,
-        ...(platform ? ['--platform', platform] : []),
-        '--max_results', '16'
-      ]
-    };
-    
     console.log('Scraping LukieGames.com for:', query, platform ? `(platform: ${platform})` : '');
     
-    // Run the Python script
-    const results = await new Promise<Product[]>((resolve, reject) => {
-      PythonShell.run(scriptPath, options)
-        .then((results: string[]) => {
-          if (!results || results.length === 0) {
-            return resolve([]);
-          }
-          
-          try {
-            // Parse the JSON output from the Python script
-            const products = JSON.parse(results[0]) as Product[];
-            resolve(products);
-          } catch (e) {
-            console.error('Error parsing Python script output:', e);
-            reject(e);
-          }
-        })
-        .catch((err: Error) => {
-          console.error('Error running Python script:', err);
-          reject(err);
-        });
-    });
+    // Run the search on the shared scraper worker
+    const results = await runScraper('lukie-games', query, platform || undefined);
     
     // Update cache
     cache[cacheKey] = {
@@ -34,7 +34,10 @@ import {
   fetchJJGamesProducts, 
   fetchDKOldiesProducts, 
   fetchEbayProducts,
-  combineProductResults 
+  combineProductResults,
+  productPrice,
+  compareByPrice,
+  thumbnailUrl
 } from "@/lib/scraper";
 import { useAuth } from "@/context/AuthContext";
 import { useFavorites } from "@/context/FavoritesContext";
@@ -72,12 +75,15 @@ export default function SearchPage() {
           // Get the active platform filter if any
           const activePlatform = activePlatformFilters.length > 0 ? activePlatformFilters[0] : undefined;
           
-          // Fetch products from scrapers and APIs
-          const lukieProducts = await fetchLukieGamesProducts(query, activePlatform);
-          const vgnyProducts = await fetchVGNYProducts(query, activePlatform);
-          const jjgamesProducts = await fetchJJGamesProducts(query, activePlatform);
-          const dkoldiesProducts = await fetchDKOldiesProducts(query, activePlatform);
-          const ebayProducts = await fetchEbayProducts(query, activePlatform);
+          // Fetch products from scrapers and APIs concurrently; each fetcher
+          // returns [] on failure, so one slow or broken source can't sink the rest
+          const [lukieProducts, vgnyProducts, jjgamesProducts, dkoldiesProducts, ebayProducts] = await Promise.all([
+            fetchLukieGamesProducts(query, activePlatform),
+            fetchVGNYProducts(query, activePlatform),
+            fetchJJGamesProducts(query, activePlatform),
+            fetchDKOldiesProducts(query, activePlatform),
+            fetchEbayProducts(query, activePlatform),
+          ]);
           
           // Log product counts for debugging
           console.log('Product counts:', {
@@ -98,7 +104,7 @@ export default function SearchPage() {
             // Filter products under $50
             const allProducts = combineProductResults(lukieProducts, vgnyProducts, jjgamesProducts, dkoldiesProducts, ebayProducts);
             results = allProducts.filter(product => 
-              parseFloat(product.price.replace('$', '')) < 50
+              productPrice(product) < 50
             );
           } else if (query.toLowerCase() === "sealed") {
             // Filter products that mention "sealed" in title or description
@@ -112,7 +118,7 @@ export default function SearchPage() {
             // Filter products that are considered rare (in this case, over $100)
             const allProducts = combineProductResults(lukieProducts, vgnyProducts, jjgamesProducts, dkoldiesProducts, ebayProducts);
             results = allProducts.filter(product => 
-              parseFloat(product.price.replace('$', '')) > 100
+              productPrice(product) > 100
             );
           } else {
             // Regular search query - combine all results
@@ -161,7 +167,7 @@ export default function SearchPage() {
     // Apply price filters
     if (activePriceFilters.length > 0) {
       results = results.filter((product) => {
-        const price = parseFloat(product.price.replace('$', ''));
+        const price = productPrice(product);
         return activePriceFilters.some(filter => {
           if (filter === "under-25") return price < 25;
           if (filter === "under-50") return price < 50;
@@ -183,13 +189,9 @@ export default function SearchPage() {
     
     // Apply sorting
     if (sortOrder === "price-asc") {
-      results.sort((a, b) => 
-        parseFloat(a.price.replace('$', '')) - parseFloat(b.price.replace('$', ''))
-      );
+      results.sort((a, b) => compareByPrice(a, b));
     } else if (sortOrder === "price-desc") {
-      results.sort((a, b) => 
-        parseFloat(b.price.replace('$', '')) - parseFloat(a.price.replace('$', ''))
-      );
+      results.sort((a, b) => compareByPrice(a, b, true));
     } else if (sortOrder === "newest") {
       // This is a simplified version since we don't have real timestamps
       // In a real app, you'd sort by actual date
@@ -211,13 +213,9 @@ export default function SearchPage() {
       const sortedProducts = [...prevProducts];
       
       if (sortOrder === "price-asc") {
-        sortedProducts.sort((a, b) => 
-          parseFloat(a.price.replace('$', '')) - parseFloat(b.price.replace('$', ''))
-        );
+        sortedProducts.sort((a, b) => compareByPrice(a, b));
       } else if (sortOrder === "price-desc") {
-        sortedProducts.sort((a, b) => 
-          parseFloat(b.price.replace('$', '')) - parseFloat(a.price.replace('$', ''))
-        );
+        sortedProducts.sort((a, b) => compareByPrice(a, b, true));
       } else if (sortOrder === "newest") {
         sortedProducts.sort((a, b) => {
           if (a.time.includes("hour") && !b.time.includes("hour")) return -1;
@@ -458,8 +456,17 @@ export default function SearchPage() {
                   <div className="w-1/3 sm:w-full flex-shrink-0">
                     <div className="bg-white rounded-[20px] p-2 sm:p-8 h-full flex items-center justify-center">
                       <img
-                        src={product.image}
+                        src={thumbnailUrl(product.image)}
                         alt={product.title}
+                        loading="lazy"
+                        onError={(e) => {
+                          // Fall back to the store's own image if no thumbnail can be made
+                          const img = e.currentTarget;
+                          if (!img.dataset.fallback) {
+                            img.dataset.fallback = '1';
+                            img.src = product.image;
+                          }
+                        }}
                         className="w-full h-20 sm:h-48 object-contain"
                       />
                     </div>
@@ -4,6 +4,8 @@ export type Product = {
   title: string;
   description: string;
   price: string;
+  price_cents?: number | null;
+  currency?: string;
   source: "eBay" | "Mercari" | "Poshmark" | "Etsy" | "LukieGames" | "VGNY" | "JJGames" | "DKOldies";
   time: string;
   image: string;
@@ -94,10 +96,10 @@ export const genreFilters = [
 ];
 
 export const priceFilters = [
-  { name: "Under $25", query: "under-25", filter: (price: string) => parseFloat(price.replace('$', '')) < 25 },
-  { name: "Under $50", query: "under-50", filter: (price: string) => parseFloat(price.replace('$', '')) < 50 },
-  { name: "Under $100", query: "under-100", filter: (price: string) => parseFloat(price.replace('$', '')) < 100 },
-  { name: "$100+", query: "over-100", filter: (price: string) => parseFloat(price.replace('$', '')) >= 100 },
+  { name: "Under $25", query: "under-25", filter: (price: string) => parseFloat(price.replace(/[^0-9.]/g, '')) < 25 },
+  { name: "Under $50", query: "under-50", filter: (price: string) => parseFloat(price.replace(/[^0-9.]/g, '')) < 50 },
+  { name: "Under $100", query: "under-100", filter: (price: string) => parseFloat(price.replace(/[^0-9.]/g, '')) < 100 },
+  { name: "$100+", query: "over-100", filter: (price: string) => parseFloat(price.replace(/[^0-9.]/g, '')) >= 100 },
 ];
 
 export const sourceFilters = [
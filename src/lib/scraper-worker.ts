@@ -0,0 +1,211 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import fs from 'fs';
+import path from 'path';
+import readline from 'readline';
+import { Product } from './mock-data';
+
+export type ScraperSource = 'vgny' | 'jjgames' | 'lukie-games' | 'dkoldies';
+
+type WorkerResponse = {
+  id?: string | null;
+  event?: string;
+  ok?: boolean;
+  products?: Product[];
+  result?: unknown;
+  error?: string;
+};
+
+type PendingRequest = {
+  resolve: (message: WorkerResponse) => void;
+  reject: (reason: Error) => void;
+  timer: NodeJS.Timeout;
+};
+
+export type ThumbnailSize = 'small' | 'medium';
+export type ThumbnailFormat = 'webp' | 'jpeg';
+
+export type Thumbnail = {
+  path: string;
+  content_type: string;
+};
+
+// Don't respawn faster than this after a crash
+const MIN_RESTART_DELAY = 500;
+const MAX_RESTART_DELAY = 10000;
+
+/**
+ * Manages a single long-lived scripts/lootscout_worker.py process.
+ *
+ * Requests are written to the worker's stdin as JSON lines and matched to
+ * responses by id, so many searches can be in flight at once. If the worker
+ * exits, pending requests are rejected and the next request starts a fresh one.
+ */
+class ScraperWorker {
+  private child: ChildProcessWithoutNullStreams | null = null;
+  private pending = new Map<string, PendingRequest>();
+  private nextId = 0;
+  private restartDelay = MIN_RESTART_DELAY;
+  private lastExit = 0;
+
+  private pythonPath(): string {
+    if (process.env.LOOTSCOUT_PYTHON) {
+      return process.env.LOOTSCOUT_PYTHON;
+    }
+    const venvPython = path.join(process.cwd(), 'venv', 'bin', 'python3');
+    return fs.existsSync(venvPython) ? venvPython : 'python3';
+  }
+
+  private async ensureStarted(): Promise<ChildProcessWithoutNullStreams> {
+    if (this.child) {
+      return this.child;
+    }
+
+    // Back off if the last worker died recently, so a broken environment
+    // doesn't turn into a tight spawn loop
+    const sinceExit = Date.now() - this.lastExit;
+    if (this.lastExit && sinceExit < this.restartDelay) {
+      await new Promise(resolve => setTimeout(resolve, this.restartDelay - sinceExit));
+    }
+    if (this.child) {
+      return this.child;
+    }
+
+    const scriptPath = path.join(process.cwd(), 'scripts', 'lootscout_worker.py');
+    const child = spawn(this.pythonPath(), ['-u', scriptPath]);
+
+    readline.createInterface({ input: child.stdout }).on('line', line => this.handleLine(line));
+    readline.createInterface({ input: child.stderr }).on('line', line => {
+      console.error('Scraper worker:', line);
+    });
+
+    child.on('exit', (code, signal) => this.handleExit(child, code, signal));
+    child.on('error', err => {
+      console.error('Scraper worker failed to start:', err);
+      this.handleExit(child, null, null);
+    });
+
+    this.child = child;
+    return child;
+  }
+
+  private handleLine(line: string) {
+    let message: WorkerResponse;
+    try {
+      message = JSON.parse(line) as WorkerResponse;
+    } catch (e) {
+      console.error('Error parsing scraper worker output:', e);
+      return;
+    }
+
+    if (message.event === 'ready') {
+      // A healthy start resets the crash backoff
+      this.restartDelay = MIN_RESTART_DELAY;
+      return;
+    }
+
+    if (message.id == null) {
+      console.error('Scraper worker error:', message.error);
+      return;
+    }
+
+    const request = this.pending.get(message.id);
+    if (!request) {
+      return;
+    }
+    this.pending.delete(message.id);
+    clearTimeout(request.timer);
+
+    if (message.ok) {
+      request.resolve(message);
+    } else {
+      request.reject(new Error(message.error || 'Scraper worker request failed'));
+    }
+  }
+
+  private handleExit(child: ChildProcessWithoutNullStreams, code: number | null, signal: string | null) {
+    if (this.child !== child) {
+      return;
+    }
+    console.error(`Scraper worker exited (code: ${code}, signal: ${signal})`);
+
+    this.child = null;
+    this.lastExit = Date.now();
+    this.restartDelay = Math.min(this.restartDelay * 2, MAX_RESTART_DELAY);
+
+    for (const [id, request] of this.pending) {
+      clearTimeout(request.timer);
+      request.reject(new Error('Scraper worker exited'));
+      this.pending.delete(id);
+    }
+  }
+
+  private async send(message: Record<string, unknown>, timeout: number): Promise<WorkerResponse> {
+    const child = await this.ensureStarted();
+    const id = String(++this.nextId);
+
+    return new Promise<WorkerResponse>((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error('Scraping timeout'));
+      }, timeout);
+
+      this.pending.set(id, { resolve, reject, timer });
+      child.stdin.write(JSON.stringify({ id, ...message }) + '\n');
+    });
+  }
+
+  async search(
+    source: ScraperSource,
+    query: string,
+    platform?: string,
+    maxResults = 16,
+    timeout = 30000
+  ): Promise<Product[]> {
+    const message = await this.send({
+      op: 'search',
+      source,
+      query,
+      platform: platform || null,
+      max_results: maxResults,
+    }, timeout);
+    return message.products || [];
+  }
+
+  async thumbnail(
+    url: string,
+    size: ThumbnailSize = 'small',
+    format: ThumbnailFormat = 'webp',
+    timeout = 15000
+  ): Promise<Thumbnail> {
+    const message = await this.send({ op: 'thumbnail', url, size, format }, timeout);
+    return message.result as Thumbnail;
+  }
+}
+
+// Keep one worker per server process, including across dev-mode reloads
+const globalForWorker = globalThis as unknown as { scraperWorker?: ScraperWorker };
+
+export function getScraperWorker(): ScraperWorker {
+  if (!globalForWorker.scraperWorker) {
+    globalForWorker.scraperWorker = new ScraperWorker();
+  }
+  return globalForWorker.scraperWorker;
+}
+
+/**
+ * Runs a search on one scraper source through the shared worker process
+ *
+ * @param source Scraper source name
+ * @param query Search query
+ * @param platform Optional platform filter
+ * @param timeout Milliseconds to wait before giving up
+ * @returns Promise resolving to an array of products
+ */
+export function runScraper(
+  source: ScraperSource,
+  query: string,
+  platform?: string,
+  timeout?: number
+): Promise<Product[]> {
+  return getScraperWorker().search(source, query, platform, 16, timeout);
+}
@@ -190,6 +190,60 @@ export async function fetchDKOldiesProducts(
   }
 }
 
+/**
+ * Returns the URL of a cached thumbnail for a product image
+ *
+ * Remote store images are resized and cached by /api/image; local images
+ * are returned unchanged.
+ *
+ * @param image Product image URL
+ * @param size Thumbnail size
+ * @returns Thumbnail URL
+ */
+export function thumbnailUrl(image: string, size: 'small' | 'medium' = 'medium'): string {
+  if (!/^https?:\/\//.test(image)) {
+    return image;
+  }
+  const params = new URLSearchParams({ url: image, size });
+  return `/api/image?${params.toString()}`;
+}
+
+/**
+ * Returns a product's price in dollars for sorting and filtering
+ * 
+ * Uses the numeric price_cents emitted by the scrapers and only falls back
+ * to parsing the display string for products without it.
+ * 
+ * @param product Product to read the price from
+ * @returns Price in dollars, or NaN if the product has no price
+ */
+export function productPrice(product: Product): number {
+  if (typeof product.price_cents === 'number') {
+    return product.price_cents / 100;
+  }
+  if (product.price_cents === null) {
+    return NaN;
+  }
+  return parseFloat(product.price.replace(/[^0-9.]/g, ''));
+}
+
+/**
+ * Compares two products by price, keeping unpriced products last
+ * 
+ * @param a First product
+ * @param b Second product
+ * @param descending Sort highest price first
+ * @returns Sort comparator result
+ */
+export function compareByPrice(a: Product, b: Product, descending = false): number {
+  const priceA = productPrice(a);
+  const priceB = productPrice(b);
+  if (isNaN(priceA) || isNaN(priceB)) {
+    return Number(isNaN(priceA)) - Number(isNaN(priceB));
+  }
+  return descending ? priceB - priceA : priceA - priceB;
+}
+
 /**
  * Combines results from multiple sources
  * 
@@ -199,7 +253,8 @@ export async function fetchDKOldiesProducts(
 export function combineProductResults(
   ...scrapedProducts: Product[][]
 ): Product[] {
-  // Create a map to track products by title for deduplication
+  // Dedupe on store and URL: the same title from two stores is two offers,
+  // which scripts/entity_resolution.py can group
   const productMap = new Map<string, Product>();
   
   // Log the number of products from each source
@@ -209,7 +264,7 @@ export function combineProductResults(
   scrapedProducts.forEach((productArray, index) => {
     console.log(`Source ${index} has ${productArray.length} products`);
     productArray.forEach(product => {
-      productMap.set(product.title.toLowerCase(), product);
+      productMap.set(`${product.source}|${product.url}`, product);
     });
   });
   